@@ -3,23 +3,50 @@ import asyncio
 import logging
 import os
 import shutil
+import sqlite3
 import time
-from typing import List, Optional, Tuple, Union
+from datetime import timedelta
+from typing import AsyncGenerator, BinaryIO, List, Optional, Tuple, Union
 
 import pyrogram
 from loguru import logger
 from pyrogram.types import Audio, Document, Photo, Video, VideoNote, Voice
 from rich.logging import RichHandler
 
-from module.app import Application, ChatDownloadConfig, DownloadStatus, TaskNode
+from module.app import (
+    Application,
+    ChatDownloadConfig,
+    DownloadStatus,
+    DownloadTaskItem,
+    TaskNode,
+)
 from module.bot import start_download_bot, stop_download_bot
-from module.download_stat import update_download_status
-from module.get_chat_history_v2 import get_chat_history_v2
+from module.client_pool import ClientPool
+from module.concurrency import (
+    ConcurrencyController,
+    get_concurrency_controller,
+    set_concurrency_controller,
+)
+from module.content_hash import ChunkHasher, hash_download
+from module.download_journal import DownloadJournal
+from module.download_stat import get_total_download_speed, update_download_status
+from module.file_index import get_file_index
+from module.file_reference_cache import get_file_reference_cache
+from module.filter_bounds import get_filter_bounds
+from module.get_chat_history_v2 import (
+    MEDIA_SEARCH_FILTERS,
+    get_chat_history_by_media,
+    get_chat_history_partitioned,
+    get_chat_history_v2,
+    get_message_id_by_date,
+)
 from module.language import _t
+from module.message_fetcher import get_message_fetcher
+from module.parallel_download import download_segmented, get_segment_count
 from module.pyrogram_extension import (
     HookClient,
-    fetch_message,
     get_extension,
+    get_media_dc_id,
     record_download_status,
     report_bot_download_status,
     set_max_concurrent_transmissions,
@@ -27,7 +54,11 @@ from module.pyrogram_extension import (
     update_cloud_upload_stat,
     upload_telegram_chat,
 )
+from module.rate_limiter import RateFamily, RateLimiter, get_rate_limiter
+from module.retry_queue import DelayedRetryQueue, RetryLaterError, get_backoff_delay
+from module.task_queue import PriorityTaskQueue
 from module.web import init_web
+from utils.file_management import is_same_filesystem, link_file
 from utils.format import truncate_filename, validate_title
 from utils.log import LogFilter
 from utils.meta import print_meta
@@ -45,8 +76,12 @@ DATA_FILE_NAME = "data.yaml"
 APPLICATION_NAME = "media_downloader"
 app = Application(CONFIG_NAME, DATA_FILE_NAME, APPLICATION_NAME)
 
-queue: asyncio.Queue = asyncio.Queue()
+queue: PriorityTaskQueue = PriorityTaskQueue()
+retry_queue: DelayedRetryQueue = DelayedRetryQueue()
 RETRY_TIME_OUT = 3
+# suffix of a file being downloaded next to its final path
+PARTIAL_FILE_SUFFIX = ".part"
+MAX_RETRY_ATTEMPTS = 3
 
 logging.getLogger("pyrogram.session.session").addFilter(LogFilter())
 logging.getLogger("pyrogram.client").addFilter(LogFilter())
@@ -76,7 +111,9 @@ def _check_download_finish(media_size: int, download_path: str, ui_file_name: st
             f"{download_size}, {_t('actual')}: "
             f"{media_size}, {_t('file name')}: {ui_file_name}"
         )
-        os.remove(download_path)
+        # keep partial files that can be resumed from their journal
+        if not os.path.exists(DownloadJournal.get_journal_path(download_path)):
+            os.remove(download_path)
         raise pyrogram.errors.exceptions.bad_request_400.BadRequest()
 
 
@@ -95,24 +132,128 @@ def _move_to_download_path(temp_download_path: str, download_path: str):
 
     directory, _ = os.path.split(download_path)
     os.makedirs(directory, exist_ok=True)
-    shutil.move(temp_download_path, download_path)
+    if is_same_filesystem(temp_download_path, download_path):
+        # atomic, the file is never copied
+        os.replace(temp_download_path, download_path)
+    else:
+        shutil.move(temp_download_path, download_path)
 
 
-def _check_timeout(retry: int, _: int):
-    """Check if message download timeout, then add message id into failed_ids
+def _new_hasher(media_size: int) -> Optional[ChunkHasher]:
+    """Create the hasher of a download, `None` if hashing is disabled"""
+    if not app.hash_algorithm:
+        return None
+    return ChunkHasher(app.hash_algorithm, media_size)
 
-    Parameters
-    ----------
-    retry: int
-        Retry download message times
 
-    message_id: int
-        Try to download message 's id
+def _record_downloaded_file(
+    file_name: str,
+    media_size: int,
+    hasher: Optional[ChunkHasher],
+    file_unique_id: Optional[str] = None,
+):
+    """Record a downloaded file and its digest in the file index"""
+    digest = hasher.hexdigest() if hasher else None
+    try:
+        get_file_index().add(
+            file_name,
+            media_size,
+            hasher.name if hasher else None,
+            digest,
+            file_unique_id,
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"record {file_name} failed: {e}")
+
+
+def _link_stored_media(media_obj, file_name: str, ui_file_name: str) -> bool:
+    """Link the stored copy of a media reposted in another chat
+
+    The same media has the same `file_unique_id` in every chat. If it was
+    already downloaded, `file_name` becomes a link to that file instead of
+    a new download.
 
+    Returns
+    -------
+    bool
+        True if `file_name` was linked.
     """
-    if retry == 2:
-        return True
-    return False
+    file_unique_id = getattr(media_obj, "file_unique_id", None)
+    if not app.dedup_link or not isinstance(file_unique_id, str):
+        return False
+
+    try:
+        record = get_file_index().find_by_unique_id(file_unique_id)
+        if not record or record.path == os.path.abspath(file_name):
+            return False
+
+        link_file(record.path, file_name, app.dedup_link)
+        get_file_index().add(
+            file_name, record.size, record.algorithm, record.digest, file_unique_id
+        )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"{_t('link stored media failed')} {ui_file_name}: {e}")
+        return False
+
+    logger.success(f"{_t('Linked stored media')} - {ui_file_name} -> {record.path}")
+    return True
+
+
+def _get_file_unique_id(message: pyrogram.types.Message) -> Optional[str]:
+    """Get the `file_unique_id` of the media of a message"""
+    media_type = getattr(getattr(message, "media", None), "value", None)
+    media_obj = (
+        getattr(message, media_type, None) if isinstance(media_type, str) else None
+    )
+    file_unique_id = getattr(media_obj, "file_unique_id", None)
+    return file_unique_id if isinstance(file_unique_id, str) else None
+
+
+def _get_download_path(file_name: str, temp_file_name: str) -> str:
+    """Get where a media is written while it downloads
+
+    With `download_in_place` it is a partial file next to the final one,
+    renamed when done, so every byte is written to disk only once.
+    Otherwise it is the file in the temp directory.
+    """
+    if app.download_in_place:
+        return file_name + PARTIAL_FILE_SUFFIX
+    return temp_file_name
+
+
+def _check_temp_save_path():
+    """Warn when finished files are copied from the temp directory"""
+    if app.download_in_place:
+        return
+
+    try:
+        same_filesystem = is_same_filesystem(app.temp_save_path, app.save_path)
+    except OSError:
+        return
+
+    if not same_filesystem:
+        warning = _t(
+            "Temp and save paths are on different filesystems, "
+            "every file is copied after download"
+        )
+        logger.warning(f"{warning}: {app.temp_save_path}, {app.save_path}")
+
+
+def _check_search_media_types():
+    """Turn off `search_media_types` when the history can not be searched"""
+    if not app.search_media_types:
+        return
+
+    not_searchable = [it for it in app.media_types if it not in MEDIA_SEARCH_FILTERS]
+    if app.enable_download_txt:
+        not_searchable.append("text")
+
+    if not_searchable:
+        app.search_media_types = False
+        logger.warning(
+            f"{_t('Media types can not be searched, the whole history is read')}: "
+            f"{', '.join(not_searchable)}"
+        )
 
 
 def _can_download(_type: str, file_formats: dict, file_format: Optional[str]) -> bool:
@@ -156,7 +297,12 @@ def _is_exist(file_path: str) -> bool:
     bool
         True if the file exists else False.
     """
-    return not os.path.isdir(file_path) and os.path.exists(file_path)
+    if os.path.isdir(file_path) or not os.path.exists(file_path):
+        return False
+
+    # a file smaller than recorded was cut off while it was written
+    state = app.download_state.find_by_path(file_path)
+    return not state or not state.size or os.path.getsize(file_path) == state.size
 
 
 # pylint: disable = R0912
@@ -263,8 +409,21 @@ async def add_download_task(
     if message.empty:
         return False
     node.download_status[message.id] = DownloadStatus.Downloading
-    await queue.put((message, node))
     node.total_task += 1
+    chat_id = message.chat.id if message.chat else node.chat_id
+    # only a compact descriptor is queued, the message itself waits in the
+    # bounded file reference cache of the account that fetched it, the
+    # worker fetches it again only if it was evicted, went stale or another
+    # account downloads it. `put` waits while the queue is full,
+    # which pauses the history scan until the workers catch up.
+    get_file_reference_cache().put(getattr(message, "_client", None), chat_id, message)
+    item = DownloadTaskItem(
+        chat_id=chat_id,
+        message_id=message.id,
+        node=node,
+        dc_id=get_media_dc_id(message),
+    )
+    await queue.put(item, node.priority, item.dc_id)
     return True
 
 
@@ -307,13 +466,20 @@ async def download_task(
     if app.enable_download_txt and message.text and not message.media:
         download_status, file_name = await save_msg_to_file(app, node.chat_id, message)
 
+    file_size = os.path.getsize(file_name) if file_name else 0
+
     if not node.bot:
-        app.set_download_id(node, message.id, download_status)
+        app.set_download_id(
+            node,
+            message.id,
+            download_status,
+            file_name,
+            file_size,
+            _get_file_unique_id(message),
+        )
 
     node.download_status[message.id] = download_status
 
-    file_size = os.path.getsize(file_name) if file_name else 0
-
     await upload_telegram_chat(
         client,
         node.upload_user if node.upload_user else client,
@@ -359,8 +525,8 @@ async def download_media(
     """
     Download media from Telegram.
 
-    Each of the files to download are retried 3 times with a
-    delay of 5 seconds each.
+    Transient failures raise `RetryLaterError`, the worker parks the task
+    in the delayed retry queue and retries it up to 3 times.
 
     Parameters
     ----------
@@ -395,7 +561,6 @@ async def download_media(
     task_start_time: float = time.time()
     media_size = 0
     _media = None
-    message = await fetch_message(client, message)
     try:
         for _type in media_types:
             _media = getattr(message, _type, None)
@@ -434,64 +599,121 @@ async def download_media(
     if _media is None:
         return DownloadStatus.SkipDownload, None
 
+    return await _download_or_link_media(
+        client,
+        message,
+        node,
+        _media,
+        file_name,
+        temp_file_name,
+        ui_file_name,
+        task_start_time,
+    )
+
+
+async def _download_or_link_media(
+    client: pyrogram.client.Client,
+    message: pyrogram.types.Message,
+    node: TaskNode,
+    _media,
+    file_name: str,
+    temp_file_name: str,
+    ui_file_name: str,
+    task_start_time: float,
+) -> Tuple[DownloadStatus, Optional[str]]:
+    """Link the stored copy of the media, or download it"""
+    if _link_stored_media(_media, file_name, ui_file_name):
+        return DownloadStatus.SuccessDownload, file_name
+
+    media_size = getattr(_media, "file_size", 0)
     message_id = message.id
+    download_path = _get_download_path(file_name, temp_file_name)
 
-    for retry in range(3):
-        try:
-            temp_download_path = await client.download_media(
-                message,
-                file_name=temp_file_name,
-                progress=update_download_status,
-                progress_args=(
-                    message_id,
-                    ui_file_name,
-                    task_start_time,
-                    node,
+    try:
+        await get_rate_limiter(client).acquire(RateFamily.File)
+        progress_args = (
+            message_id,
+            ui_file_name,
+            task_start_time,
+            node,
+            client,
+        )
+        temp_download_path: Union[str, BinaryIO, None]
+        # every chunk is hashed as it arrives, the file is never read again
+        with hash_download(_new_hasher(media_size)) as hasher:
+            # large files go through the journaled segmented download,
+            # so a retry or a restart continues from the verified chunks
+            if media_size >= app.segment_download_min_size:
+                temp_download_path = await download_segmented(
                     client,
-                ),
-            )
-
-            if temp_download_path and isinstance(temp_download_path, str):
-                _check_download_finish(media_size, temp_download_path, ui_file_name)
-                await asyncio.sleep(0.5)
-                _move_to_download_path(temp_download_path, file_name)
-                # TODO: if not exist file size or media
-                return DownloadStatus.SuccessDownload, file_name
-        except pyrogram.errors.exceptions.bad_request_400.BadRequest:
-            logger.warning(
-                f"Message[{message.id}]: {_t('file reference expired, refetching')}..."
-            )
-            await asyncio.sleep(RETRY_TIME_OUT)
-            message = await fetch_message(client, message)
-            if _check_timeout(retry, message.id):
-                # pylint: disable = C0301
-                logger.error(
-                    f"Message[{message.id}]: "
-                    f"{_t('file reference expired for 3 retries, download skipped.')}"
+                    _media.file_id,
+                    media_size,
+                    download_path,
+                    get_segment_count(
+                        media_size,
+                        app.max_download_segments,
+                        app.segment_download_min_size,
+                    ),
+                    progress=update_download_status,
+                    progress_args=progress_args,
                 )
-        except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
-            await asyncio.sleep(wait_err.value)
-            logger.warning("Message[{}]: FlowWait {}", message.id, wait_err.value)
-            _check_timeout(retry, message.id)
-        except TypeError:
-            # pylint: disable = C0301
-            logger.warning(
-                f"{_t('Timeout Error occurred when downloading Message')}[{message.id}], "
-                f"{_t('retrying after')} {RETRY_TIME_OUT} {_t('seconds')}"
-            )
-            await asyncio.sleep(RETRY_TIME_OUT)
-            if _check_timeout(retry, message.id):
-                logger.error(
-                    f"Message[{message.id}]: {_t('Timing out after 3 reties, download skipped.')}"
+            else:
+                temp_download_path = await client.download_media(
+                    message,
+                    file_name=download_path,
+                    progress=update_download_status,
+                    progress_args=progress_args,
                 )
-        except Exception as e:
-            # pylint: disable = C0301
-            logger.error(
-                f"Message[{message.id}]: "
-                f"{_t('could not be downloaded due to following exception')}:\n[{e}].",
-                exc_info=True,
+
+        if temp_download_path and isinstance(temp_download_path, str):
+            _check_download_finish(media_size, temp_download_path, ui_file_name)
+            await asyncio.sleep(0.5)
+            _move_to_download_path(temp_download_path, file_name)
+            _record_downloaded_file(
+                file_name, media_size, hasher, getattr(_media, "file_unique_id", None)
             )
-            break
+            get_concurrency_controller().record_success()
+            # TODO: if not exist file size or media
+            return DownloadStatus.SuccessDownload, file_name
+    except pyrogram.errors.exceptions.bad_request_400.FileReferenceExpired as e:
+        get_concurrency_controller().record_error()
+        logger.warning(
+            f"Message[{message.id}]: {_t('file reference expired, refetching')}..."
+        )
+        # the worker fetches the message again before the next attempt
+        get_file_reference_cache().invalidate(
+            client, message.chat.id if message.chat else node.chat_id, message.id
+        )
+        raise RetryLaterError(
+            reason=_t("file reference expired for 3 retries, download skipped.")
+        ) from e
+    except pyrogram.errors.exceptions.bad_request_400.BadRequest as e:
+        get_concurrency_controller().record_error()
+        logger.warning(f"Message[{message.id}]: {e}")
+        raise RetryLaterError(reason=str(e)) from e
+    except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
+        get_concurrency_controller().record_flood_wait()
+        logger.warning("Message[{}]: FlowWait {}", message.id, wait_err.value)
+        get_rate_limiter(client).flood_wait(RateFamily.File, wait_err.value)
+        raise RetryLaterError(
+            wait_err.value, f"FlowWait {wait_err.value}"
+        ) from wait_err
+    except TypeError as e:
+        get_concurrency_controller().record_error()
+        logger.warning(
+            f"{_t('Timeout Error occurred when downloading Message')}[{message.id}]"
+        )
+        raise RetryLaterError(
+            reason=_t("Timing out after 3 reties, download skipped.")
+        ) from e
+    except Exception as e:
+        get_concurrency_controller().record_error()
+        # pylint: disable = C0301
+        logger.error(
+            f"Message[{message.id}]: "
+            f"{_t('could not be downloaded due to following exception')}:\n[{e}].",
+            exc_info=True,
+        )
 
     return DownloadStatus.FailedDownload, None
 
@@ -516,58 +738,292 @@ def _check_config() -> bool:
         logger.exception(f"load config error: {e}")
         return False
 
+    _check_temp_save_path()
+    _check_search_media_types()
     return True
 
 
-async def worker(client: pyrogram.client.Client):
-    """Work for download task"""
+async def _finish_without_download(
+    node: TaskNode, message_id: int, download_status: DownloadStatus
+):
+    """Finish a queued task whose message could not be downloaded"""
+    if not node.bot:
+        app.set_download_id(node, message_id, download_status)
+
+    node.download_status[message_id] = download_status
+
+    await report_bot_download_status(node.bot, node, download_status)
+
+
+async def _retry_later(item: DownloadTaskItem, error: RetryLaterError):
+    """Park a failed task in the retry queue, or finish it as failed"""
+    item.attempts += 1
+    if item.attempts >= MAX_RETRY_ATTEMPTS:
+        logger.error(f"Message[{item.message_id}]: {error.reason}")
+        await _finish_without_download(
+            item.node, item.message_id, DownloadStatus.FailedDownload
+        )
+        return
+
+    delay = error.delay
+    if delay is None:
+        delay = get_backoff_delay(item.attempts, RETRY_TIME_OUT)
+
+    logger.warning(
+        f"Message[{item.message_id}]: "
+        f"{_t('retrying after')} {delay:.1f} {_t('seconds')}"
+    )
+    await retry_queue.put(item, delay)
+
+
+async def _requeue_retry_tasks():
+    """Move due tasks from the retry queue back to the download queue"""
+    while True:
+        item: DownloadTaskItem = await retry_queue.get()
+        if item.node.is_stop_transmission:
+            continue
+        await queue.put(item, item.node.priority, item.dc_id)
+
+
+async def _save_checkpoints():
+    """Save the progress while downloading, a crash loses one checkpoint at most"""
     while app.is_running:
+        await asyncio.sleep(1)
+        if not app.need_checkpoint():
+            continue
         try:
-            item = await queue.get()
-            message = item[0]
-            node: TaskNode = item[1]
+            app.checkpoint()
+        except Exception as e:
+            logger.warning(f"{_t('save checkpoint failed')}: {e}")
 
-            if node.is_stop_transmission:
-                continue
 
-            if node.client:
-                await download_task(node.client, message, node)
-            else:
-                await download_task(client, message, node)
+# errors telling an account can not see a chat
+_CHAT_ACCESS_ERRORS = (
+    pyrogram.errors.PeerIdInvalid,
+    pyrogram.errors.ChannelPrivate,
+    pyrogram.errors.ChannelInvalid,
+    pyrogram.errors.Forbidden,
+)
+
+# errors of a message fetch that are gone after a while
+_TRANSIENT_FETCH_ERRORS = (
+    pyrogram.errors.InternalServerError,
+    pyrogram.errors.ServiceUnavailable,
+    asyncio.TimeoutError,
+    OSError,
+)
+
+
+async def _fetch_task_message(
+    client_pool: ClientPool, item: DownloadTaskItem
+) -> Tuple[pyrogram.Client, Optional[pyrogram.types.Message]]:
+    """Fetch the message of a task through an account that can see its chat
+
+    The returned account is borrowed from `client_pool`, the caller
+    releases it. FloodWait and other transient errors raise
+    `RetryLaterError`.
+    """
+    if item.node.upload_telegram_chat_id:
+        # the main account forwards, it is a member of the target chat
+        # and its limiter holds the forward budget
+        download_client = client_pool.acquire_main()
+    else:
+        download_client = client_pool.acquire(item.chat_id)
+    while True:
+        is_main_client = download_client is client_pool.main_client
+        try:
+            message = await get_file_reference_cache().fetch(
+                download_client, item.chat_id, item.message_id
+            )
+        except pyrogram.errors.FloodWait as wait_err:
+            client_pool.release(download_client)
+            if is_main_client:
+                raise RetryLaterError(
+                    wait_err.value, f"FlowWait {wait_err.value}"
+                ) from wait_err
+            # the account is paused now, the pool selects another one
+            download_client = client_pool.acquire(item.chat_id)
+            continue
+        except _CHAT_ACCESS_ERRORS:
+            client_pool.release(download_client)
+            if is_main_client:
+                raise
+            # the chat is not visible to this account
+            client_pool.hide_chat(download_client, item.chat_id)
+            download_client = client_pool.acquire(item.chat_id)
+            continue
+        except pyrogram.errors.BadRequest:
+            if is_main_client:
+                client_pool.release(download_client)
+                raise
+            message = None
+        except _TRANSIENT_FETCH_ERRORS as e:
+            client_pool.release(download_client)
+            raise RetryLaterError(reason=str(e)) from e
+        except Exception:
+            client_pool.release(download_client)
+            raise
+
+        if (message and not message.empty) or is_main_client:
+            return download_client, message
+
+        # the message may just be deleted, the main account decides
+        client_pool.release(download_client)
+        download_client = client_pool.acquire_main()
+
+
+async def worker(client_pool: ClientPool):
+    """Work for download task
+
+    Only as many workers as the concurrency controller allows are active,
+    the others wait on its worker semaphore. Every task is downloaded by an
+    account of `client_pool`, bot tasks by their own client and forward
+    tasks by the main account.
+    """
+    controller = get_concurrency_controller()
+    while app.is_running:
+        try:
+            async with controller.worker_semaphore:
+                item: DownloadTaskItem = await queue.get()
+                node: TaskNode = item.node
+
+                if node.is_stop_transmission:
+                    continue
+
+                pool = ClientPool([node.client]) if node.client else client_pool
+
+                try:
+                    download_client, message = await _fetch_task_message(pool, item)
+                except RetryLaterError as e:
+                    await _retry_later(item, e)
+                    continue
+                except Exception as e:
+                    error = _t("could not be downloaded due to following exception")
+                    logger.error(f"Message[{item.message_id}]: {error}:\n[{e}].")
+                    await _finish_without_download(
+                        node, item.message_id, DownloadStatus.FailedDownload
+                    )
+                    continue
+
+                try:
+                    if not message or message.empty:
+                        await _finish_without_download(
+                            node, item.message_id, DownloadStatus.SkipDownload
+                        )
+                        continue
+
+                    try:
+                        await download_task(download_client, message, node)
+                    except RetryLaterError as e:
+                        await _retry_later(item, e)
+                finally:
+                    pool.release(download_client)
         except Exception as e:
             logger.exception(f"{e}")
 
 
+async def _get_history_range(
+    client: pyrogram.Client,
+    chat_download_config: ChatDownloadConfig,
+    node: TaskNode,
+) -> Optional[Tuple[int, int]]:
+    """Get the ids to read the history of a chat from and to
+
+    The range is narrowed to the ids and dates `download_filter` can match,
+    a date is turned into an id with one query. `None` if no message can
+    match, a `max_id` of 0 is unbounded.
+    """
+    offset_id = chat_download_config.last_read_message_id
+    max_id = node.end_offset_id
+    bounds = get_filter_bounds(chat_download_config.download_filter)
+
+    if bounds.max_date:
+        # the newest message sent at `max_date` at the latest
+        last_id = await get_message_id_by_date(
+            client, node.chat_id, bounds.max_date + timedelta(seconds=1)
+        )
+        bounds.max_id = _min_bound(bounds.max_id, last_id)
+    if bounds.min_date:
+        first_id = (
+            await get_message_id_by_date(client, node.chat_id, bounds.min_date) + 1
+        )
+        bounds.min_id = max(bounds.min_id or 0, first_id)
+
+    if bounds.min_id:
+        offset_id = max(offset_id, bounds.min_id)
+    if bounds.max_id is not None:
+        if bounds.max_id < 1:
+            return None
+        max_id = _min_bound(max_id, bounds.max_id)
+
+    if max_id and offset_id > max_id:
+        return None
+    return offset_id, max_id
+
+
+async def _no_messages() -> AsyncGenerator[pyrogram.types.Message, None]:
+    """History of a chat no message of the download filter is in"""
+    return
+    yield  # pylint: disable = W0101
+
+
+def _min_bound(left: Optional[int], right: int) -> int:
+    """The lower of two upper bounds, `left` unbounded if `None` or 0"""
+    return min(left, right) if left else right
+
+
 async def download_chat_task(
     client: pyrogram.Client,
     chat_download_config: ChatDownloadConfig,
     node: TaskNode,
 ):
     """Download all task"""
-    messages_iter = get_chat_history_v2(
-        client,
-        node.chat_id,
-        limit=node.limit,
-        max_id=node.end_offset_id,
-        offset_id=chat_download_config.last_read_message_id,
-        reverse=True,
-    )
+    history_range = await _get_history_range(client, chat_download_config, node)
+    offset_id, max_id = history_range or (0, 0)
+    messages_iter: AsyncGenerator[pyrogram.types.Message, None]
+    if not history_range:
+        messages_iter = _no_messages()
+    elif app.search_media_types and not node.limit:
+        messages_iter = get_chat_history_by_media(
+            client,
+            node.chat_id,
+            app.media_types,
+            offset_id=offset_id,
+            max_id=max_id,
+        )
+    elif app.history_partitions > 1 and not node.limit:
+        # ordered, the watermark follows the history in ascending order
+        messages_iter = get_chat_history_partitioned(
+            client,
+            node.chat_id,
+            offset_id=offset_id,
+            max_id=max_id,
+            partitions=app.history_partitions,
+        )
+    else:
+        messages_iter = get_chat_history_v2(
+            client,
+            node.chat_id,
+            limit=node.limit,
+            max_id=max_id,
+            offset_id=offset_id,
+            reverse=True,
+        )
 
     chat_download_config.node = node
 
     if chat_download_config.ids_to_retry:
         logger.info(f"{_t('Downloading files failed during last run')}...")
-        skipped_messages: list = await client.get_messages(  # type: ignore
-            chat_id=node.chat_id, message_ids=chat_download_config.ids_to_retry
-        )
-
-        for message in skipped_messages:
+        async for message in get_message_fetcher().iter_messages(
+            client, node.chat_id, chat_download_config.ids_to_retry
+        ):
             await add_download_task(message, node)
 
-    async for message in messages_iter:  # type: ignore
+    async for message in messages_iter:
+        chat_download_config.watermark.scan(message.id)
         meta_data = MetaData()
 
-        caption = message.caption
+        caption: Optional[str] = message.caption
         if caption:
             caption = validate_title(caption)
             app.set_caption_name(node.chat_id, message.media_group_id, caption)
@@ -579,11 +1035,16 @@ async def download_chat_task(
         set_meta_data(meta_data, message, caption)
 
         if app.need_skip_message(chat_download_config, message.id):
+            # ids to retry are downloaded on their own and stay in
+            # ids_to_retry until they succeed, the watermark moves past them
+            chat_download_config.watermark.finish(message.id)
             continue
 
         if app.exec_filter(chat_download_config, meta_data):
-            await add_download_task(message, node)
+            if not await add_download_task(message, node):
+                chat_download_config.watermark.finish(message.id)
         else:
+            chat_download_config.watermark.finish(message.id)
             node.download_status[message.id] = DownloadStatus.SkipDownload
             if message.media_group_id:
                 await upload_telegram_chat(
@@ -600,16 +1061,40 @@ async def download_chat_task(
     node.is_running = True
 
 
-async def download_all_chat(client: pyrogram.Client):
-    """Download All chat"""
-    for key, value in app.chat_download_config.items():
-        value.node = TaskNode(chat_id=key)
+async def _download_chat(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    chat_download_config: ChatDownloadConfig,
+    semaphore: asyncio.Semaphore,
+):
+    """Read the history of a configured chat, an error only stops this chat"""
+    async with semaphore:
+        chat_download_config.node = TaskNode(
+            chat_id=chat_id, priority=chat_download_config.priority
+        )
         try:
-            await download_chat_task(client, value, value.node)
+            await download_chat_task(
+                client, chat_download_config, chat_download_config.node
+            )
         except Exception as e:
-            logger.warning(f"Download {key} error: {e}")
+            logger.warning(f"Download {chat_id} error: {e}")
         finally:
-            value.need_check = True
+            chat_download_config.need_check = True
+
+
+async def download_all_chat(client: pyrogram.Client):
+    """Download All chat
+
+    Up to `max_scan_chats` chats read their history at the same time, so a
+    long or slow chat does not hold back the others.
+    """
+    semaphore = asyncio.Semaphore(max(1, app.max_scan_chats))
+    await asyncio.gather(
+        *(
+            _download_chat(client, key, value, semaphore)
+            for key, value in app.chat_download_config.items()
+        )
+    )
 
 
 async def run_until_all_task_finish():
@@ -646,8 +1131,37 @@ async def stop_server(client: pyrogram.Client):
     await client.stop()
 
 
+def _create_concurrency_controller() -> ConcurrencyController:
+    """Create the concurrency controller from the config"""
+    if app.adaptive_concurrency:
+        return ConcurrencyController(
+            app.max_download_task,
+            max(app.max_download_task, app.max_download_task_limit),
+            app.max_concurrent_transmissions,
+            max(
+                app.max_concurrent_transmissions,
+                app.max_concurrent_transmissions_limit,
+            ),
+        )
+
+    return ConcurrencyController(
+        app.max_download_task,
+        app.max_download_task,
+        app.max_concurrent_transmissions,
+        app.max_concurrent_transmissions,
+    )
+
+
 def main():
     """Main function of the downloader."""
+    # pylint: disable = W0603
+    global queue
+    queue = PriorityTaskQueue(
+        app.download_queue_size, app.task_priority_aging, app.dc_batch_size
+    )
+
+    get_file_index().open(app.db_file_path)
+
     tasks = []
     client = HookClient(
         "media_downloader",
@@ -658,20 +1172,56 @@ def main():
         start_timeout=app.start_timeout,
         no_updates=True,
     )
+    # extra accounts only download, each one is rate limited on its own
+    download_clients = [
+        HookClient(
+            name,
+            api_id=app.api_id,
+            api_hash=app.api_hash,
+            proxy=app.proxy,
+            workdir=app.session_file_path,
+            start_timeout=app.start_timeout,
+            no_updates=True,
+            rate_limiter=RateLimiter(),
+        )
+        for name in app.download_accounts
+    ]
+    started_download_clients: List[pyrogram.Client] = []
     try:
         app.pre_run()
         init_web(app)
 
-        set_max_concurrent_transmissions(client, app.max_concurrent_transmissions)
+        controller = _create_concurrency_controller()
+        set_concurrency_controller(controller)
+        for it in [client] + download_clients:
+            set_max_concurrent_transmissions(
+                it, app.max_concurrent_transmissions, controller
+            )
 
         app.loop.run_until_complete(start_server(client))
+        for it in download_clients:
+            app.loop.run_until_complete(start_server(it))
+            started_download_clients.append(it)
         logger.success(_t("Successfully started (Press Ctrl+C to stop)"))
 
+        client_pool = ClientPool(
+            [client] + download_clients, app.download_account_policy
+        )
+
         app.loop.create_task(download_all_chat(client))
-        for _ in range(app.max_download_task):
-            task = app.loop.create_task(worker(client))
+        tasks.append(app.loop.create_task(_requeue_retry_tasks()))
+        tasks.append(app.loop.create_task(_save_checkpoints()))
+        for _ in range(controller.max_workers):
+            task = app.loop.create_task(worker(client_pool))
             tasks.append(task)
 
+        if app.adaptive_concurrency:
+            tasks.append(
+                app.loop.create_task(
+                    controller.run(get_total_download_speed, lambda: app.is_running)
+                )
+            )
+
         if app.bot_token:
             app.loop.run_until_complete(
                 start_download_bot(app, client, add_download_task, download_chat_task)
@@ -686,12 +1236,20 @@ def main():
         if app.bot_token:
             app.loop.run_until_complete(stop_download_bot())
         app.loop.run_until_complete(stop_server(client))
+        for it in started_download_clients:
+            app.loop.run_until_complete(stop_server(it))
         for task in tasks:
             task.cancel()
         logger.info(_t("Stopped!"))
         # check_for_updates(app.proxy)
         logger.info(f"{_t('update config')}......")
-        app.update_config()
+        try:
+            app.update_config()
+        except Exception as e:
+            # the databases are still closed, their state is committed
+            logger.exception("{}", e)
+        app.download_state.close()
+        get_file_index().close()
         logger.success(
             f"{_t('Updated last read message_id to config file')},"
             f"{_t('total download')} {app.total_download_task}, "
@@ -2,6 +2,7 @@
 
 import asyncio
 import os
+import sqlite3
 import time
 from asyncio import Lock
 from concurrent.futures import ThreadPoolExecutor
@@ -13,10 +14,19 @@ from typing import Callable, List, Optional, Union
 from loguru import logger
 from ruamel import yaml
 
+from module.client_pool import ClientPolicy
 from module.cloud_drive import CloudDrive, CloudDriveConfig
+from module.content_hash import new_hash
+from module.download_state import DownloadStateStore
+from module.file_reference_cache import get_file_reference_cache
 from module.filter import Filter
+from module.interval_set import IntervalSet
 from module.language import Language, set_language
-from utils.format import replace_date_time, validate_title
+from module.rate_limiter import RateFamily, get_rate_limiter
+from module.status_map import StatusMap
+from module.watermark import MessageWatermark
+from utils.file_management import atomic_write
+from utils.format import get_byte_from_str, replace_date_time, validate_title
 from utils.meta_data import MetaData
 
 _yaml = yaml.YAML()
@@ -32,6 +42,13 @@ class DownloadStatus(Enum):
     Downloading = 4
 
 
+# messages in the download state that are not retried
+_FINISHED_STATUS = (
+    DownloadStatus.SkipDownload.value,
+    DownloadStatus.SuccessDownload.value,
+)
+
+
 class ForwardStatus(Enum):
     """Forward status"""
 
@@ -60,6 +77,14 @@ class TaskType(Enum):
     ListenForward = 3
 
 
+class TaskPriority(Enum):
+    """Task priority, the smaller value is downloaded first"""
+
+    Interactive = 1
+    ListenForward = 2
+    Bulk = 3
+
+
 class QueryHandler(Enum):
     """Query handler"""
 
@@ -118,7 +143,7 @@ class QueryHandlerStr:
 class TaskNode:
     """Task node"""
 
-    # pylint: disable = R0913
+    # pylint: disable = R0913, R0914
     def __init__(
         self,
         chat_id: Union[int, str],
@@ -135,6 +160,7 @@ class TaskNode:
         task_type: TaskType = TaskType.Download,
         task_id: int = 0,
         topic_id: int = 0,
+        priority: Optional[TaskPriority] = None,
     ):
         self.chat_id = chat_id
         self.from_user_id = from_user_id
@@ -169,12 +195,24 @@ class TaskNode:
         self.is_stop_transmission = False
         self.media_group_ids: dict = {}
         self.media_group_ids_lock: Lock = Lock()
-        self.download_status: dict = {}
-        self.upload_status: dict = {}
+        self.download_status: StatusMap = StatusMap(DownloadStatus)
+        self.upload_status: StatusMap = StatusMap(UploadStatus)
         self.upload_stat_dict: dict = {}
         self.topic_id = topic_id
         self.reply_to_message = None
         self.cloud_drive_upload_stat_dict: dict = {}
+        self.priority = priority if priority else self.default_priority()
+
+    def default_priority(self) -> TaskPriority:
+        """Single message bot requests are interactive, listen forward tasks
+        keep up with new messages, everything else is a bulk download"""
+        if self.task_type is TaskType.ListenForward:
+            return TaskPriority.ListenForward
+
+        if self.bot and self.limit == 1:
+            return TaskPriority.Interactive
+
+        return TaskPriority.Bulk
 
     def skip_msg_id(self, msg_id: int):
         """Skip if message id out of range"""
@@ -243,70 +281,35 @@ class TaskNode:
         return False
 
 
-class LimitCall:
-    """Limit call"""
-
-    def __init__(
-        self,
-        max_limit_call_times: int = 0,
-        limit_call_times: int = 0,
-        last_call_time: float = 0,
-    ):
-        """
-        Initializes the object with the given parameters.
-
-        Args:
-            max_limit_call_times (int): The maximum limit of call times allowed.
-            limit_call_times (int): The current limit of call times.
-            last_call_time (int): The time of the last call.
-
-        Returns:
-            None
-        """
-        self.max_limit_call_times = max_limit_call_times
-        self.limit_call_times = limit_call_times
-        self.last_call_time = last_call_time
-
-    async def wait(self, node: TaskNode):
-        """
-        Wait for a certain period of time before continuing execution.
-
-        This function does not take any parameters.
-
-        This function does not return anything.
-        """
-        while True:
-            now = time.time()
-            time_span = now - self.last_call_time
-            if node.is_stop_transmission:
-                break
-
-            if time_span > 60:
-                self.limit_call_times = 0
-                self.last_call_time = now
+@dataclass
+class DownloadTaskItem:
+    """Download queue item
 
-            if self.limit_call_times + 1 <= self.max_limit_call_times:
-                self.limit_call_times += 1
-                break
+    Only the ids are kept while waiting in the queue, the message is
+    fetched again by the worker right before it is downloaded.
+    """
 
-            # logger.debug("Waiting for 10 seconds...")
-            await asyncio.sleep(1)
+    chat_id: Union[int, str]
+    message_id: int
+    node: TaskNode
+    attempts: int = 0
+    dc_id: int = 0
 
 
 class ChatDownloadConfig:
     """Chat Message Download Status"""
 
     def __init__(self):
-        self.ids_to_retry_dict: dict = {}
-
         # need storage
         self.download_filter: str = None
-        self.ids_to_retry: list = []
+        self.ids_to_retry: IntervalSet = IntervalSet()
         self.last_read_message_id = 0
+        self.watermark: MessageWatermark = MessageWatermark()
         self.total_task: int = 0
         self.finish_task: int = 0
         self.need_check: bool = False
         self.upload_telegram_chat_id: Union[int, str] = None
+        self.priority: Optional[TaskPriority] = None
         self.node: TaskNode = TaskNode(0)
 
 
@@ -398,6 +401,7 @@ class Application:
         self.web_host: str = "0.0.0.0"
         self.web_port: int = 5000
         self.max_download_task: int = 5
+        self._init_download_tuning()
         self.language = Language.EN
         self.after_upload_telegram_delete: bool = True
         self.web_login_secret: str = ""
@@ -417,7 +421,6 @@ class Application:
             yaml.comments.CommentedSeq([])
         )
         self.group_add_advertisement: dict = {}
-        self.forward_limit_call = LimitCall(max_limit_call_times=33)
 
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
@@ -426,6 +429,34 @@ class Application:
             min(32, (os.cpu_count() or 0) + 4), thread_name_prefix="multi_task"
         )
 
+    def _init_download_tuning(self):
+        """Defaults of the download tuning and rate limit config"""
+        self.forward_limit: int = 33
+        self.forward_chat_limit: int = 0
+        self.db_file_path = os.path.join(os.path.abspath("."), "sessions", "tdl.db")
+        self.download_state = DownloadStateStore()
+        self.adaptive_concurrency: bool = False
+        self.max_download_task_limit: int = 10
+        self.max_concurrent_transmissions_limit: int = 50
+        self.download_queue_size: int = 1000
+        self.max_scan_chats: int = 3
+        self.history_partitions: int = 1
+        self.search_media_types: bool = False
+        self.task_priority_aging: int = 60
+        self.dc_batch_size: int = 10
+        self.checkpoint_interval: int = 60
+        self.checkpoint_tasks: int = 100
+        self.last_checkpoint_time: float = time.time()
+        self.unsaved_task_count: int = 0
+        self.file_reference_ttl: int = 1800
+        self.download_accounts: list = []
+        self.download_account_policy = ClientPolicy.LeastLoaded
+        self.max_download_segments: int = 4
+        self.download_in_place: bool = False
+        self.hash_algorithm: str = "sha256"
+        self.dedup_link: str = ""
+        self.segment_download_min_size: int = 32 * 1024 * 1024
+
     # pylint: disable = R0915
     def assign_config(self, _config: dict) -> bool:
         """assign config from str.
@@ -509,6 +540,8 @@ class Application:
             "max_concurrent_transmissions", self.max_concurrent_transmissions
         )
 
+        self._assign_download_tuning(_config)
+
         language = _config.get("language", "EN")
 
         try:
@@ -578,11 +611,18 @@ class Application:
         forward_limit = _config.get("forward_limit", None)
         if forward_limit:
             try:
-                forward_limit = int(forward_limit)
-                self.forward_limit_call.max_limit_call_times = forward_limit
+                self.forward_limit = int(forward_limit)
             except ValueError:
                 pass
 
+        self.forward_chat_limit = get_config(
+            _config, "forward_chat_limit", self.forward_chat_limit, int
+        )
+
+        get_rate_limiter().set_rate(
+            RateFamily.Forward, self.forward_limit, self.forward_chat_limit
+        )
+
         if _config.get("chat"):
             chat = _config["chat"]
             for item in chat:
@@ -599,6 +639,16 @@ class Application:
                     ].upload_telegram_chat_id = item.get(
                         "upload_telegram_chat_id", None
                     )
+                    if item.get("priority"):
+                        try:
+                            self.chat_download_config[
+                                item["chat_id"]
+                            ].priority = TaskPriority[item["priority"]]
+                        except KeyError:
+                            logger.warning(
+                                f"{item['chat_id']} priority {item['priority']} "
+                                f"is not one of {[it.name for it in TaskPriority]}"
+                            )
         elif _config.get("chat_id"):
             # Compatible with lower versions
             self._chat_id = _config["chat_id"]
@@ -606,13 +656,9 @@ class Application:
             self.chat_download_config[self._chat_id] = ChatDownloadConfig()
 
             if _config.get("ids_to_retry"):
-                self.chat_download_config[self._chat_id].ids_to_retry = _config[
-                    "ids_to_retry"
-                ]
-                for it in self.chat_download_config[self._chat_id].ids_to_retry:
-                    self.chat_download_config[self._chat_id].ids_to_retry_dict[
-                        it
-                    ] = True
+                self.chat_download_config[
+                    self._chat_id
+                ].ids_to_retry = IntervalSet.load(_config["ids_to_retry"])
 
             self.chat_download_config[self._chat_id].last_read_message_id = _config[
                 "last_read_message_id"
@@ -641,9 +687,117 @@ class Application:
             self.chat_download_config[key].download_filter = replace_date_time(
                 value.download_filter
             )
+            # the history is read from `last_read_message_id` on
+            value.watermark = MessageWatermark(max(value.last_read_message_id - 1, 0))
 
         return True
 
+    def _assign_download_tuning(self, _config: dict):
+        """Assign the download tuning config, unknown values keep the default
+
+        Parameters
+        ----------
+        _config: dict
+            application config dict
+        """
+        self.download_queue_size = get_config(
+            _config, "download_queue_size", self.download_queue_size, int
+        )
+
+        self.max_scan_chats = get_config(
+            _config, "max_scan_chats", self.max_scan_chats, int
+        )
+
+        self.history_partitions = get_config(
+            _config, "history_partitions", self.history_partitions, int
+        )
+
+        self.search_media_types = get_config(
+            _config, "search_media_types", self.search_media_types, bool
+        )
+
+        self.task_priority_aging = get_config(
+            _config, "task_priority_aging", self.task_priority_aging, int
+        )
+        self.dc_batch_size = get_config(
+            _config, "dc_batch_size", self.dc_batch_size, int
+        )
+
+        self.file_reference_ttl = get_config(
+            _config, "file_reference_ttl", self.file_reference_ttl, int
+        )
+        get_file_reference_cache().ttl = self.file_reference_ttl
+
+        self.download_accounts = [
+            str(it) for it in _config.get("download_accounts", None) or []
+        ]
+
+        download_account_policy = _config.get("download_account_policy", None)
+        if download_account_policy:
+            try:
+                self.download_account_policy = ClientPolicy[download_account_policy]
+            except KeyError:
+                logger.warning(
+                    f"unknown download_account_policy {download_account_policy}"
+                )
+
+        self.adaptive_concurrency = get_config(
+            _config, "adaptive_concurrency", self.adaptive_concurrency, bool
+        )
+
+        self.max_download_task_limit = get_config(
+            _config, "max_download_task_limit", self.max_download_task * 2, int
+        )
+
+        self.max_concurrent_transmissions_limit = get_config(
+            _config,
+            "max_concurrent_transmissions_limit",
+            self.max_concurrent_transmissions * 2,
+            int,
+        )
+
+        self.max_download_segments = get_config(
+            _config, "max_download_segments", self.max_download_segments, int
+        )
+
+        segment_download_min_size = _config.get("segment_download_min_size", None)
+        if isinstance(segment_download_min_size, int):
+            self.segment_download_min_size = segment_download_min_size
+        elif isinstance(segment_download_min_size, str):
+            self.segment_download_min_size = (
+                get_byte_from_str(segment_download_min_size)
+                or self.segment_download_min_size
+            )
+
+        self.download_in_place = get_config(
+            _config, "download_in_place", self.download_in_place, bool
+        )
+
+        self.db_file_path = get_config(_config, "db_file_path", self.db_file_path, str)
+
+        self.checkpoint_interval = get_config(
+            _config, "checkpoint_interval", self.checkpoint_interval, int
+        )
+        self.checkpoint_tasks = get_config(
+            _config, "checkpoint_tasks", self.checkpoint_tasks, int
+        )
+
+        dedup_link = _config.get("dedup_link", self.dedup_link) or ""
+        if dedup_link in ("", "hardlink", "reflink", "symlink"):
+            self.dedup_link = dedup_link
+        else:
+            logger.warning(f"unknown dedup_link {dedup_link}")
+
+        hash_algorithm = _config.get("hash_algorithm", self.hash_algorithm)
+        if hash_algorithm:
+            try:
+                new_hash(hash_algorithm)
+                self.hash_algorithm = hash_algorithm
+            except ValueError as e:
+                logger.warning(f"hash_algorithm {hash_algorithm}: {e}")
+        else:
+            self.hash_algorithm = ""
+
     def assign_app_data(self, app_data: dict) -> bool:
         """Assign config from str.
 
@@ -658,13 +812,9 @@ class Application:
         """
         if app_data.get("ids_to_retry"):
             if self._chat_id:
-                self.chat_download_config[self._chat_id].ids_to_retry = app_data[
-                    "ids_to_retry"
-                ]
-                for it in self.chat_download_config[self._chat_id].ids_to_retry:
-                    self.chat_download_config[self._chat_id].ids_to_retry_dict[
-                        it
-                    ] = True
+                self.chat_download_config[
+                    self._chat_id
+                ].ids_to_retry = IntervalSet.load(app_data["ids_to_retry"])
                 self.app_data.pop("ids_to_retry")
         else:
             if app_data.get("chat"):
@@ -675,15 +825,32 @@ class Application:
                         and chat["chat_id"] in self.chat_download_config
                     ):
                         chat_id = chat["chat_id"]
-                        self.chat_download_config[chat_id].ids_to_retry = chat.get(
-                            "ids_to_retry", []
+                        # older versions saved a list of ids
+                        self.chat_download_config[
+                            chat_id
+                        ].ids_to_retry = IntervalSet.load(chat.get("ids_to_retry", []))
+                        watermark = self.chat_download_config[chat_id].watermark
+                        self.chat_download_config[chat_id].watermark = MessageWatermark(
+                            watermark.watermark, chat.get("finished_ids", [])
                         )
-                        for it in self.chat_download_config[chat_id].ids_to_retry:
-                            self.chat_download_config[chat_id].ids_to_retry_dict[
-                                it
-                            ] = True
+
+        self.load_download_state()
         return True
 
+    def load_download_state(self):
+        """Load the ids to retry of every chat from the download state
+
+        Ids to retry of older versions, kept in yaml, are moved into the
+        download state first.
+        """
+        for key, value in self.chat_download_config.items():
+            self.download_state.add_message_ids(
+                key, value.ids_to_retry, DownloadStatus.FailedDownload.value
+            )
+            value.ids_to_retry = IntervalSet.load(
+                self.download_state.get_message_ids(key, _FINISHED_STATUS)
+            )
+
     async def upload_file(
         self,
         local_file_path: str,
@@ -803,10 +970,11 @@ class Application:
         -------
         bool
         """
-        if message_id in download_config.ids_to_retry_dict:
+        if download_config.watermark.is_finished(message_id):
             return True
 
-        return False
+        # ids to retry are fetched on their own before the history
+        return message_id in download_config.ids_to_retry
 
     def exec_filter(self, download_config: ChatDownloadConfig, meta_data: MetaData):
         """
@@ -843,33 +1011,37 @@ class Application:
         # pylint: disable = R1733
         for key, value in self.chat_download_config.items():
             # pylint: disable = W0201
-            unfinished_ids = set(value.ids_to_retry)
-
-            for it in value.ids_to_retry:
+            # downloads stopped before they finished are above the
+            # watermark and downloaded again when the history is read
+            unfinished_ids = [
+                it
+                for it in value.ids_to_retry
                 if value.node.download_status.get(
                     it, DownloadStatus.FailedDownload
-                ) in [DownloadStatus.SuccessDownload, DownloadStatus.SkipDownload]:
-                    unfinished_ids.remove(it)
-
-            for _idx, _value in value.node.download_status.items():
-                if _value not in (
-                    DownloadStatus.SuccessDownload,
-                    DownloadStatus.SkipDownload,
-                ):
-                    unfinished_ids.add(_idx)
+                ).value
+                not in _FINISHED_STATUS
+            ]
 
-            self.chat_download_config[key].ids_to_retry = list(unfinished_ids)
+            self.download_state.add_message_ids(
+                key, unfinished_ids, DownloadStatus.FailedDownload.value
+            )
+            self.chat_download_config[key].ids_to_retry = IntervalSet.load(
+                self.download_state.get_message_ids(key, _FINISHED_STATUS)
+            )
 
             if idx >= len(self.app_data["chat"]):
                 self.app_data["chat"].append({})
 
             if value.finish_task:
                 self.config["chat"][idx]["last_read_message_id"] = (
-                    value.last_read_message_id + 1
+                    value.watermark.watermark + 1
                 )
 
             self.app_data["chat"][idx]["chat_id"] = key
-            self.app_data["chat"][idx]["ids_to_retry"] = value.ids_to_retry
+            self.app_data["chat"][idx]["ids_to_retry"] = value.ids_to_retry.intervals
+            self.app_data["chat"][idx][
+                "finished_ids"
+            ] = value.watermark.finished.intervals
             idx += 1
 
         self.config["save_path"] = self.save_path
@@ -897,13 +1069,39 @@ class Application:
         self.config["group_add_advertisement"] = self.group_add_advertisement
 
         if immediate:
-            with open(self.config_file, "w", encoding="utf-8") as yaml_file:
+            with atomic_write(self.config_file) as yaml_file:
                 _yaml.dump(self.config, yaml_file)
 
         if immediate:
-            with open(self.app_data_file, "w", encoding="utf-8") as yaml_file:
+            with atomic_write(self.app_data_file) as yaml_file:
                 _yaml.dump(self.app_data, yaml_file)
 
+    def need_checkpoint(self) -> bool:
+        """If enough progress is unsaved to save a checkpoint
+
+        A checkpoint is due every `checkpoint_interval` seconds or
+        `checkpoint_tasks` finished tasks, whichever comes first.
+        """
+        if not self.unsaved_task_count:
+            return False
+
+        if self.checkpoint_tasks and self.unsaved_task_count >= self.checkpoint_tasks:
+            return True
+
+        return bool(self.checkpoint_interval) and (
+            time.time() - self.last_checkpoint_time >= self.checkpoint_interval
+        )
+
+    def checkpoint(self):
+        """Save the progress of the running downloads
+
+        The watermark of every chat is saved, so a restart after a crash
+        continues from the last checkpoint.
+        """
+        self.update_config()
+        self.unsaved_task_count = 0
+        self.last_checkpoint_time = time.time()
+
     def set_language(self, language: Language):
         """Set Language"""
         self.language = language
@@ -919,15 +1117,21 @@ class Application:
                 self.config = config
                 self.assign_config(self.config)
 
+        self.download_state.open(self.db_file_path)
+
+        app_data = None
         if os.path.exists(os.path.join(os.path.abspath("."), self.app_data_file)):
             with open(
                 os.path.join(os.path.abspath("."), self.app_data_file),
                 encoding="utf-8",
             ) as f:
                 app_data = _yaml.load(f.read())
-                if app_data:
-                    self.app_data = app_data
-                    self.assign_app_data(self.app_data)
+
+        if app_data:
+            self.app_data = app_data
+            self.assign_app_data(self.app_data)
+        else:
+            self.load_download_state()
 
     def pre_run(self):
         """before run application do"""
@@ -1023,7 +1227,13 @@ class Application:
         return self.caption_entities_dict[chat_id][media_group_id]
 
     def set_download_id(
-        self, node: TaskNode, message_id: int, download_status: DownloadStatus
+        self,
+        node: TaskNode,
+        message_id: int,
+        download_status: DownloadStatus,
+        file_name: Optional[str] = None,
+        file_size: Optional[int] = None,
+        file_unique_id: Optional[str] = None,
     ):
         """Set Download status"""
         if download_status is DownloadStatus.SuccessDownload:
@@ -1032,8 +1242,18 @@ class Application:
         if node.chat_id not in self.chat_download_config:
             return
 
-        self.chat_download_config[node.chat_id].finish_task += 1
+        try:
+            self.download_state.set_status(
+                node.chat_id,
+                message_id,
+                download_status.value,
+                file_size,
+                file_name,
+                file_unique_id,
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"record message {message_id} failed: {e}")
 
-        self.chat_download_config[node.chat_id].last_read_message_id = max(
-            self.chat_download_config[node.chat_id].last_read_message_id, message_id
-        )
+        self.chat_download_config[node.chat_id].finish_task += 1
+        self.unsaved_task_count += 1
+        self.chat_download_config[node.chat_id].watermark.finish(message_id)
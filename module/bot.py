@@ -37,6 +37,7 @@ from module.pyrogram_extension import (
     set_meta_data,
     upload_telegram_chat_message,
 )
+from module.rate_limiter import RateFamily
 from utils.format import replace_date_time, validate_title
 from utils.meta_data import MetaData
 
@@ -478,7 +479,11 @@ async def get_info(client: pyrogram.Client, message: pyrogram.types.Message):
 
     if entity:
         if message_id:
-            _message = await retry(_bot.client.get_messages, args=(chat_id, message_id))
+            _message = await retry(
+                _bot.client.get_messages,
+                args=(chat_id, message_id),
+                family=RateFamily.History,
+            )
             if _message:
                 meta_data = MetaData()
                 set_meta_data(meta_data, _message)
@@ -707,7 +712,11 @@ async def proc_replace_advertisement(mesage_link: str, filter_str: str):
         Exception: If there are issues parsing the message link or accessing the message
     """
     chat_id, message_id, _ = await parse_link(_bot.client, mesage_link)
-    raw_message = await retry(_bot.client.get_messages, args=(chat_id, message_id))
+    raw_message = await retry(
+        _bot.client.get_messages,
+        args=(chat_id, message_id),
+        family=RateFamily.History,
+    )
 
     processor = MessageProcessor(raw_message, filter_str)
     processor.process_entities()
@@ -895,7 +904,9 @@ async def download_from_link(client: pyrogram.Client, message: pyrogram.types.Me
     if entity:
         if message_id:
             download_message = await retry(
-                _bot.client.get_messages, args=(chat_id, message_id)
+                _bot.client.get_messages,
+                args=(chat_id, message_id),
+                family=RateFamily.History,
             )
             if download_message:
                 await direct_download(_bot, entity.id, message, download_message)
@@ -0,0 +1,99 @@
+"""Pool of accounts sharing the downloads"""
+
+import zlib
+from enum import Enum
+from typing import Dict, List, Set, Tuple, Union
+
+import pyrogram
+
+from module.rate_limiter import RateFamily, get_rate_limiter
+
+
+class ClientPolicy(Enum):
+    """How a download account is chosen"""
+
+    LeastLoaded = 1
+    HashByChat = 2
+
+
+class ClientPool:
+    """Download accounts, the first one is the main account
+
+    Every download task borrows an account with `acquire` and gives it back
+    with `release`. Accounts paused by a FloodWait are skipped while another
+    one is available, and an account that can not see a chat is not used
+    for it again.
+    """
+
+    def __init__(
+        self,
+        clients: List[pyrogram.Client],
+        policy: ClientPolicy = ClientPolicy.LeastLoaded,
+    ):
+        self.clients = clients
+        self.policy = policy
+        self._load: Dict[int, int] = {id(it): 0 for it in clients}
+        self._hidden_chats: Set[Tuple[int, Union[int, str]]] = set()
+
+    @property
+    def main_client(self) -> pyrogram.Client:
+        """The account used when no other one fits"""
+        return self.clients[0]
+
+    def load(self, client: pyrogram.Client) -> int:
+        """Number of tasks running on `client`"""
+        return self._load.get(id(client), 0)
+
+    @staticmethod
+    def is_flood_waited(client: pyrogram.Client) -> bool:
+        """If downloads of `client` are paused by a FloodWait"""
+        rate_limiter = get_rate_limiter(client)
+        return any(
+            rate_limiter.get_bucket(family).circuit_delay() > 0
+            for family in (RateFamily.File, RateFamily.History)
+        )
+
+    def can_see(self, client: pyrogram.Client, chat_id: Union[int, str]) -> bool:
+        """If `client` was not found unable to see `chat_id`"""
+        return (id(client), chat_id) not in self._hidden_chats
+
+    def hide_chat(self, client: pyrogram.Client, chat_id: Union[int, str]):
+        """Stop using `client` for `chat_id`, never for the main account"""
+        if client is not self.main_client:
+            self._hidden_chats.add((id(client), chat_id))
+
+    def select(self, chat_id: Union[int, str]) -> pyrogram.Client:
+        """Select the account for a task of `chat_id`"""
+        candidates = [it for it in self.clients if self.can_see(it, chat_id)]
+        if not candidates:
+            return self.main_client
+
+        available = [it for it in candidates if not self.is_flood_waited(it)]
+        if not available:
+            return self.main_client
+
+        if self.policy is ClientPolicy.HashByChat:
+            # same chat, same account, as long as it is available
+            start = zlib.crc32(str(chat_id).encode()) % len(candidates)
+            for i in range(len(candidates)):
+                client = candidates[(start + i) % len(candidates)]
+                if client in available:
+                    return client
+
+        return min(available, key=self.load)
+
+    def acquire(self, chat_id: Union[int, str]) -> pyrogram.Client:
+        """Borrow an account for a task of `chat_id`"""
+        client = self.select(chat_id)
+        self._load[id(client)] = self.load(client) + 1
+        return client
+
+    def acquire_main(self) -> pyrogram.Client:
+        """Borrow the main account, whatever its load"""
+        client = self.main_client
+        self._load[id(client)] = self.load(client) + 1
+        return client
+
+    def release(self, client: pyrogram.Client):
+        """Give back an account borrowed by `acquire`"""
+        self._load[id(client)] = max(0, self.load(client) - 1)
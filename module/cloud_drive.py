@@ -12,6 +12,7 @@ from zipfile import ZipFile
 
 from loguru import logger
 
+from module.file_index import get_file_index
 from utils import platform
 
 
@@ -134,6 +135,7 @@ class CloudDrive:
                         drive_config.total_upload_success_file_count += 1
                         if drive_config.after_upload_file_delete:
                             os.remove(local_file_path)
+                            get_file_index().remove(local_file_path)
                         if drive_config.before_upload_file_zip:
                             os.remove(zip_file_path)
                         upload_status = True
@@ -207,6 +209,7 @@ class CloudDrive:
                 drive_config.total_upload_success_file_count += len(res)
                 if drive_config.after_upload_file_delete:
                     os.remove(local_file_path)
+                    get_file_index().remove(local_file_path)
 
                 if drive_config.before_upload_file_zip:
                     os.remove(zip_file_path)
@@ -0,0 +1,218 @@
+"""Adaptive concurrency of download workers and transmissions"""
+
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import TYPE_CHECKING, Callable, Deque, List
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from typing_extensions import Literal
+
+
+class AdjustableSemaphore(asyncio.Semaphore):
+    """Semaphore whose limit can be changed at runtime
+
+    Lowering the limit never interrupts holders, new acquirers simply wait
+    until enough holders released. It replaces the transmission
+    semaphores of pyrogram, so it is an `asyncio.Semaphore` with every
+    method overridden.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(max(1, limit))
+        self._limit = max(1, limit)
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        """Current limit"""
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        """Number of holders"""
+        return self._active
+
+    def set_limit(self, limit: int):
+        """Change the limit and wake up waiters if there is room"""
+        self._limit = max(1, limit)
+        self._wake_up()
+
+    def locked(self) -> bool:
+        """If `acquire` would wait"""
+        return self._active >= self._limit
+
+    def _wake_up(self):
+        """Hand free slots to the waiters, oldest first"""
+        while self._waiters and self._active < self._limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # hand the slot over to the waiter
+                self._active += 1
+                waiter.set_result(True)
+
+    async def acquire(self) -> "Literal[True]":
+        """Acquire a slot"""
+        if not self._waiters and self._active < self._limit:
+            self._active += 1
+            return True
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return True
+
+    def release(self):
+        """Release a slot"""
+        self._active -= 1
+        self._wake_up()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ConcurrencyAction(Enum):
+    """Controller decision"""
+
+    Hold = 1
+    Increase = 2
+    Decrease = 3
+
+
+# pylint: disable = R0902
+class ConcurrencyController:
+    """AIMD controller of the download concurrency
+
+    Every `interval` seconds the controller looks at the FloodWait and error
+    counts of the last period. Any FloodWait, or an error rate above
+    `max_error_rate`, halves the worker and transmission limits. Otherwise
+    the limits grow by one step, as long as the previous step still improved
+    the throughput.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_workers: int,
+        transmissions: int,
+        max_transmissions: int,
+        interval: float = 10.0,
+        max_error_rate: float = 0.2,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_transmissions = max(1, max_transmissions)
+        self.interval = interval
+        self.max_error_rate = max_error_rate
+        self.worker_semaphore = AdjustableSemaphore(min(workers, self.max_workers))
+        self.transmissions = min(transmissions, self.max_transmissions)
+        self.transmission_semaphores: List[AdjustableSemaphore] = []
+        self.throughput: int = 0
+        self.last_action = ConcurrencyAction.Hold
+        self._flood_wait_count = 0
+        self._error_count = 0
+        self._success_count = 0
+
+    @property
+    def workers(self) -> int:
+        """Active worker limit"""
+        return self.worker_semaphore.limit
+
+    def add_transmission_semaphore(self) -> AdjustableSemaphore:
+        """Create a transmission semaphore that follows the controller"""
+        semaphore = AdjustableSemaphore(self.transmissions)
+        self.transmission_semaphores.append(semaphore)
+        return semaphore
+
+    def record_flood_wait(self):
+        """Record a FloodWait"""
+        self._flood_wait_count += 1
+
+    def record_error(self):
+        """Record a failed attempt"""
+        self._error_count += 1
+
+    def record_success(self):
+        """Record a finished download"""
+        self._success_count += 1
+
+    def _set_limits(self, workers: int, transmissions: int):
+        """Apply new limits, clamped to the configured bounds"""
+        self.worker_semaphore.set_limit(max(1, min(workers, self.max_workers)))
+        self.transmissions = max(1, min(transmissions, self.max_transmissions))
+        for semaphore in self.transmission_semaphores:
+            semaphore.set_limit(self.transmissions)
+
+    def adjust(self, throughput: int) -> ConcurrencyAction:
+        """Adjust the limits from the stat of the last period.
+
+        Parameters
+        ----------
+        throughput: int
+            Download speed of the last period in bytes per second
+
+        Returns
+        -------
+        ConcurrencyAction
+        """
+        attempts = self._error_count + self._success_count
+        error_rate = self._error_count / attempts if attempts else 0.0
+
+        if self._flood_wait_count or error_rate > self.max_error_rate:
+            action = ConcurrencyAction.Decrease
+            self._set_limits(self.workers // 2, self.transmissions // 2)
+        elif (
+            self.last_action is not ConcurrencyAction.Increase
+            or throughput > self.throughput
+        ):
+            action = ConcurrencyAction.Increase
+            step = max(1, self.max_transmissions // self.max_workers)
+            self._set_limits(self.workers + 1, self.transmissions + step)
+        else:
+            action = ConcurrencyAction.Hold
+
+        self.throughput = throughput
+        self.last_action = action
+        self._flood_wait_count = 0
+        self._error_count = 0
+        self._success_count = 0
+
+        return action
+
+    async def run(self, get_throughput: Callable, is_running: Callable):
+        """Adjust the limits periodically"""
+        while is_running():
+            await asyncio.sleep(self.interval)
+            action = self.adjust(get_throughput())
+            if action is not ConcurrencyAction.Hold:
+                logger.debug(
+                    f"concurrency {action.name}: workers {self.workers}, "
+                    f"transmissions {self.transmissions}"
+                )
+
+
+_controller: ConcurrencyController = ConcurrencyController(1, 1, 1, 1)
+
+
+def get_concurrency_controller() -> ConcurrencyController:
+    """get global concurrency controller"""
+    return _controller
+
+
+# pylint: disable = W0603
+def set_concurrency_controller(controller: ConcurrencyController):
+    """set global concurrency controller"""
+    global _controller
+    _controller = controller
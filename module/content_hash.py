@@ -0,0 +1,117 @@
+"""Content digest of media computed while it downloads"""
+
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# telegram sends files in 1 MB chunks
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_current_hasher: "contextvars.ContextVar[Optional[ChunkHasher]]" = (
+    contextvars.ContextVar("current_hasher", default=None)
+)
+
+
+def new_hash(algorithm: str) -> Any:
+    """Create a hash object of `algorithm`
+
+    `xxh64`, `xxh128` and `blake3` need the `xxhash` and `blake3` packages,
+    every other name is passed to `hashlib`.
+
+    Raises
+    ------
+    ValueError
+        If the algorithm is unknown or its package is not installed.
+    """
+    if algorithm in ("xxh64", "xxh128"):
+        try:
+            import xxhash  # pylint: disable = C0415
+        except ImportError as e:
+            raise ValueError(f"{algorithm} needs the xxhash package") from e
+        return getattr(xxhash, algorithm)()
+
+    if algorithm == "blake3":
+        try:
+            import blake3  # pylint: disable = C0415
+        except ImportError as e:
+            raise ValueError("blake3 needs the blake3 package") from e
+        return blake3.blake3()
+
+    return hashlib.new(algorithm)
+
+
+class ChunkHasher:
+    """Digest of a file built from the digests of its chunks
+
+    Segments of a file arrive out of order, so every 1 MB chunk is hashed
+    on its own when it arrives, and the file digest is the hash of all
+    chunk digests in file order. The same content always gets the same
+    digest, however it was downloaded, without reading the file again.
+
+    The digest differs from a plain digest of the file, it is stored
+    under `name`, e.g. `sha256-chunked-1m`.
+    """
+
+    def __init__(self, algorithm: str, file_size: int):
+        self.algorithm = algorithm
+        self.file_size = file_size
+        self.total_chunks = max(1, -(-file_size // HASH_CHUNK_SIZE))
+        self.chunk_digests: Dict[int, bytes] = {}
+        # validate the algorithm early
+        new_hash(algorithm)
+
+    @property
+    def name(self) -> str:
+        """Name of the digest scheme, the algorithm and the chunk size"""
+        return f"{self.algorithm}-chunked-{HASH_CHUNK_SIZE // (1024 * 1024)}m"
+
+    def update(self, idx: int, data: bytes):
+        """Hash the chunk `idx` of the file"""
+        chunk_hash = new_hash(self.algorithm)
+        chunk_hash.update(data)
+        self.chunk_digests[idx] = chunk_hash.digest()
+
+    def get_chunk_digest(self, idx: int) -> Optional[str]:
+        """Hex digest of the chunk `idx`, `None` if not hashed"""
+        digest = self.chunk_digests.get(idx)
+        return digest.hex() if digest else None
+
+    def set_chunk_digest(self, idx: int, digest: str):
+        """Restore the digest of a chunk downloaded by an earlier attempt"""
+        self.chunk_digests[idx] = bytes.fromhex(digest)
+
+    def hexdigest(self) -> Optional[str]:
+        """Digest of the file, `None` if some chunk was not hashed"""
+        # the size of some media is unknown until it is downloaded
+        total_chunks = max(self.total_chunks, max(self.chunk_digests, default=-1) + 1)
+        if len(self.chunk_digests) < total_chunks:
+            return None
+
+        file_hash = new_hash(self.algorithm)
+        for idx in range(total_chunks):
+            digest = self.chunk_digests.get(idx)
+            if digest is None:
+                return None
+            file_hash.update(digest)
+        file_digest: str = file_hash.hexdigest()
+        return file_digest
+
+
+def get_current_hasher() -> Optional[ChunkHasher]:
+    """Hasher of the download running in the current task"""
+    return _current_hasher.get()
+
+
+@contextmanager
+def hash_download(hasher: Optional[ChunkHasher]) -> Iterator[Optional[ChunkHasher]]:
+    """Hash every chunk fetched inside the block with `hasher`
+
+    Tasks started inside the block, like the segments of a download,
+    use the same hasher.
+    """
+    token = _current_hasher.set(hasher)
+    try:
+        yield hasher
+    finally:
+        _current_hasher.reset(token)
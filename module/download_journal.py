@@ -0,0 +1,166 @@
+"""Sidecar journal of verified chunks for resumable downloads"""
+
+import json
+import math
+import os
+from typing import Dict, List, Optional, Set, TextIO, Tuple
+
+
+class DownloadJournal:
+    """Download journal
+
+    The journal lives next to the partially downloaded file as
+    `<file>.journal`. Its first line is a json header describing the
+    media, every following line is the index of a chunk that was fully
+    written to the file, followed by the digest of the chunk if it was
+    hashed.
+    """
+
+    SUFFIX = ".journal"
+
+    def __init__(self, file_path: str, file_size: int, media_id: int, chunk_size: int):
+        self.file_path = file_path
+        self.journal_path = self.get_journal_path(file_path)
+        self.file_size = file_size
+        self.media_id = media_id
+        self.chunk_size = chunk_size
+        self.done_chunks: Set[int] = set()
+        self.chunk_digests: Dict[int, str] = {}
+        self._file: Optional[TextIO] = None
+
+    @staticmethod
+    def get_journal_path(file_path: str) -> str:
+        """Get journal path of a download file"""
+        return file_path + DownloadJournal.SUFFIX
+
+    @property
+    def total_chunks(self) -> int:
+        """Number of chunks of the file"""
+        return math.ceil(self.file_size / self.chunk_size)
+
+    def _header(self) -> dict:
+        """Header identifying the media and the chunk layout"""
+        return {
+            "media_id": self.media_id,
+            "file_size": self.file_size,
+            "chunk_size": self.chunk_size,
+        }
+
+    def load(self) -> bool:
+        """Load the journal left by an earlier attempt.
+
+        Returns
+        -------
+        bool
+            True if the journal belongs to the same media and the
+            partial file can be resumed.
+        """
+        self.done_chunks.clear()
+        self.chunk_digests.clear()
+
+        if not os.path.isfile(self.journal_path) or not os.path.isfile(self.file_path):
+            return False
+
+        if os.path.getsize(self.file_path) != self.file_size:
+            return False
+
+        with open(self.journal_path, encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return False
+
+            if header != self._header():
+                return False
+
+            for line in f:
+                fields = line.split()
+                # the last line may be cut off by a crash
+                if not fields or not fields[0].isdigit() or not line.endswith("\n"):
+                    continue
+                idx = int(fields[0])
+                if idx < self.total_chunks:
+                    self.done_chunks.add(idx)
+                    if len(fields) > 1:
+                        self.chunk_digests[idx] = fields[1]
+
+        return True
+
+    def open(self, resume: bool):
+        """Open the journal for appending, start a new one if not resume"""
+        if not resume:
+            self.done_chunks.clear()
+            self.chunk_digests.clear()
+            with open(self.journal_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self._header()) + "\n")
+
+        # pylint: disable = R1732
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+
+    def close(self):
+        """Close the journal, the file stays on disk for the next attempt"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Close and delete the journal once the download is complete"""
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def expected_chunk_size(self, idx: int) -> int:
+        """Size of the chunk `idx`, only the last chunk may be shorter"""
+        return min(self.chunk_size, self.file_size - idx * self.chunk_size)
+
+    def record(self, idx: int, size: int, digest: Optional[str] = None) -> bool:
+        """Mark a chunk as written, with its digest if it was hashed.
+
+        The data must already be flushed to the download file.
+
+        Returns
+        -------
+        bool
+            False if the chunk has an unexpected size and was not recorded.
+        """
+        if size != self.expected_chunk_size(idx):
+            return False
+
+        if self._file:
+            self._file.write(f"{idx} {digest}\n" if digest else f"{idx}\n")
+            self._file.flush()
+        self.done_chunks.add(idx)
+        if digest:
+            self.chunk_digests[idx] = digest
+        return True
+
+    def done_size(self) -> int:
+        """Bytes already verified"""
+        return sum(self.expected_chunk_size(idx) for idx in self.done_chunks)
+
+    def is_complete(self) -> bool:
+        """If every chunk is verified"""
+        return len(self.done_chunks) == self.total_chunks
+
+    def missing_runs(self, offset: int, limit: int) -> List[Tuple[int, int]]:
+        """Get the contiguous runs of missing chunks in `[offset, offset + limit)`
+
+        Returns
+        -------
+        List[Tuple[int, int]]
+            `(offset, limit)` of every run, counted in chunks
+        """
+        runs: List[Tuple[int, int]] = []
+        run_start = -1
+        for idx in range(offset, offset + limit):
+            if idx in self.done_chunks:
+                if run_start != -1:
+                    runs.append((run_start, idx - run_start))
+                    run_start = -1
+            elif run_start == -1:
+                run_start = idx
+
+        if run_start != -1:
+            runs.append((run_start, offset + limit - run_start))
+
+        return runs
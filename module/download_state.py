@@ -0,0 +1,137 @@
+"""Download state of every message"""
+
+import os
+import sqlite3
+import time
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+from module.sqlite_store import SqliteStore
+
+_COLUMNS = (
+    "chat_id, message_id, status, size, path, file_unique_id, attempts, update_time"
+)
+
+
+class MessageState(NamedTuple):
+    """Download state of a message"""
+
+    chat_id: str
+    message_id: int
+    status: int
+    size: int
+    path: Optional[str]
+    file_unique_id: Optional[str]
+    attempts: int
+    update_time: float
+
+
+class DownloadStateStore(SqliteStore):
+    """Download state of messages in a sqlite database
+
+    Messages are keyed by `(chat_id, message_id)`, so a lookup or an update
+    is one indexed query and the state of a chat never has to be loaded or
+    written in full. Every change is committed on its own.
+    """
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "chat_id TEXT NOT NULL, message_id INTEGER NOT NULL, "
+            "status INTEGER NOT NULL, size INTEGER NOT NULL DEFAULT 0, "
+            "path TEXT, file_unique_id TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, update_time REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_status ON messages (chat_id, status)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_path ON messages (path)")
+
+    def set_status(
+        self,
+        chat_id: Union[int, str],
+        message_id: int,
+        status: int,
+        size: Optional[int] = None,
+        path: Optional[str] = None,
+        file_unique_id: Optional[str] = None,
+    ):
+        """Record a finished download attempt of a message
+
+        `size`, `path` and `file_unique_id` keep their recorded value if
+        not given.
+        """
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO messages ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (chat_id, message_id) DO UPDATE SET "
+                "status = excluded.status, "
+                "size = COALESCE(?, size), "
+                "path = COALESCE(excluded.path, path), "
+                "file_unique_id = COALESCE(excluded.file_unique_id, file_unique_id), "
+                "attempts = attempts + 1, "
+                "update_time = excluded.update_time",
+                (
+                    str(chat_id),
+                    message_id,
+                    status,
+                    size or 0,
+                    os.path.abspath(path) if path else None,
+                    file_unique_id,
+                    time.time(),
+                    size,
+                ),
+            )
+
+    def add_message_ids(
+        self, chat_id: Union[int, str], message_ids: Iterable[int], status: int
+    ):
+        """Record messages with `status`, messages already recorded are kept"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO messages "
+                "(chat_id, message_id, status, update_time) VALUES (?, ?, ?, ?)",
+                ((str(chat_id), it, status, now) for it in message_ids),
+            )
+
+    def get(self, chat_id: Union[int, str], message_id: int) -> Optional[MessageState]:
+        """Get the state of a message"""
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM messages WHERE chat_id = ? AND message_id = ?",
+            (str(chat_id), message_id),
+        ).fetchone()
+        return MessageState(*row) if row else None
+
+    def get_status(self, chat_id: Union[int, str], message_id: int) -> Optional[int]:
+        """Get the status of a message, `None` if not recorded"""
+        row = self.conn.execute(
+            "SELECT status FROM messages WHERE chat_id = ? AND message_id = ?",
+            (str(chat_id), message_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_message_ids(
+        self, chat_id: Union[int, str], exclude_status: Iterable[int] = ()
+    ) -> List[int]:
+        """Get the sorted ids of the recorded messages of a chat
+
+        Messages with a status in `exclude_status` are left out.
+        """
+        excluded = list(exclude_status)
+        placeholders = ", ".join("?" * len(excluded))
+        rows = self.conn.execute(
+            "SELECT message_id FROM messages WHERE chat_id = ? "
+            f"AND status NOT IN ({placeholders}) ORDER BY message_id",
+            (str(chat_id), *excluded),
+        )
+        return [it[0] for it in rows]
+
+    def find_by_path(self, path: str) -> Optional[MessageState]:
+        """Get the message last downloaded to `path`"""
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM messages WHERE path = ? "
+            "ORDER BY update_time DESC LIMIT 1",
+            (os.path.abspath(path),),
+        ).fetchone()
+        return MessageState(*row) if row else None
@@ -0,0 +1,134 @@
+"""Index of downloaded files"""
+
+import os
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+from module.sqlite_store import SqliteStore
+
+_COLUMNS = "path, size, algorithm, digest, create_time, file_unique_id"
+
+
+class FileRecord(NamedTuple):
+    """A downloaded file"""
+
+    path: str
+    size: int
+    algorithm: Optional[str]
+    digest: Optional[str]
+    create_time: float
+    file_unique_id: Optional[str] = None
+
+
+class FileIndex(SqliteStore):
+    """Downloaded files and their content digest in a sqlite database
+
+    The digest is computed while the file downloads, so deduplication and
+    integrity checks can use it without reading the file again. Files are
+    also found by the telegram `file_unique_id` of their media, which is
+    the same in every chat the media is posted to.
+    """
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "algorithm TEXT, digest TEXT, create_time REAL NOT NULL, "
+            "file_unique_id TEXT)"
+        )
+        columns = [it[1] for it in conn.execute("PRAGMA table_info(files)")]
+        # databases created before files were indexed by media
+        if "file_unique_id" not in columns:
+            conn.execute("ALTER TABLE files ADD COLUMN file_unique_id TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_digest ON files (digest)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS files_file_unique_id ON files (file_unique_id)"
+        )
+
+    def add(
+        self,
+        path: str,
+        size: int,
+        algorithm: Optional[str] = None,
+        digest: Optional[str] = None,
+        file_unique_id: Optional[str] = None,
+    ):
+        """Record a downloaded file, replacing an older record of `path`"""
+        with self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO files ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.abspath(path),
+                    size,
+                    algorithm,
+                    digest,
+                    time.time(),
+                    file_unique_id,
+                ),
+            )
+
+    def get(self, path: str) -> Optional[FileRecord]:
+        """Get the record of `path`"""
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM files WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        return FileRecord(*row) if row else None
+
+    def get_digest(self, path: str) -> Optional[str]:
+        """Get the digest of `path` recorded while it downloaded
+
+        The digest is prefixed by its algorithm, `None` if it was not
+        hashed or the file changed since.
+        """
+        record = self.get(path)
+        if (
+            not record
+            or not record.digest
+            or not os.path.isfile(record.path)
+            or os.path.getsize(record.path) != record.size
+        ):
+            return None
+        return f"{record.algorithm}:{record.digest}"
+
+    def find_by_digest(self, algorithm: str, digest: str) -> Optional[FileRecord]:
+        """Get a file with the same content"""
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM files WHERE digest = ? AND algorithm = ? LIMIT 1",
+            (digest, algorithm),
+        ).fetchone()
+        return FileRecord(*row) if row else None
+
+    def find_by_unique_id(self, file_unique_id: str) -> Optional[FileRecord]:
+        """Get a stored file of the media `file_unique_id`
+
+        Records of files deleted or changed outside the downloader are
+        dropped on the way, so the index follows the disk.
+        """
+        rows = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM files WHERE file_unique_id = ?",
+            (file_unique_id,),
+        ).fetchall()
+        for row in rows:
+            record = FileRecord(*row)
+            if os.path.isfile(record.path) and (
+                not record.size or os.path.getsize(record.path) == record.size
+            ):
+                return record
+            self.remove(record.path)
+        return None
+
+    def remove(self, path: str):
+        """Forget a deleted file"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM files WHERE path = ?", (os.path.abspath(path),)
+            )
+
+
+_file_index = FileIndex()
+
+
+def get_file_index() -> FileIndex:
+    """get global file index"""
+    return _file_index
@@ -0,0 +1,105 @@
+"""Cache of fetched messages while their file references are fresh"""
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+import pyrogram
+
+from module.message_fetcher import get_message_fetcher
+
+# (account, chat_id, message_id) of a cached message
+_Key = Tuple[Optional[str], Union[int, str], int]
+
+
+def _get_account(client: Optional[pyrogram.Client]) -> Optional[str]:
+    """Name of the account a file reference belongs to"""
+    return getattr(client, "name", None)
+
+
+class FileReferenceCache:
+    """Messages keyed by (account, chat_id, message_id), valid for `ttl` seconds
+
+    A message coming from the chat history carries a usable file reference,
+    so it is kept here instead of being fetched again right before the
+    download. An entry is dropped when its file reference expired, the
+    next `fetch` then gets a fresh message from telegram.
+
+    File references are only used by the account that fetched them, a
+    download account never reuses a message of another one.
+    """
+
+    def __init__(self, ttl: float = 1800, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # (fetch time, message) of every key, oldest first
+        self._messages: "OrderedDict[_Key, Tuple[float, pyrogram.types.Message]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def put(
+        self,
+        client: Optional[pyrogram.Client],
+        chat_id: Union[int, str],
+        message: pyrogram.types.Message,
+    ):
+        """Cache a message just received from telegram by `client`"""
+        key = (_get_account(client), chat_id, message.id)
+        self._messages.pop(key, None)
+        self._messages[key] = (time.monotonic(), message)
+        while len(self._messages) > self.maxsize:
+            self._messages.popitem(last=False)
+
+    def get(
+        self,
+        client: Optional[pyrogram.Client],
+        chat_id: Union[int, str],
+        message_id: int,
+    ) -> Optional[pyrogram.types.Message]:
+        """Get a message cached for `client`, `None` if missing or stale"""
+        key = (_get_account(client), chat_id, message_id)
+        cached = self._messages.get(key)
+        if not cached:
+            return None
+
+        fetch_time, message = cached
+        if time.monotonic() - fetch_time > self.ttl:
+            del self._messages[key]
+            return None
+        return message
+
+    def invalidate(
+        self,
+        client: Optional[pyrogram.Client],
+        chat_id: Union[int, str],
+        message_id: int,
+    ):
+        """Drop a message whose file reference expired"""
+        self._messages.pop((_get_account(client), chat_id, message_id), None)
+
+    async def fetch(
+        self, client: pyrogram.Client, chat_id: Union[int, str], message_id: int
+    ) -> Optional[pyrogram.types.Message]:
+        """Get a cached message, or fetch it from telegram if stale
+
+        Fetches of several messages are batched by the message fetcher.
+        """
+        message = self.get(client, chat_id, message_id)
+        if message:
+            return message
+
+        message = await get_message_fetcher().fetch(client, chat_id, message_id)
+        if message and not message.empty:
+            self.put(client, chat_id, message)
+        return message
+
+
+_file_reference_cache = FileReferenceCache()
+
+
+def get_file_reference_cache() -> FileReferenceCache:
+    """get global file reference cache"""
+    return _file_reference_cache
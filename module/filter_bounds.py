@@ -0,0 +1,210 @@
+"""Bounds of the messages a download filter can match"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional
+
+from ply import lex, yacc
+
+from module.filter import BaseFilter
+
+
+@dataclass
+class FilterBounds:
+    """Range of message ids and dates a filter can match, `None` is unbounded
+
+    Every bound is inclusive.
+    """
+
+    min_id: Optional[int] = None
+    max_id: Optional[int] = None
+    min_date: Optional[datetime] = None
+    max_date: Optional[datetime] = None
+
+    def intersect(self, other: "FilterBounds") -> "FilterBounds":
+        """Messages matching both bounds"""
+        return FilterBounds(
+            _pick(max, self.min_id, other.min_id),
+            _pick(min, self.max_id, other.max_id),
+            _pick(max, self.min_date, other.min_date),
+            _pick(min, self.max_date, other.max_date),
+        )
+
+    def union(self, other: "FilterBounds") -> "FilterBounds":
+        """Messages matching either bound"""
+        return FilterBounds(
+            _hull(min, self.min_id, other.min_id),
+            _hull(max, self.max_id, other.max_id),
+            _hull(min, self.min_date, other.min_date),
+            _hull(max, self.max_date, other.max_date),
+        )
+
+
+def _pick(func, left, right):
+    """The tighter of two bounds"""
+    if left is None or right is None:
+        return right if left is None else left
+    return func(left, right)
+
+
+def _hull(func, left, right):
+    """The looser of two bounds"""
+    if left is None or right is None:
+        return None
+    return func(left, right)
+
+
+def _as_bounds(value: Any) -> FilterBounds:
+    """Bounds of a parsed value, unbounded if it is not a comparison"""
+    return value if isinstance(value, FilterBounds) else FilterBounds()
+
+
+class _Field(str):
+    """A message id or date in a filter"""
+
+
+class _Unknown:
+    """A value only known once a message is read"""
+
+
+# names of the fields bounds are taken from
+_BOUND_FIELDS = {"id": "id", "message_id": "id", "message_date": "date"}
+
+# the comparison as seen from the other side
+_FLIPPED = {">": "<", "<": ">", ">=": "<=", "<=": ">=", "==": "=="}
+
+
+class BoundsFilter(BaseFilter):
+    """Compute the `FilterBounds` of a filter without reading any message
+
+    Parses with the grammar of `BaseFilter`. Comparisons of `id`,
+    `message_id` or `message_date` with a constant become bounds, `&&` and
+    `||` intersect and join them, anything else leaves the bounds open.
+    The bounds can only be wider than what the filter matches.
+    """
+
+    # pylint: disable = W0231
+    def __init__(self):
+        self.names: dict = {}
+        self.debug = False
+        self.lexer = lex.lex(module=self)
+        # the rules of `BaseFilter` are overridden on purpose, and its
+        # tables are kept to itself
+        self.yacc = yacc.yacc(
+            module=self,
+            start="statement",
+            debug=False,
+            write_tables=False,
+            errorlog=yacc.NullLogger(),
+        )
+
+    def _bounds(self, left: Any, op: str, right: Any) -> FilterBounds:
+        """Bounds of `left op right`"""
+        if isinstance(right, _Field) and not isinstance(left, _Field):
+            left, op, right = right, _FLIPPED.get(op, op), left
+
+        if not isinstance(left, _Field) or op not in _FLIPPED:
+            return FilterBounds()
+
+        if _BOUND_FIELDS[left] == "id":
+            if not isinstance(right, int) or isinstance(right, bool):
+                return FilterBounds()
+            min_id = {">": right + 1, ">=": right, "==": right}.get(op)
+            max_id = {"<": right - 1, "<=": right, "==": right}.get(op)
+            return FilterBounds(min_id=min_id, max_id=max_id)
+
+        if not isinstance(right, datetime):
+            return FilterBounds()
+        min_date = right if op in (">", ">=", "==") else None
+        max_date = right if op in ("<", "<=", "==") else None
+        return FilterBounds(min_date=min_date, max_date=max_date)
+
+    def p_statement_assign(self, p):
+        'statement : NAME "=" expression'
+        field = _BOUND_FIELDS.get(p[1])
+        p[0] = self._bounds(_Field(p[1]) if field else _Unknown(), "==", p[3])
+
+    def p_statement_expr(self, p):
+        "statement : expression"
+        p[0] = _as_bounds(p[1])
+
+    def p_expression_binop(self, p):
+        """expression : expression '+' expression
+        | expression '-' expression
+        | expression '*' expression
+        | expression '/' expression"""
+        if isinstance(p[1], (_Field, _Unknown, FilterBounds)) or isinstance(
+            p[3], (_Field, _Unknown, FilterBounds)
+        ):
+            p[0] = _Unknown()
+            return
+        super().p_expression_binop(p)
+
+    def p_expression_uminus(self, p):
+        "expression : '-' expression %prec UMINUS"
+        if isinstance(p[2], (int, float)) and not isinstance(p[2], bool):
+            p[0] = -p[2]
+        else:
+            p[0] = _Unknown()
+
+    def p_expression_comp(self, p):
+        """expression : expression '>' expression
+        | expression '<' expression"""
+        p[0] = self._bounds(p[1], p[2], p[3])
+
+    def p_expression_ge(self, p):
+        "expression : expression GE expression"
+        p[0] = self._bounds(p[1], p[2], p[3])
+
+    def p_expression_le(self, p):
+        "expression : expression LE expression"
+        p[0] = self._bounds(p[1], p[2], p[3])
+
+    def p_expression_eq(self, p):
+        "expression : expression EQ expression"
+        p[0] = self._bounds(p[1], p[2], p[3])
+
+    def p_expression_ne(self, p):
+        "expression : expression NE expression"
+        p[0] = FilterBounds()
+
+    def p_expression_name(self, p):
+        "expression : NAME"
+        p[0] = _Field(p[1]) if p[1] in _BOUND_FIELDS else _Unknown()
+
+    def p_expression_lor(self, p):
+        "expression : expression LOR expression"
+        p[0] = _as_bounds(p[1]).union(_as_bounds(p[3]))
+
+    def p_expression_land(self, p):
+        "expression : expression LAND expression"
+        p[0] = _as_bounds(p[1]).intersect(_as_bounds(p[3]))
+
+    def p_expression_or(self, p):
+        "expression : expression OR expression"
+        self.p_expression_lor(p)
+
+    def p_expression_and(self, p):
+        "expression : expression AND expression"
+        self.p_expression_land(p)
+
+
+_bounds_filter: Optional[BoundsFilter] = None
+
+
+def get_filter_bounds(filter_str: str) -> FilterBounds:
+    """Get the ids and dates of the messages `filter_str` can match
+
+    Unbounded if `filter_str` is empty or can not be parsed.
+    """
+    global _bounds_filter  # pylint: disable = W0603
+    if not filter_str:
+        return FilterBounds()
+
+    if _bounds_filter is None:
+        _bounds_filter = BoundsFilter()
+    try:
+        bounds = _bounds_filter.yacc.parse(filter_str, lexer=_bounds_filter.lexer)
+    except Exception:
+        return FilterBounds()
+    return _as_bounds(bounds)
@@ -1,7 +1,9 @@
 """Rewrite pyrogram.get_chat_history"""
 
+import asyncio
+from collections import deque
 from datetime import datetime
-from typing import AsyncGenerator, Optional, Union
+from typing import AsyncGenerator, Deque, Dict, List, Optional, Tuple, Type, Union, cast
 
 import pyrogram
 
@@ -9,6 +11,13 @@ import pyrogram
 from pyrogram import raw, types, utils
 
 
+async def _resolve_input_peer(
+    client: pyrogram.Client, chat_id: Union[int, str]
+) -> "raw.base.InputPeer":
+    """Resolve the peer of a chat, always an input peer for a chat id"""
+    return cast("raw.base.InputPeer", await client.resolve_peer(chat_id))
+
+
 async def get_chunk_v2(
     *,
     client: pyrogram.Client,
@@ -16,9 +25,10 @@ async def get_chunk_v2(
     limit: int = 0,
     offset: int = 0,
     max_id: int = 0,
+    min_id: int = 0,
     from_message_id: int = 0,
     from_date: datetime = utils.zero_datetime(),
-    reverse: bool = False
+    reverse: bool = False,
 ):
     """get chunk"""
     from_message_id = from_message_id or (1 if reverse else 0)
@@ -27,13 +37,13 @@ async def get_chunk_v2(
         client,
         await client.invoke(
             raw.functions.messages.GetHistory(
-                peer=await client.resolve_peer(chat_id),
+                peer=await _resolve_input_peer(client, chat_id),
                 offset_id=from_message_id,
                 offset_date=utils.datetime_to_timestamp(from_date),
                 add_offset=offset * (-1 if reverse else 1) - (limit if reverse else 0),
                 limit=limit,
                 max_id=max_id,
-                min_id=0,
+                min_id=min_id,
                 hash=0,
             ),
             sleep_threshold=60,
@@ -47,6 +57,55 @@ async def get_chunk_v2(
     return messages
 
 
+async def _seek_message(
+    client: pyrogram.Client, chat_id: Union[int, str], start: int, end: int = 0
+) -> Optional["types.Message"]:
+    """Find the oldest message with an id from `start` to `end`
+
+    The id range is bisected with single message queries bounded by
+    `min_id` and `max_id`, so a gap of any size costs a few requests
+    instead of reading the history up to it. `end` 0 is unbounded.
+    """
+
+    async def _get_newest(low: int, high: int) -> Optional["types.Message"]:
+        messages = await get_chunk_v2(
+            client=client,
+            chat_id=chat_id,
+            limit=1,
+            min_id=low - 1,
+            max_id=high + 1 if high else 0,
+        )
+        return messages[0] if messages else None
+
+    found = await _get_newest(start, end)
+    if not found:
+        return None
+
+    # no message from `start` to `low - 1`, `found` is the oldest seen
+    low = start
+    while low < found.id:
+        mid = (low + found.id - 1) // 2
+        message = await _get_newest(low, mid)
+        if message:
+            found = message
+        else:
+            low = mid + 1
+    return found
+
+
+async def get_message_id_by_date(
+    client: pyrogram.Client, chat_id: Union[int, str], date: datetime
+) -> int:
+    """Get the id of the newest message sent before `date`, 0 if none"""
+    messages = await get_chunk_v2(
+        client=client, chat_id=chat_id, limit=1, from_date=date
+    )
+    if not messages:
+        return 0
+    message_id: int = messages[0].id
+    return message_id
+
+
 # pylint: disable = C0301
 async def get_chat_history_v2(
     self: pyrogram.Client,
@@ -57,7 +116,7 @@ async def get_chat_history_v2(
     offset_id: int = 0,
     offset_date: datetime = utils.zero_datetime(),
     reverse: bool = False,
-) -> Optional[AsyncGenerator["types.Message", None]]:
+) -> AsyncGenerator["types.Message", None]:
     """Get messages from a chat history."""
     current = 0
     total = limit or (1 << 31) - 1
@@ -76,16 +135,13 @@ async def get_chat_history_v2(
         )
 
         if not messages:
-            break_count = offset_id - 1
-            async for message in self.get_chat_history(chat_id):
-                if break_count:
-                    break_count -= 1
-                    continue
-                if len(messages) >= limit + 1:
-                    break
-                messages.append(message)
-            if not messages:
+            if not reverse:
+                return
+            # the history can come back empty when `offset_id` is in a gap
+            message = await _seek_message(self, chat_id, max(offset_id, 1), max_id)
+            if not message:
                 return
+            messages = [message]
 
         offset_id = messages[-1].id + (1 if reverse else 0)
 
@@ -96,3 +152,236 @@ async def get_chat_history_v2(
 
             if current >= total:
                 return
+
+
+# ids covered by one range of a partitioned scan, adapted to the density
+# of the chat so a range is about one page of messages
+_MIN_RANGE_SIZE = 100
+_MAX_RANGE_SIZE = 1 << 20
+# pages read for one range, the rest of a denser range is fetched again
+_MAX_RANGE_PAGES = 2
+
+
+async def _get_range(
+    client: pyrogram.Client, chat_id: Union[int, str], start: int, end: int
+) -> Tuple[List["types.Message"], Optional[Tuple[int, int]]]:
+    """Get the messages with an id from `start` to `end`, in order
+
+    At most `_MAX_RANGE_PAGES` pages are read. Returns the messages and
+    the part of the range not read yet, `None` if the range is done.
+    """
+    messages: List["types.Message"] = []
+    for _ in range(_MAX_RANGE_PAGES):
+        if start > end:
+            break
+        chunk = await get_chunk_v2(
+            client=client,
+            chat_id=chat_id,
+            limit=100,
+            max_id=end + 1,
+            from_message_id=start,
+            reverse=True,
+        )
+        chunk = [it for it in chunk if start <= it.id <= end]
+        if not chunk:
+            # the history can come back empty when `start` is in a gap
+            message = await _seek_message(client, chat_id, start, end)
+            if not message:
+                return messages, None
+            chunk = [message]
+        messages.extend(chunk)
+        start = chunk[-1].id + 1
+    return messages, (start, end) if start <= end else None
+
+
+async def get_chat_history_partitioned(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    offset_id: int = 0,
+    max_id: int = 0,
+    partitions: int = 4,
+    ordered: bool = True,
+) -> AsyncGenerator["types.Message", None]:
+    """Get the messages from `offset_id` to `max_id` reading several ranges at once
+
+    The id range is split into consecutive ranges, `partitions` of them
+    are fetched at the same time. A range covers about one page of
+    messages: it grows over sparse parts of the chat and shrinks over
+    dense ones. A range is read up to `_MAX_RANGE_PAGES` pages, the rest
+    of it is fetched as a new range, so only a few pages are held in
+    memory.
+
+    Messages are yielded in ascending order, or as soon as their range is
+    fetched if `ordered` is false.
+    """
+    if not max_id:
+        newest = await get_chunk_v2(client=client, chat_id=chat_id, limit=1)
+        if not newest:
+            return
+        max_id = newest[0].id
+
+    cursor = max(offset_id, 1)
+    range_size = _MIN_RANGE_SIZE
+    pending: Deque[asyncio.Task] = deque()
+
+    try:
+        while cursor <= max_id or pending:
+            while len(pending) < max(1, partitions) and cursor <= max_id:
+                end = min(cursor + range_size - 1, max_id)
+                pending.append(
+                    asyncio.ensure_future(_get_range(client, chat_id, cursor, end))
+                )
+                cursor = end + 1
+
+            if ordered:
+                task = pending.popleft()
+                messages, rest = await task
+            else:
+                task = (
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                )[0].pop()
+                pending.remove(task)
+                messages, rest = task.result()
+
+            if rest:
+                # read before the ranges after it to keep the order
+                pending.appendleft(
+                    asyncio.ensure_future(_get_range(client, chat_id, *rest))
+                )
+
+            if len(messages) < 50:
+                range_size = min(range_size * 2, _MAX_RANGE_SIZE)
+            elif len(messages) > 100:
+                range_size = max(range_size // 2, _MIN_RANGE_SIZE)
+
+            for message in messages:
+                yield message
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# media types of `media_types` and the search filter returning them
+MEDIA_SEARCH_FILTERS: Dict[str, Type[raw.base.MessagesFilter]] = {
+    "audio": raw.types.InputMessagesFilterMusic,
+    "document": raw.types.InputMessagesFilterDocument,
+    "photo": raw.types.InputMessagesFilterPhotos,
+    "video": raw.types.InputMessagesFilterVideo,
+    "voice": raw.types.InputMessagesFilterVoice,
+    "video_note": raw.types.InputMessagesFilterRoundVideo,
+    "animation": raw.types.InputMessagesFilterGif,
+}
+
+
+async def search_chunk(
+    *,
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    message_filter: raw.base.MessagesFilter,
+    limit: int = 100,
+    max_id: int = 0,
+    from_message_id: int = 1,
+) -> List["types.Message"]:
+    """Search messages matching `message_filter`, the oldest from `from_message_id` on"""
+    messages = await utils.parse_messages(
+        client,
+        await client.invoke(
+            raw.functions.messages.Search(
+                peer=await _resolve_input_peer(client, chat_id),
+                q="",
+                filter=message_filter,
+                min_date=0,
+                max_date=0,
+                offset_id=from_message_id,
+                add_offset=-limit,
+                limit=limit,
+                max_id=max_id,
+                min_id=from_message_id - 1,
+                hash=0,
+            ),
+            sleep_threshold=60,
+        ),
+        replies=0,
+    )
+    messages.reverse()
+    return messages
+
+
+async def _search_history(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    message_filter: raw.base.MessagesFilter,
+    offset_id: int,
+    max_id: int,
+) -> AsyncGenerator["types.Message", None]:
+    """Search every message matching `message_filter`, in ascending order"""
+    while True:
+        messages = await search_chunk(
+            client=client,
+            chat_id=chat_id,
+            message_filter=message_filter,
+            max_id=max_id + 1 if max_id else 0,
+            from_message_id=offset_id,
+        )
+        messages = [it for it in messages if it.id >= offset_id]
+        if not messages:
+            return
+
+        for message in messages:
+            yield message
+        offset_id = messages[-1].id + 1
+
+
+async def get_chat_history_by_media(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    media_types: List[str],
+    offset_id: int = 0,
+    max_id: int = 0,
+) -> AsyncGenerator["types.Message", None]:
+    """Get the messages of `media_types` from `offset_id` to `max_id`
+
+    The server filters the history with one `messages.Search` per media
+    type, so messages of other types are never fetched. The results are
+    merged in ascending order, a message matching several searches is
+    yielded once.
+
+    Raises
+    ------
+    ValueError
+        If a media type has no search filter, see `MEDIA_SEARCH_FILTERS`.
+    """
+    for media_type in media_types:
+        if media_type not in MEDIA_SEARCH_FILTERS:
+            raise ValueError(f"{media_type} can not be searched")
+
+    # several media types can share a filter
+    message_filters = dict.fromkeys(MEDIA_SEARCH_FILTERS[it] for it in media_types)
+    searches = [
+        _search_history(client, chat_id, it(), max(offset_id, 1), max_id)
+        for it in message_filters
+    ]
+    # the next message of every search that is not done
+    heads: Dict[int, "types.Message"] = {}
+
+    async def _next(idx: int):
+        try:
+            # anext() is python 3.10 and later
+            # pylint: disable = C2801
+            heads[idx] = await searches[idx].__anext__()
+        except StopAsyncIteration:
+            heads.pop(idx, None)
+
+    try:
+        await asyncio.gather(*(_next(idx) for idx in range(len(searches))))
+        last_id = 0
+        while heads:
+            idx = min(heads, key=lambda it: heads[it].id)
+            message = heads[idx]
+            if message.id != last_id:
+                last_id = message.id
+                yield message
+            await _next(idx)
+    finally:
+        for search in searches:
+            await search.aclose()
@@ -0,0 +1,94 @@
+"""Sets of integers stored as intervals"""
+
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+
+class IntervalSet:
+    """Set of integers stored as sorted, merged closed intervals
+
+    Message ids come in long runs, so a set of ids takes two integers per
+    run instead of one entry per id, and membership is a binary search.
+    """
+
+    def __init__(self, intervals: Iterable[Sequence[int]] = ()):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        for start, end in intervals:
+            self.add_range(start, end)
+
+    @classmethod
+    def load(cls, items: Iterable[Union[int, Sequence[int]]]) -> "IntervalSet":
+        """Read a set saved as intervals, or as a list of ids by older versions"""
+        interval_set = cls()
+        for item in items or []:
+            if isinstance(item, int):
+                interval_set.add(item)
+            else:
+                interval_set.add_range(*item)
+        return interval_set
+
+    def __contains__(self, value: int) -> bool:
+        idx = bisect_right(self._starts, value) - 1
+        return idx >= 0 and value <= self._ends[idx]
+
+    def __bool__(self) -> bool:
+        return bool(self._starts)
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    @property
+    def intervals(self) -> List[List[int]]:
+        """The intervals as `[[start, end], ...]`"""
+        return [[start, end] for start, end in zip(self._starts, self._ends)]
+
+    def first(self) -> Optional[Tuple[int, int]]:
+        """The lowest interval, `None` if the set is empty"""
+        if not self._starts:
+            return None
+        return self._starts[0], self._ends[0]
+
+    def add(self, value: int):
+        """Add `value`"""
+        self.add_range(value, value)
+
+    def add_range(self, start: int, end: int):
+        """Add every integer from `start` to `end`, both included"""
+        if start > end:
+            return
+
+        # intervals overlapping or touching [start, end]
+        lo = bisect_left(self._ends, start - 1)
+        hi = bisect_right(self._starts, end + 1)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def discard(self, value: int):
+        """Remove `value` if present"""
+        self.remove_range(value, value)
+
+    def remove_range(self, start: int, end: int):
+        """Remove every integer from `start` to `end`, both included"""
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo >= hi:
+            return
+
+        starts: List[int] = []
+        ends: List[int] = []
+        if self._starts[lo] < start:
+            starts.append(self._starts[lo])
+            ends.append(start - 1)
+        if self._ends[hi - 1] > end:
+            starts.append(end + 1)
+            ends.append(self._ends[hi - 1])
+        self._starts[lo:hi] = starts
+        self._ends[lo:hi] = ends
@@ -211,6 +211,31 @@ translations = {
         "не может быть скачен по следующей причине",
         "не може бути скачаний з наступної причини",
     ],
+    "Temp and save paths are on different filesystems, every file is copied after download": [
+        "临时目录和保存目录不在同一文件系统,每个文件下载后都会被复制",
+        "Временный каталог и каталог сохранения на разных файловых системах, каждый файл копируется после скачивания",
+        "Тимчасовий каталог і каталог збереження на різних файлових системах, кожен файл копіюється після скачування",
+    ],
+    "Linked stored media": [
+        "已链接已保存的媒体",
+        "Связан сохраненный медиафайл",
+        "Пов'язано збережений медіафайл",
+    ],
+    "link stored media failed": [
+        "链接已保存的媒体失败",
+        "не удалось связать сохраненный медиафайл",
+        "не вдалося пов'язати збережений медіафайл",
+    ],
+    "Media types can not be searched, the whole history is read": [
+        "媒体类型无法搜索，将读取全部聊天记录",
+        "типы медиа нельзя найти поиском, читается вся история",
+        "типи медіа не можна знайти пошуком, читається вся історія",
+    ],
+    "save checkpoint failed": [
+        "保存进度检查点失败",
+        "не удалось сохранить контрольную точку",
+        "не вдалося зберегти контрольну точку",
+    ],
     "Downloading files failed during last run": [
         "下载最后一次运行失败的文件",
         "Скачивание файлов не удалось во время последнего запуска",
@@ -287,6 +312,11 @@ translations = {
         "Установить рекламу",
         "Встановити рекламу",
     ],
+    "Resume download": [
+        "继续下载",
+        "Возобновление загрузки",
+        "Відновлення завантаження",
+    ],
 }
 
 
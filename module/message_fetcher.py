@@ -0,0 +1,112 @@
+"""Batched refetch of messages"""
+
+import asyncio
+from itertools import islice
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple, Union
+
+import pyrogram
+from loguru import logger
+
+# telegram returns at most 200 messages for one `get_messages`
+MAX_BATCH_SIZE = 200
+
+_Key = Tuple[pyrogram.Client, Union[int, str]]
+# requested ids of a chat and the futures of their callers
+_Pending = List[Tuple[int, "asyncio.Future[Optional[pyrogram.types.Message]]"]]
+
+
+class BatchMessageFetcher:
+    """Collect single message refetches into `get_messages` batches
+
+    Requests for the same chat arriving within `window` seconds are sent as
+    one `get_messages` call of up to `batch_size` ids, each caller gets its
+    own message back.
+    """
+
+    def __init__(self, window: float = 0.05, batch_size: int = MAX_BATCH_SIZE):
+        self.window = window
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self._pending: Dict[_Key, _Pending] = {}
+
+    async def fetch(
+        self, client: pyrogram.Client, chat_id: Union[int, str], message_id: int
+    ) -> Optional[pyrogram.types.Message]:
+        """Fetch one message through the next batch of its chat"""
+        key = (client, chat_id)
+        future: "asyncio.Future[Optional[pyrogram.types.Message]]" = (
+            asyncio.get_event_loop().create_future()
+        )
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = []
+            asyncio.ensure_future(self._flush_later(key, pending))
+
+        pending.append((message_id, future))
+        if len(pending) >= self.batch_size:
+            self._pending.pop(key, None)
+            asyncio.ensure_future(self._flush(key, pending))
+
+        return await future
+
+    async def _flush_later(self, key: _Key, pending: _Pending):
+        """Send the batch of a chat once its window is over"""
+        await asyncio.sleep(self.window)
+        # already sent because the batch was full
+        if self._pending.get(key) is pending:
+            del self._pending[key]
+            await self._flush(key, pending)
+
+    async def _flush(self, key: _Key, pending: _Pending):
+        """Fetch a batch with one call and hand every caller its message"""
+        client, chat_id = key
+        try:
+            messages = await client.get_messages(
+                chat_id=chat_id,
+                message_ids=list(dict.fromkeys(it[0] for it in pending)),
+            )
+            result = {it.id: it for it in messages if it and not it.empty}  # type: ignore
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for message_id, future in pending:
+            if not future.done():
+                future.set_result(result.get(message_id))
+
+    async def iter_messages(
+        self,
+        client: pyrogram.Client,
+        chat_id: Union[int, str],
+        message_ids: Iterable[int],
+    ) -> AsyncGenerator[pyrogram.types.Message, None]:
+        """Fetch a long id list batch by batch
+
+        Only one batch is in memory at a time, so a consumer waiting on a
+        full download queue also pauses the fetch. A failed batch is skipped,
+        its ids stay in the retry list for the next run.
+        """
+        ids = iter(message_ids)
+        while True:
+            batch = list(islice(ids, self.batch_size))
+            if not batch:
+                break
+            try:
+                messages = await client.get_messages(chat_id=chat_id, message_ids=batch)
+            except Exception as e:
+                logger.warning(
+                    f"Get messages {batch[0]}-{batch[-1]} of {chat_id} failed: {e}"
+                )
+                continue
+
+            for message in messages:  # type: ignore
+                yield message
+
+
+_message_fetcher = BatchMessageFetcher()
+
+
+def get_message_fetcher() -> BatchMessageFetcher:
+    """get global message fetcher"""
+    return _message_fetcher
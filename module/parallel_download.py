@@ -0,0 +1,232 @@
+"""Parallel segmented download of a single media file"""
+
+import asyncio
+import inspect
+import math
+import os
+from typing import Callable, List, Optional, Tuple
+
+import pyrogram
+from loguru import logger
+from pyrogram.file_id import FileId
+
+from module.content_hash import get_current_hasher
+from module.download_journal import DownloadJournal
+from module.language import _t
+
+# pyrogram `get_file` offsets and limits are counted in 1 MB chunks
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_segment_count(file_size: int, max_segments: int, min_segment_size: int) -> int:
+    """Get how many segments a file should be split into.
+
+    Parameters
+    ----------
+    file_size: int
+        Size of the file in bytes
+
+    max_segments: int
+        Upper bound of parallel segments
+
+    min_segment_size: int
+        Smallest size in bytes worth a dedicated connection
+
+    Returns
+    -------
+    int
+        Segment count, 1 means the file is not worth splitting
+    """
+    if not file_size or max_segments <= 1 or min_segment_size <= 0:
+        return 1
+
+    total_chunks = math.ceil(file_size / CHUNK_SIZE)
+    segment_count = min(max_segments, file_size // min_segment_size, total_chunks)
+    return max(1, segment_count)
+
+
+def split_segments(file_size: int, segment_count: int) -> List[Tuple[int, int]]:
+    """Split a file into chunk aligned byte ranges.
+
+    Parameters
+    ----------
+    file_size: int
+        Size of the file in bytes
+
+    segment_count: int
+        Number of segments
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        `(offset, limit)` of every segment, both counted in chunks
+    """
+    total_chunks = math.ceil(file_size / CHUNK_SIZE)
+    if not total_chunks:
+        return []
+
+    segment_count = max(1, min(segment_count, total_chunks))
+    base, extra = divmod(total_chunks, segment_count)
+
+    segments: List[Tuple[int, int]] = []
+    offset = 0
+    for idx in range(segment_count):
+        limit = base + (1 if idx < extra else 0)
+        segments.append((offset, limit))
+        offset += limit
+
+    return segments
+
+
+def _preallocate(file_path: str, file_size: int):
+    """Create the file with its final size so segments can write in place
+
+    The blocks are reserved with `fallocate` where the platform and the
+    filesystem support it, so the file does not fragment while segments
+    fill it out of order. Otherwise it is only extended to its size.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(file_path, "wb") as f:
+        if file_size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, file_size)
+                return
+            except OSError:
+                pass
+        f.truncate(file_size)
+
+
+def _write_at(fd: int, data: bytes, offset: int):
+    """Write `data` at `offset` without moving a shared file position"""
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+
+    # no await between seek and write, other segments can not interleave
+    os.lseek(fd, offset, os.SEEK_SET)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+# pylint: disable = R0913,R0914
+async def download_segmented(
+    client: pyrogram.Client,
+    file_id: str,
+    file_size: int,
+    file_path: str,
+    segment_count: int,
+    progress: Callable = None,
+    progress_args: tuple = (),
+) -> Optional[str]:
+    """
+    Download a file over several connections at the same time.
+
+    The file is preallocated and split into chunk aligned ranges, every
+    range is fetched by its own `get_file` call (one media session each)
+    and written at its offset with positional writes on one descriptor.
+    Verified chunks are recorded in a `DownloadJournal` next to the file,
+    so a later call for the same media only fetches the chunks that are
+    still missing.
+
+    Parameters:
+        client (pyrogram.Client): The client used to fetch the file.
+        file_id (str): The media `file_id`.
+        file_size (int): The media size in bytes.
+        file_path (str): Where to write the file.
+        segment_count (int): How many ranges to fetch in parallel.
+        progress (Callable): Same as pyrogram `download_media` progress.
+        progress_args (tuple): Extra arguments passed to `progress`.
+
+    Returns:
+        The file path, or None if the transmission was stopped.
+
+    Raises:
+        Any error raised by `get_file`, e.g. `FloodWait` or `BadRequest`.
+        The partial file and its journal are kept for the next attempt.
+    """
+    decoded_file_id = FileId.decode(file_id)
+    segments = split_segments(file_size, segment_count)
+
+    journal = DownloadJournal(
+        file_path, file_size, getattr(decoded_file_id, "media_id", 0), CHUNK_SIZE
+    )
+    resume = journal.load()
+    if resume:
+        logger.info(
+            f"{_t('Resume download')} {file_path}: "
+            f"{len(journal.done_chunks)}/{journal.total_chunks}"
+        )
+    else:
+        _preallocate(file_path, file_size)
+    journal.open(resume)
+
+    # chunks of an earlier attempt are not fetched again, their digests are
+    # taken from the journal
+    hasher = get_current_hasher()
+    if hasher:
+        for idx, digest in journal.chunk_digests.items():
+            hasher.set_chunk_digest(idx, digest)
+
+    downloaded_size = journal.done_size()
+
+    async def _download_range(fd: int, offset: int, limit: int):
+        nonlocal downloaded_size
+        idx = offset
+        async for chunk in client.get_file(decoded_file_id, file_size, limit, offset):
+            _write_at(fd, chunk, idx * CHUNK_SIZE)
+            digest = hasher.get_chunk_digest(idx) if hasher else None
+            if not journal.record(idx, len(chunk), digest):
+                raise pyrogram.errors.exceptions.bad_request_400.BadRequest(
+                    f"chunk {idx} of {file_path} has wrong size {len(chunk)}"
+                )
+            idx += 1
+            downloaded_size += len(chunk)
+
+            if progress:
+                func = progress(
+                    min(downloaded_size, file_size), file_size, *progress_args
+                )
+                if inspect.isawaitable(func):
+                    await func
+
+    async def _download_segment(fd: int, offset: int, limit: int):
+        for run_offset, run_limit in journal.missing_runs(offset, limit):
+            await _download_range(fd, run_offset, run_limit)
+
+    fd = os.open(file_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    tasks = [
+        asyncio.ensure_future(_download_segment(fd, offset, limit))
+        for offset, limit in segments
+    ]
+
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        journal.close()
+
+        if isinstance(e, pyrogram.StopTransmission):
+            return None
+        raise e
+    finally:
+        os.close(fd)
+
+    if not journal.is_complete():
+        journal.close()
+        raise pyrogram.errors.exceptions.bad_request_400.BadRequest(
+            f"{file_path} is incomplete: "
+            f"{len(journal.done_chunks)}/{journal.total_chunks}"
+        )
+
+    journal.remove()
+    return file_path
@@ -1,7 +1,11 @@
 """Pyrogram ext"""
 
 import asyncio
+import base64
+import functools
 import html
+import inspect
+import json
 import os
 import secrets
 import struct
@@ -11,18 +15,19 @@ from datetime import datetime
 from functools import wraps
 from io import BytesIO, StringIO
 from mimetypes import MimeTypes
-from typing import Callable, Iterable, List, Optional, Tuple, Union
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import pyrogram
 from loguru import logger
 from pyrogram import enums, parser, types, utils
-from pyrogram.client import Cache
 from pyrogram.enums import MessageEntityType
 from pyrogram.file_id import (
     FILE_REFERENCE_FLAG,
     PHOTO_TYPES,
     WEB_LOCATION_FLAG,
+    FileId,
     FileType,
+    ThumbnailSource,
     b64_decode,
     rle_decode,
 )
@@ -37,8 +42,19 @@ from module.app import (
     UploadProgressStat,
     UploadStatus,
 )
+from module.concurrency import ConcurrencyController
+from module.content_hash import get_current_hasher
 from module.download_stat import get_download_result
+from module.file_index import get_file_index
+from module.file_reference_cache import get_file_reference_cache
 from module.language import Language, _t
+from module.message_fetcher import get_message_fetcher
+from module.rate_limiter import (
+    RateFamily,
+    RateLimiter,
+    get_query_family,
+    get_rate_limiter,
+)
 from module.send_media_group_v2 import cache_media, send_media_group_v2
 from utils.format import (
     create_progress_bar,
@@ -50,12 +66,13 @@ from utils.meta_data import MetaData
 
 _mimetypes = MimeTypes()
 _mimetypes.readfp(StringIO(mime_types))
-_download_cache = Cache(1024 * 1024 * 1024)
+# (chat_id, message_id) of the running downloads
+_downloading: Set[Tuple[Union[int, str], int]] = set()
 
 
 def reset_download_cache():
     """Reset download cache"""
-    _download_cache.store.clear()
+    _downloading.clear()
 
 
 def _guess_mime_type(filename: str) -> Optional[str]:
@@ -144,8 +161,8 @@ def get_media_obj(
     return None
 
 
-def _get_file_type(file_id: str):
-    """Get file type"""
+def _unpack_file_id(file_id: str) -> Tuple[int, int]:
+    """Get the raw file type and the DC id encoded in `file_id`"""
     decoded = rle_decode(b64_decode(file_id))
 
     # File id versioning. Major versions lower than 4 don't have a minor version
@@ -156,7 +173,13 @@ def _get_file_type(file_id: str):
     else:
         buffer = BytesIO(decoded[:-2])
 
-    file_type, _ = struct.unpack("<ii", buffer.read(8))
+    file_type, dc_id = struct.unpack("<ii", buffer.read(8))
+    return file_type, dc_id
+
+
+def _get_file_type(file_id: str):
+    """Get file type"""
+    file_type, _ = _unpack_file_id(file_id)
 
     file_type &= ~WEB_LOCATION_FLAG
     file_type &= ~FILE_REFERENCE_FLAG
@@ -169,6 +192,21 @@ def _get_file_type(file_id: str):
     return file_type
 
 
+def get_media_dc_id(message: pyrogram.types.Message) -> int:
+    """Get the DC storing the media of `message`, 0 if it has none"""
+    media_type = getattr(message.media, "value", None)
+    media = getattr(message, media_type, None) if isinstance(media_type, str) else None
+    file_id = getattr(media, "file_id", None)
+    if not isinstance(file_id, str) or not file_id:
+        return 0
+
+    try:
+        _, dc_id = _unpack_file_id(file_id)
+    except Exception:
+        return 0
+    return dc_id
+
+
 def get_extension(file_id: str, mime_type: str, dot: bool = True) -> str:
     """Get extension"""
 
@@ -239,7 +277,10 @@ async def download_thumbnail(
     """
     thumbnail_file = None
     if message.video.thumbs:
-        message = await fetch_message(client, message)
+        # the message is fetched again only if its file reference is stale
+        message = await get_file_reference_cache().fetch(
+            client, message.chat.id, message.id
+        )
         thumbnail = message.video.thumbs[0] if message.video.thumbs else None
         unique_name = os.path.join(
             temp_path,
@@ -315,6 +356,7 @@ async def upload_telegram_chat(
             finally:
                 if file_name and app.after_upload_telegram_delete:
                     os.remove(file_name)
+                    get_file_index().remove(file_name)
 
             # forward text
             # FIXME: fix upload text
@@ -346,10 +388,10 @@ async def upload_telegram_chat_message(
             )
             break
         except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
-            await asyncio.sleep(wait_err.value * 2)
             logger.warning(
                 "Upload Message[{}]: FlowWait {}", message.id, wait_err.value
             )
+            await get_rate_limiter().on_flood_wait(RateFamily.Forward, wait_err.value)
         except Exception as e:
             logger.exception(f"Upload file {file_name} error: {e}")
             return ForwardStatus.FailedForward
@@ -723,7 +765,12 @@ async def _upload_telegram_chat_message(
     Returns:
         None
     """
-    await app.forward_limit_call.wait(node)
+    if not await get_rate_limiter().acquire(
+        RateFamily.Forward,
+        node.upload_telegram_chat_id,
+        cancel=lambda: node.is_stop_transmission,
+    ):
+        return
 
     caption = await process_caption(
         client,
@@ -991,16 +1038,17 @@ def record_download_status(func):
         file_formats: dict,
         node: TaskNode,
     ):
-        if _download_cache[(node.chat_id, message.id)] is DownloadStatus.Downloading:
+        key = (node.chat_id, message.id)
+        if key in _downloading:
             return DownloadStatus.Downloading, None
 
-        _download_cache[(node.chat_id, message.id)] = DownloadStatus.Downloading
-
-        status, file_name = await func(client, message, media_types, file_formats, node)
-
-        _download_cache[(node.chat_id, message.id)] = status
+        _downloading.add(key)
 
-        return status, file_name
+        try:
+            return await func(client, message, media_types, file_formats, node)
+        finally:
+            # a task retried later must not look like it is still downloading
+            _downloading.discard(key)
 
     return inner
 
@@ -1182,11 +1230,21 @@ async def _report_bot_status(
 
 
 def set_max_concurrent_transmissions(
-    client: pyrogram.Client, max_concurrent_transmissions: int
+    client: pyrogram.Client,
+    max_concurrent_transmissions: int,
+    controller: Optional[ConcurrencyController] = None,
 ):
-    """Set maximum concurrent transmissions"""
+    """Set maximum concurrent transmissions
+
+    With a `controller` the transmission semaphores follow the limit
+    adjusted by it instead of the fixed `max_concurrent_transmissions`.
+    """
     if getattr(client, "max_concurrent_transmissions", None):
         client.max_concurrent_transmissions = max_concurrent_transmissions
+        if controller:
+            client.save_file_semaphore = controller.add_transmission_semaphore()
+            client.get_file_semaphore = controller.add_transmission_semaphore()
+            return
         client.save_file_semaphore = asyncio.Semaphore(
             client.max_concurrent_transmissions
         )
@@ -1204,13 +1262,20 @@ async def fetch_message(client: pyrogram.Client, message: pyrogram.types.Message
      Returns:
         pyrogram.types.Message: A message object retrieved from the specified chat.
     """
-    return await client.get_messages(
-        chat_id=message.chat.id,
-        message_ids=message.id,
-    )
-
-
-async def retry(func: Callable, args: tuple = (), max_attempts=3, wait_second=15):
+    chat_id = message.chat.id
+    message = await get_message_fetcher().fetch(client, chat_id, message.id)
+    if message:
+        get_file_reference_cache().put(client, chat_id, message)
+    return message
+
+
+async def retry(
+    func: Callable,
+    args: tuple = (),
+    max_attempts=3,
+    wait_second=15,
+    family: RateFamily = RateFamily.Default,
+):
     """
     Asynchronously retries the provided function
     a specified number of times with a specified wait time between retries.
@@ -1221,6 +1286,8 @@ async def retry(func: Callable, args: tuple = (), max_attempts=3, wait_second=15
         Defaults to 3.
     :param wait_second: The wait time in seconds between each retry attempt.
         Defaults to 15.
+    :param family: The rate family paused on FloodWait.
+        Defaults to RateFamily.Default.
 
     :return: The result of the function
     if it succeeds within the maximum number of attempts, otherwise None.
@@ -1231,7 +1298,7 @@ async def retry(func: Callable, args: tuple = (), max_attempts=3, wait_second=15
             return await func(*args)
         except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
             logger.warning("bad call retry: FlowWait {}", wait_err.value)
-            await asyncio.sleep(wait_err.value)
+            await get_rate_limiter().on_flood_wait(family, wait_err.value)
         except Exception as e:
             logger.exception("Error: {}", e)
             await asyncio.sleep(wait_second)
@@ -1436,6 +1503,215 @@ class HookSession(pyrogram.session.Session):
         self.START_TIMEOUT = start_timeout
 
 
+class MediaSessionPool:
+    """Warm media sessions of one client, per DC
+
+    pyrogram opens a new media session for every `get_file` and, for a DC
+    other than the home one, creates a new auth key and imports an exported
+    authorization into it first. Here a session goes back to the pool once
+    its download is done, and the authorized key of every DC is saved next
+    to the session file, so the sessions of the DCs used by the last run
+    are opened again at startup without any authorization round trip.
+    """
+
+    # idle sessions kept per DC, the others are closed
+    MAX_IDLE_SESSIONS = 4
+
+    def __init__(self, client: pyrogram.Client):
+        self.client = client
+        self._idle: Dict[int, List[HookSession]] = {}
+        self._auth_keys: Dict[int, bytes] = {}
+        self._auth_locks: Dict[int, asyncio.Lock] = {}
+        self._active: Set[HookSession] = set()
+        self._loaded = False
+
+    @property
+    def auth_file(self) -> Optional[str]:
+        """Where the media auth keys are saved, `None` for in memory clients"""
+        if getattr(self.client, "in_memory", True):
+            return None
+        return os.path.join(self.client.workdir, f"{self.client.name}.media_auth")
+
+    def load(self):
+        """Load the auth keys saved by the last run"""
+        self._loaded = True
+        if not self.auth_file or not os.path.exists(self.auth_file):
+            return
+
+        try:
+            with open(self.auth_file, "r", encoding="utf-8") as f:
+                auth_keys = json.load(f)
+            self._auth_keys = {
+                int(dc_id): base64.b64decode(auth_key)
+                for dc_id, auth_key in auth_keys.items()
+            }
+        except Exception as e:
+            logger.warning(f"load {self.auth_file} failed: {e}")
+            self._auth_keys = {}
+
+    def save(self):
+        """Save the auth keys, readable only by the owner like the session"""
+        if not self.auth_file:
+            return
+
+        auth_keys = {
+            str(dc_id): base64.b64encode(auth_key).decode()
+            for dc_id, auth_key in self._auth_keys.items()
+        }
+        try:
+            fd = os.open(self.auth_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(auth_keys, f)
+        except Exception as e:
+            logger.warning(f"save {self.auth_file} failed: {e}")
+
+    async def _new_session(self, dc_id: int, auth_key: bytes) -> HookSession:
+        session = HookSession(
+            self.client,
+            dc_id,
+            auth_key,
+            await self.client.storage.test_mode(),
+            is_media=True,
+        )
+        session.start_timeout(getattr(self.client, "START_TIME_OUT", 60))
+        await session.start()
+        return session
+
+    async def _authorize(self, dc_id: int) -> HookSession:
+        """Open a session on a foreign DC with a new authorized key"""
+        test_mode = await self.client.storage.test_mode()
+        auth_key = await pyrogram.session.Auth(self.client, dc_id, test_mode).create()
+        session = await self._new_session(dc_id, auth_key)
+        try:
+            exported_auth = await self.client.invoke(
+                pyrogram.raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+            )
+            await session.invoke(
+                pyrogram.raw.functions.auth.ImportAuthorization(
+                    id=exported_auth.id, bytes=exported_auth.bytes
+                )
+            )
+        except Exception:
+            await session.stop()
+            raise
+
+        self._auth_keys[dc_id] = auth_key
+        self.save()
+        return session
+
+    async def acquire(self, dc_id: int) -> HookSession:
+        """Borrow a started media session of `dc_id`"""
+        if not self._loaded:
+            self.load()
+
+        idle = self._idle.get(dc_id)
+        if idle:
+            session = idle.pop()
+        elif dc_id == await self.client.storage.dc_id():
+            session = await self._new_session(
+                dc_id, await self.client.storage.auth_key()
+            )
+        else:
+            lock = self._auth_locks.setdefault(dc_id, asyncio.Lock())
+            async with lock:
+                auth_key = self._auth_keys.get(dc_id)
+                if auth_key:
+                    session = await self._new_session(dc_id, auth_key)
+                else:
+                    session = await self._authorize(dc_id)
+
+        self._active.add(session)
+        return session
+
+    def release(self, session: HookSession):
+        """Give back a session borrowed by `acquire`"""
+        self._active.discard(session)
+        idle = self._idle.setdefault(session.dc_id, [])
+        if len(idle) < self.MAX_IDLE_SESSIONS:
+            idle.append(session)
+        else:
+            asyncio.ensure_future(session.stop())
+
+    async def discard(self, session: HookSession, key_revoked: bool = True):
+        """Close a failed session instead of giving it back
+
+        If `key_revoked`, the auth key was rejected: the idle sessions of
+        the DC are closed too and the key is forgotten.
+        """
+        self._active.discard(session)
+        if key_revoked:
+            for it in self._idle.pop(session.dc_id, []):
+                await it.stop()
+        await session.stop()
+        if key_revoked and self._auth_keys.pop(session.dc_id, None):
+            self.save()
+
+    async def prewarm(self):
+        """Open one session for every DC saved by the last run"""
+        if not self._loaded:
+            self.load()
+
+        async def _prewarm(dc_id: int):
+            try:
+                self.release(await self.acquire(dc_id))
+            except Exception as e:
+                logger.warning(f"prewarm media session of DC {dc_id} failed: {e}")
+
+        await asyncio.gather(*[_prewarm(dc_id) for dc_id in list(self._auth_keys)])
+
+    async def stop(self):
+        """Close all sessions"""
+        sessions = list(self._active)
+        for idle in self._idle.values():
+            sessions.extend(idle)
+        self._active.clear()
+        self._idle.clear()
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception as e:
+                logger.debug(f"stop media session failed: {e}")
+
+
+def get_file_location(file_id: FileId):
+    """Input location of a decoded `file_id`, the same as pyrogram `get_file`"""
+    file_type = file_id.file_type
+
+    if file_type == FileType.CHAT_PHOTO:
+        if file_id.chat_id > 0:
+            peer = pyrogram.raw.types.InputPeerUser(
+                user_id=file_id.chat_id, access_hash=file_id.chat_access_hash
+            )
+        elif file_id.chat_access_hash == 0:
+            peer = pyrogram.raw.types.InputPeerChat(chat_id=-file_id.chat_id)
+        else:
+            peer = pyrogram.raw.types.InputPeerChannel(
+                channel_id=utils.get_channel_id(file_id.chat_id),
+                access_hash=file_id.chat_access_hash,
+            )
+
+        return pyrogram.raw.types.InputPeerPhotoFileLocation(
+            peer=peer,
+            photo_id=file_id.media_id,
+            big=file_id.thumbnail_source == ThumbnailSource.CHAT_PHOTO_BIG,
+        )
+
+    if file_type == FileType.PHOTO:
+        return pyrogram.raw.types.InputPhotoFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size,
+        )
+
+    return pyrogram.raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size,
+    )
+
+
 # pylint: disable=all
 class HookClient(pyrogram.Client):
     """Hook Client"""
@@ -1450,8 +1726,33 @@ class HookClient(pyrogram.Client):
                 self.START_TIME_OUT = value
             kwargs.pop("start_timeout")
 
+        self.rate_limiter: Optional[RateLimiter] = kwargs.pop("rate_limiter", None)
+
         super().__init__(name, **kwargs)
 
+        self.media_session_pool = MediaSessionPool(self)
+
+    async def invoke(self, query, *args, **kwargs):
+        """
+        Invokes a raw function through the rate limiter.
+
+        Forwarded messages are metered once per message by the upload,
+        here they only wait while the forward circuit is open. A FloodWait
+        opens the circuit of the family before it is raised.
+        """
+        rate_limiter = get_rate_limiter(self)
+        family = get_query_family(query)
+        if family is RateFamily.Forward:
+            await rate_limiter.wait(family)
+        else:
+            await rate_limiter.acquire(family)
+
+        try:
+            return await super().invoke(query, *args, **kwargs)
+        except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
+            rate_limiter.flood_wait(family, wait_err.value)
+            raise
+
     async def connect(
         self,
     ) -> bool:
@@ -1513,9 +1814,122 @@ class HookClient(pyrogram.Client):
         else:
             self.me = await self.get_me()
             await self.initialize()
+            await self.media_session_pool.prewarm()
 
             return self
 
+    async def terminate(self):
+        """Close the pooled media sessions before terminating the client"""
+        await self.media_session_pool.stop()
+        await super().terminate()
+
+    # pylint: disable=R0912
+    async def get_file(
+        self,
+        file_id: FileId,
+        file_size: int = 0,
+        limit: int = 0,
+        offset: int = 0,
+        progress: Callable = None,
+        progress_args: tuple = (),
+    ):
+        """
+        Download a file through a pooled media session of its DC.
+
+        Same as pyrogram `get_file`, except that the media session is
+        borrowed from `media_session_pool` and errors are raised instead of
+        logged. A CDN redirect falls back to pyrogram `get_file`. Every
+        chunk is hashed by the hasher of the running download, if any.
+        """
+        chunk_size = 1024 * 1024
+        total = abs(limit) or (1 << 31) - 1
+        offset_bytes = abs(offset) * chunk_size
+        current = 0
+        retried = False
+        cdn_redirect = False
+        hasher = get_current_hasher()
+
+        async with self.get_file_semaphore:
+            location = get_file_location(file_id)
+            session = await self.media_session_pool.acquire(file_id.dc_id)
+            # a failed session is discarded, only a working one goes back
+            session_ok = True
+            try:
+                while current < total:
+                    try:
+                        r = await session.invoke(
+                            pyrogram.raw.functions.upload.GetFile(
+                                location=location,
+                                offset=offset_bytes,
+                                limit=chunk_size,
+                            ),
+                            sleep_threshold=30,
+                        )
+                    except pyrogram.errors.Unauthorized:
+                        # the saved auth key was revoked, authorize again once
+                        session_ok = False
+                        await self.media_session_pool.discard(session)
+                        if current or retried:
+                            raise
+                        retried = True
+                        session = await self.media_session_pool.acquire(file_id.dc_id)
+                        session_ok = True
+                        continue
+                    except pyrogram.errors.RPCError:
+                        # telegram answered, the session itself works
+                        raise
+                    except BaseException:
+                        # the connection may be broken, never hand it out again
+                        session_ok = False
+                        await self.media_session_pool.discard(
+                            session, key_revoked=False
+                        )
+                        raise
+
+                    if not isinstance(r, pyrogram.raw.types.upload.File):
+                        cdn_redirect = True
+                        break
+
+                    chunk = r.bytes
+                    if hasher:
+                        hasher.update(offset_bytes // chunk_size, chunk)
+                    yield chunk
+
+                    current += 1
+                    offset_bytes += chunk_size
+
+                    if progress:
+                        func = functools.partial(
+                            progress,
+                            min(offset_bytes, file_size) if file_size else offset_bytes,
+                            file_size,
+                            *progress_args,
+                        )
+                        if inspect.iscoroutinefunction(progress):
+                            await func()
+                        else:
+                            await self.loop.run_in_executor(self.executor, func)
+
+                    if len(chunk) < chunk_size:
+                        break
+            finally:
+                if session_ok:
+                    self.media_session_pool.release(session)
+
+        if cdn_redirect:
+            async for chunk in super().get_file(
+                file_id,
+                file_size,
+                total - current if limit else 0,
+                offset_bytes // chunk_size,
+                progress,
+                progress_args,
+            ):
+                if hasher:
+                    hasher.update(offset_bytes // chunk_size, chunk)
+                offset_bytes += len(chunk)
+                yield chunk
+
 
 # pylint: disable=R0914,R0913
 async def forward_messages(
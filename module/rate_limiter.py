@@ -0,0 +1,215 @@
+"""Rate limit of telegram calls"""
+
+import asyncio
+import time
+from enum import Enum
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from loguru import logger
+
+
+class RateFamily(Enum):
+    """Family of telegram methods sharing one limit"""
+
+    Forward = 1
+    History = 2
+    File = 3
+    Default = 4
+
+
+_QUERY_FAMILY: Dict[str, RateFamily] = {
+    "functions.messages.SendMessage": RateFamily.Forward,
+    "functions.messages.SendMedia": RateFamily.Forward,
+    "functions.messages.SendMultiMedia": RateFamily.Forward,
+    "functions.messages.ForwardMessages": RateFamily.Forward,
+    "functions.messages.GetHistory": RateFamily.History,
+    "functions.messages.Search": RateFamily.History,
+    "functions.messages.GetMessages": RateFamily.History,
+    "functions.channels.GetMessages": RateFamily.History,
+    "functions.upload.GetFile": RateFamily.File,
+    "functions.upload.SaveFilePart": RateFamily.File,
+    "functions.upload.SaveBigFilePart": RateFamily.File,
+}
+
+
+def get_query_family(query) -> RateFamily:
+    """Get the family of a raw telegram function"""
+    return _QUERY_FAMILY.get(getattr(query, "QUALNAME", ""), RateFamily.Default)
+
+
+# longest sleep between two checks of a cancel predicate
+_CANCEL_CHECK_INTERVAL = 1.0
+
+
+async def _sleep(delay: float, cancel: Optional[Callable[[], bool]] = None) -> bool:
+    """Sleep `delay` seconds, return False as soon as `cancel()` is true"""
+    deadline = time.monotonic() + delay
+    while True:
+        if cancel and cancel():
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        if cancel:
+            remaining = min(remaining, _CANCEL_CHECK_INTERVAL)
+        await asyncio.sleep(remaining)
+
+
+class TokenBucket:
+    """Async token bucket with a circuit opened by FloodWait
+
+    Every `acquire` reserves a token and sleeps exactly until it is
+    available, so waiting callers do not poll. While the circuit is open
+    all callers wait until it closes.
+    """
+
+    def __init__(self, rate: float = 0, capacity: float = 1):
+        """
+        Args:
+            rate (float): Tokens per second, 0 means unlimited.
+            capacity (float): Maximum burst.
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self.open_until: float = 0
+
+    def _refill(self, now: float):
+        """Add the tokens earned since the last refill"""
+        if self.rate > 0:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last_time) * self.rate
+            )
+        self.last_time = now
+
+    def reserve(self) -> float:
+        """Reserve a token and return the seconds to wait for it"""
+        now = time.monotonic()
+        delay = self.circuit_delay(now)
+        if self.rate <= 0:
+            return delay
+
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens < 0:
+            delay = max(delay, -self.tokens / self.rate)
+        return delay
+
+    def circuit_delay(self, now: Optional[float] = None) -> float:
+        """Seconds until the circuit closes"""
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.open_until - now)
+
+    def open_circuit(self, seconds: float):
+        """Block all callers for `seconds`"""
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+
+    async def wait(self):
+        """Wait while the circuit is open"""
+        delay = self.circuit_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire(self, cancel: Optional[Callable[[], bool]] = None) -> bool:
+        """Wait for a token
+
+        Returns False and gives the token back once `cancel()` is true.
+        """
+        if not await _sleep(self.reserve(), cancel):
+            if self.rate > 0:
+                self.tokens = min(self.capacity, self.tokens + 1)
+            return False
+        # the circuit may have been opened while sleeping
+        return await _sleep(self.circuit_delay(), cancel)
+
+
+class RateLimiter:
+    """Token buckets per method family and per destination chat"""
+
+    def __init__(self):
+        self._rates: Dict[RateFamily, float] = {}
+        self._chat_rates: Dict[RateFamily, float] = {}
+        self._buckets: Dict[Tuple[RateFamily, Union[int, str, None]], TokenBucket] = {}
+
+    def set_rate(self, family: RateFamily, rate: float, chat_rate: float = 0):
+        """Set the limit of a family
+
+        Args:
+            family (RateFamily): The method family.
+            rate (float): Calls per minute of the family, 0 means unlimited.
+            chat_rate (float): Calls per minute to one chat, 0 means unlimited.
+        """
+        self._rates[family] = rate
+        self._chat_rates[family] = chat_rate
+        for (bucket_family, chat_id), bucket in self._buckets.items():
+            if bucket_family is family:
+                bucket.rate = (chat_rate if chat_id is not None else rate) / 60
+
+    def get_bucket(
+        self, family: RateFamily, chat_id: Union[int, str, None] = None
+    ) -> TokenBucket:
+        """Get the bucket of a family, or of one chat in it"""
+        key = (family, chat_id)
+        bucket = self._buckets.get(key)
+        if not bucket:
+            if chat_id is None:
+                rate = self._rates.get(family, 0)
+            else:
+                rate = self._chat_rates.get(family, 0)
+            bucket = TokenBucket(rate / 60)
+            self._buckets[key] = bucket
+        return bucket
+
+    async def acquire(
+        self,
+        family: RateFamily,
+        chat_id: Union[int, str, None] = None,
+        cancel: Optional[Callable[[], bool]] = None,
+    ) -> bool:
+        """Wait for a call of `family`, to `chat_id` if given
+
+        Returns False as soon as `cancel()` is true, the call must not be made.
+        """
+        if not await self.get_bucket(family).acquire(cancel):
+            return False
+        if chat_id is not None and self._chat_rates.get(family, 0) > 0:
+            return await self.get_bucket(family, chat_id).acquire(cancel)
+        return True
+
+    async def wait(self, family: RateFamily):
+        """Wait while the circuit of `family` is open"""
+        await self.get_bucket(family).wait()
+
+    def flood_wait(self, family: RateFamily, seconds: float):
+        """Open the circuit of `family` for `seconds`
+
+        FloodWait applies to the whole account, so every caller of the
+        family waits instead of hitting the limit again.
+        """
+        bucket = self.get_bucket(family)
+        if bucket.circuit_delay() < seconds:
+            logger.debug(f"{family.name} calls paused for {seconds} seconds")
+        bucket.open_circuit(seconds)
+
+    def reset(self):
+        """Close all circuits and refill all buckets"""
+        self._buckets.clear()
+
+    async def on_flood_wait(self, family: RateFamily, seconds: float):
+        """Handle a FloodWait: open the circuit and wait until it closes"""
+        self.flood_wait(family, seconds)
+        await self.wait(family)
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter(client=None) -> RateLimiter:
+    """get rate limiter of `client`, the global one by default
+
+    Every account is limited on its own, an extra download account carries
+    its own `rate_limiter`.
+    """
+    return getattr(client, "rate_limiter", None) or _rate_limiter
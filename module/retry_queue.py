@@ -0,0 +1,91 @@
+"""Delayed retry of download tasks"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, List, Optional, Tuple
+
+
+class RetryLaterError(Exception):
+    """The task failed for a transient reason and should be retried later
+
+    Parameters
+    ----------
+    delay: Optional[float]
+        Seconds to wait before the retry, e.g. the value of a FloodWait.
+        `None` lets the caller use an exponential backoff.
+    reason: str
+        Message logged when the task runs out of retries.
+    """
+
+    def __init__(self, delay: Optional[float] = None, reason: str = ""):
+        super().__init__(reason)
+        self.delay = delay
+        self.reason = reason
+
+
+def get_backoff_delay(attempt: int, base: float, max_delay: float = 300) -> float:
+    """Exponential backoff with jitter
+
+    The delay doubles with every attempt up to `max_delay`, and a random
+    half of it is dropped so failed tasks do not come back all at once.
+
+    Parameters
+    ----------
+    attempt: int
+        Number of failed attempts, starting from 1
+    base: float
+        Delay of the first retry in seconds
+    max_delay: float
+        Upper bound of the delay in seconds
+
+    Returns
+    -------
+    float
+        Seconds to wait before the next attempt
+    """
+    delay = min(max_delay, base * 2.0 ** max(0, attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class DelayedRetryQueue:
+    """Timer heap of tasks waiting for their retry deadline
+
+    A failed task is parked here so its worker can take the next one,
+    `get` returns the tasks in deadline order once they are due.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._counter = itertools.count()
+        self._condition = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def put(self, item: Any, delay: float):
+        """Park `item` for `delay` seconds"""
+        async with self._condition:
+            deadline = time.monotonic() + max(0.0, delay)
+            heapq.heappush(self._heap, (deadline, next(self._counter), item))
+            self._condition.notify_all()
+
+    async def get(self) -> Any:
+        """Remove and return the next due task, wait until one is due"""
+        async with self._condition:
+            while True:
+                if not self._heap:
+                    await self._condition.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(self._heap)[2]
+
+                # woken up earlier when a task with a closer deadline arrives
+                try:
+                    await asyncio.wait_for(self._condition.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
@@ -0,0 +1,49 @@
+"""Base of the stores kept in a sqlite database"""
+
+import abc
+import os
+import sqlite3
+from typing import Optional
+
+
+class SqliteStore(abc.ABC):
+    """Lazily opened sqlite connection shared by the stores
+
+    The database is opened on first use, so a store can be created at
+    import time and pointed to its file once the config is loaded.
+    Subclasses create their tables in `_create_tables`.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection to the database, opened on first use"""
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path)
+            if self.db_path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    @abc.abstractmethod
+    def _create_tables(self, conn: sqlite3.Connection):
+        """Create the tables and indexes of the store if they do not exist"""
+
+    def open(self, db_path: str):
+        """Use the database at `db_path`"""
+        self.close()
+        self.db_path = db_path
+
+    def close(self):
+        """Close the database"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
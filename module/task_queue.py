@@ -0,0 +1,125 @@
+"""Priority queue for download tasks"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from module.app import TaskPriority
+
+
+class PriorityTaskQueue:
+    """Download task queue with one FIFO per priority class
+
+    `get` returns the head of the class with the best effective priority.
+    The effective priority of a waiting task improves by one class for every
+    `aging` seconds it waited, up to the listen forward class: bulk tasks are
+    delayed but never starve, and never overtake an interactive task. Classes
+    of the same effective priority are served oldest head first.
+
+    `maxsize` bounds every class on its own: a full bulk class makes the bulk
+    producer wait in `put` without blocking interactive tasks.
+
+    Inside a class the tasks wait in one FIFO per DC of their media. Up to
+    `dc_batch_size` tasks of the same DC are served in a row, so the media
+    sessions of that DC are reused, then the DC with the oldest task takes
+    over. `dc_batch_size` 0 serves the class in plain FIFO order.
+    """
+
+    def __init__(self, maxsize: int = 0, aging: float = 60.0, dc_batch_size: int = 0):
+        self.maxsize = maxsize
+        self.aging = aging
+        self.dc_batch_size = dc_batch_size
+        self._queues: Dict[TaskPriority, Dict[int, Deque[Tuple[float, Any]]]] = {
+            priority: {} for priority in TaskPriority
+        }
+        self._dc_id: Optional[int] = None
+        self._dc_served = 0
+        self._condition = asyncio.Condition()
+
+    def _class_size(self, priority: TaskPriority) -> int:
+        """Number of tasks waiting in the class `priority`, over all DCs"""
+        return sum(len(it) for it in self._queues[priority].values())
+
+    def qsize(self) -> int:
+        """Number of waiting tasks"""
+        return sum(self._class_size(it) for it in TaskPriority)
+
+    def empty(self) -> bool:
+        """If no task is waiting"""
+        return self.qsize() == 0
+
+    def full(self, priority: TaskPriority) -> bool:
+        """If the class `priority` is full"""
+        return 0 < self.maxsize <= self._class_size(priority)
+
+    def _effective_priority(
+        self, priority: TaskPriority, now: float
+    ) -> Tuple[float, float]:
+        """Effective priority of the head of a class and its enqueue time"""
+        enqueue_time = min(it[0][0] for it in self._queues[priority].values())
+        if self.aging <= 0:
+            return priority.value, enqueue_time
+
+        # aging never lifts a task into the interactive class
+        floor = min(priority.value, TaskPriority.ListenForward.value)
+        waited = now - enqueue_time
+        return max(floor, priority.value - waited / self.aging), enqueue_time
+
+    def _select(self) -> Optional[TaskPriority]:
+        """Select the class to serve next"""
+        now = time.monotonic()
+        selected: Optional[TaskPriority] = None
+        best = (0.0, 0.0)
+        for priority, tasks in self._queues.items():
+            if not tasks:
+                continue
+            value = self._effective_priority(priority, now)
+            if selected is None or value < best:
+                selected = priority
+                best = value
+        return selected
+
+    def _select_dc(self, dc_queues: Dict[int, Deque[Tuple[float, Any]]]) -> int:
+        """Select the DC to serve next inside a class"""
+        if self.dc_batch_size <= 0:
+            return min(dc_queues, key=lambda it: dc_queues[it][0][0])
+
+        if self._dc_id in dc_queues and (
+            self._dc_served < self.dc_batch_size or len(dc_queues) == 1
+        ):
+            self._dc_served += 1
+            return self._dc_id
+
+        # the batch is used up, the DC with the oldest task takes over
+        candidates = [it for it in dc_queues if it != self._dc_id] or list(dc_queues)
+        dc_id = min(candidates, key=lambda it: dc_queues[it][0][0])
+        self._dc_id = dc_id
+        self._dc_served = 1
+        return dc_id
+
+    async def put(
+        self, item: Any, priority: TaskPriority = TaskPriority.Bulk, dc_id: int = 0
+    ):
+        """Put a task of the media on `dc_id`, wait while its class is full"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self.full(priority))
+            dc_queues = self._queues[priority]
+            if dc_id not in dc_queues:
+                dc_queues[dc_id] = deque()
+            dc_queues[dc_id].append((time.monotonic(), item))
+            self._condition.notify_all()
+
+    async def get(self) -> Any:
+        """Remove and return the next task, wait while the queue is empty"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self.empty())
+            priority = self._select()
+            assert priority is not None
+            dc_queues = self._queues[priority]
+            dc_id = self._select_dc(dc_queues)
+            _, item = dc_queues[dc_id].popleft()
+            if not dc_queues[dc_id]:
+                del dc_queues[dc_id]
+            self._condition.notify_all()
+            return item
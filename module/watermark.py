@@ -0,0 +1,48 @@
+"""Resume point of a chat download"""
+
+from typing import Iterable, Sequence
+
+from module.interval_set import IntervalSet
+
+
+class MessageWatermark:
+    """Highest message id up to which every message of a chat is finished
+
+    Downloads finish out of order. Finished messages above the watermark
+    are kept as intervals and the watermark moves up once the messages
+    below them are finished too. Ids the history scan jumps over belong to
+    deleted or filtered messages and count as finished.
+
+    A download resumes right above the watermark and skips the finished
+    messages, so nothing is lost or downloaded twice.
+    """
+
+    def __init__(self, watermark: int = 0, finished: Iterable[Sequence[int]] = ()):
+        self.watermark = watermark
+        self.finished = IntervalSet(finished)
+        self._last_scanned = watermark
+        self._advance()
+
+    def scan(self, message_id: int):
+        """Note a message read from the chat history, in ascending order"""
+        self.finished.add_range(self._last_scanned + 1, message_id - 1)
+        self._last_scanned = max(self._last_scanned, message_id)
+        self._advance()
+
+    def finish(self, message_id: int):
+        """Note a finished message, whatever its download status"""
+        if message_id > self.watermark:
+            self.finished.add(message_id)
+            self._advance()
+
+    def is_finished(self, message_id: int) -> bool:
+        """If the message is finished"""
+        return message_id <= self.watermark or message_id in self.finished
+
+    def _advance(self):
+        """Move the watermark over the finished ranges right above it"""
+        first = self.finished.first()
+        while first and first[0] <= self.watermark + 1:
+            self.watermark = max(self.watermark, first[1])
+            self.finished.remove_range(*first)
+            first = self.finished.first()
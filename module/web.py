@@ -9,6 +9,7 @@ from flask_login import LoginManager, UserMixin, login_required, login_user
 
 import utils
 from module.app import Application
+from module.concurrency import get_concurrency_controller
 from module.download_stat import (
     DownloadState,
     get_download_result,
@@ -147,10 +148,15 @@ def index():
 @login_required
 def get_download_speed():
     """Get download speed"""
+    controller = get_concurrency_controller()
     return (
         '{ "download_speed" : "'
         + format_byte(get_total_download_speed())
-        + '/s" , "upload_speed" : "0.00 B/s" } '
+        + '/s" , "upload_speed" : "0.00 B/s" , "download_task_limit" : '
+        + str(controller.workers)
+        + ' , "concurrent_transmissions" : '
+        + str(controller.transmissions)
+        + " } "
     )
 
 
@@ -2,11 +2,13 @@
 
 import os
 import sys
+import time
 import unittest
 from unittest import mock
 
 import module.app
 from module.app import Application, ChatDownloadConfig, DownloadStatus
+from module.watermark import MessageWatermark
 
 sys.path.append("..")  # Adds higher directory to python modules path.
 
@@ -28,44 +30,107 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(app.restart_program, False)
 
         app.chat_download_config[123] = ChatDownloadConfig()
-        app.chat_download_config[123].last_read_message_id = 13
-        app.chat_download_config[123].node.download_status[
-            6
-        ] = DownloadStatus.Downloading
-        app.chat_download_config[123].ids_to_retry.append(7)
+        download_config = app.chat_download_config[123]
+        download_config.watermark = MessageWatermark(4)
+        download_config.ids_to_retry.add(3)
+        # 7, 9, 11 and 12 do not exist
+        for message_id in (5, 6, 8, 10, 13):
+            download_config.watermark.scan(message_id)
+            download_config.node.download_status[
+                message_id
+            ] = DownloadStatus.Downloading
         # download success
-        app.chat_download_config[123].node.download_status[
-            8
-        ] = DownloadStatus.SuccessDownload
-        app.chat_download_config[123].finish_task += 1
-        # download success
-        app.chat_download_config[123].node.download_status[
-            10
-        ] = DownloadStatus.SuccessDownload
-        app.chat_download_config[123].finish_task += 1
-        # not exist message
-        app.chat_download_config[123].node.download_status[
-            13
-        ] = DownloadStatus.SuccessDownload
+        for message_id in (5, 8, 10):
+            download_config.node.download_status[
+                message_id
+            ] = DownloadStatus.SuccessDownload
+            download_config.watermark.finish(message_id)
+            download_config.finish_task += 1
         app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 5}]
 
         app.update_config(False)
 
-        self.assertEqual(
-            app.chat_download_config[123].last_read_message_id + 1,
-            app.config["chat"][0]["last_read_message_id"],
-        )
-        self.assertEqual(
-            [6, 7],
-            app.app_data["chat"][0]["ids_to_retry"],
-        )
+        # the history is read again from 6, 7 to 12 are skipped
+        self.assertEqual(6, app.config["chat"][0]["last_read_message_id"])
+        self.assertEqual([[7, 12]], app.app_data["chat"][0]["finished_ids"])
+        self.assertEqual([[3, 3]], app.app_data["chat"][0]["ids_to_retry"])
 
+    @mock.patch("utils.file_management.os")
     @mock.patch("__main__.__builtins__.open", new_callable=mock.mock_open)
     @mock.patch("module.app.yaml", autospec=True)
-    def test_update_config(self, mock_yaml, mock_open):
+    def test_update_config(self, mock_yaml, mock_open, mock_os):
         app = Application("", "")
         app.config_file = "config_test.yaml"
         app.app_data_file = "data_test.yaml"
         app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 0}]
         app.update_config()
-        mock_open.assert_called_with("data_test.yaml", "w", encoding="utf-8")
+        mock_open.assert_called_with("data_test.yaml.tmp", "w", encoding="utf-8")
+        mock_os.replace.assert_called_with("data_test.yaml.tmp", "data_test.yaml")
+
+    def test_ids_to_retry_intervals(self):
+        app = Application("", "")
+        app.chat_download_config[123] = ChatDownloadConfig()
+        # older versions saved a list of ids
+        app.assign_app_data(
+            {"chat": [{"chat_id": 123, "ids_to_retry": [1, 2, 3, [7, 9], 5]}]}
+        )
+        download_config = app.chat_download_config[123]
+        self.assertEqual(
+            download_config.ids_to_retry.intervals, [[1, 3], [5, 5], [7, 9]]
+        )
+        self.assertTrue(app.need_skip_message(download_config, 8))
+        self.assertFalse(app.need_skip_message(download_config, 6))
+
+        app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 0}]
+        app.update_config(False)
+        self.assertEqual(
+            [[1, 3], [5, 5], [7, 9]], app.app_data["chat"][0]["ids_to_retry"]
+        )
+
+    def test_need_checkpoint(self):
+        app = Application("", "")
+        app.chat_download_config[123] = ChatDownloadConfig()
+        node = app.chat_download_config[123].node
+        node.chat_id = 123
+        app.checkpoint_tasks = 2
+        self.assertFalse(app.need_checkpoint())
+
+        app.set_download_id(node, 1, DownloadStatus.SuccessDownload)
+        self.assertFalse(app.need_checkpoint())
+        app.last_checkpoint_time -= app.checkpoint_interval
+        self.assertTrue(app.need_checkpoint())
+
+        app.last_checkpoint_time = time.time()
+        app.set_download_id(node, 2, DownloadStatus.FailedDownload)
+        self.assertTrue(app.need_checkpoint())
+
+        with mock.patch.object(app, "update_config") as update_config:
+            app.checkpoint()
+            update_config.assert_called_once_with()
+        self.assertFalse(app.need_checkpoint())
+
+    def test_download_state(self):
+        app = Application("", "")
+        app.chat_download_config[123] = ChatDownloadConfig()
+        app.assign_app_data({"chat": [{"chat_id": 123, "ids_to_retry": [3, 1]}]})
+        self.assertEqual(list(app.chat_download_config[123].ids_to_retry), [1, 3])
+
+        node = app.chat_download_config[123].node
+        node.chat_id = 123
+        app.set_download_id(node, 1, DownloadStatus.SuccessDownload, "a.mp4", 10)
+        app.set_download_id(node, 5, DownloadStatus.FailedDownload)
+
+        state = app.download_state.get(123, 1)
+        self.assertEqual(state.status, DownloadStatus.SuccessDownload.value)
+        self.assertEqual((state.size, state.path), (10, os.path.abspath("a.mp4")))
+
+        download_config = app.chat_download_config[123]
+        # finished
+        self.assertTrue(app.need_skip_message(download_config, 1))
+        # retried on its own
+        self.assertTrue(app.need_skip_message(download_config, 3))
+        self.assertFalse(app.need_skip_message(download_config, 4))
+
+        app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 0}]
+        app.update_config(False)
+        self.assertEqual([[3, 3], [5, 5]], app.app_data["chat"][0]["ids_to_retry"])
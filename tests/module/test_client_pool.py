@@ -0,0 +1,59 @@
+"""test client pool"""
+
+import unittest
+
+from module.client_pool import ClientPolicy, ClientPool
+from module.rate_limiter import RateFamily, RateLimiter
+
+
+class MockClient:
+    def __init__(self, name: str):
+        self.name = name
+        self.rate_limiter = RateLimiter()
+
+
+class ClientPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clients = [MockClient(f"account_{i}") for i in range(3)]
+
+    def test_least_loaded(self):
+        pool = ClientPool(self.clients)
+        acquired = [pool.acquire(-100) for _ in range(3)]
+        self.assertEqual(set(acquired), set(self.clients))
+
+        pool.release(self.clients[1])
+        self.assertIs(pool.acquire(-100), self.clients[1])
+
+    def test_hash_by_chat(self):
+        pool = ClientPool(self.clients, ClientPolicy.HashByChat)
+        client = pool.acquire(-100)
+        for _ in range(3):
+            self.assertIs(pool.acquire(-100), client)
+
+    def test_skip_flood_waited(self):
+        pool = ClientPool(self.clients, ClientPolicy.HashByChat)
+        client = pool.select(-100)
+        client.rate_limiter.flood_wait(RateFamily.File, 60)
+        self.assertIsNot(pool.select(-100), client)
+
+        for it in self.clients:
+            it.rate_limiter.flood_wait(RateFamily.History, 60)
+        self.assertIs(pool.select(-100), pool.main_client)
+
+    def test_hide_chat(self):
+        pool = ClientPool(self.clients)
+        pool.hide_chat(self.clients[1], -100)
+        pool.hide_chat(self.clients[2], -100)
+        for _ in range(3):
+            self.assertIs(pool.acquire(-100), pool.main_client)
+        self.assertTrue(pool.can_see(self.clients[1], -200))
+
+        # the main account is never hidden
+        pool.hide_chat(pool.main_client, -100)
+        self.assertIs(pool.select(-100), pool.main_client)
+
+    def test_acquire_main(self):
+        pool = ClientPool(self.clients)
+        pool.acquire(-100)
+        self.assertIs(pool.acquire_main(), pool.main_client)
+        self.assertEqual(pool.load(pool.main_client), 2)
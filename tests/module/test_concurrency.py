@@ -0,0 +1,90 @@
+"""test concurrency"""
+
+import asyncio
+import unittest
+
+from module.concurrency import (
+    AdjustableSemaphore,
+    ConcurrencyAction,
+    ConcurrencyController,
+)
+
+
+class AdjustableSemaphoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_set_limit(self):
+        async def _run():
+            semaphore = AdjustableSemaphore(1)
+            # it replaces the transmission semaphores of pyrogram
+            self.assertIsInstance(semaphore, asyncio.Semaphore)
+            await semaphore.acquire()
+            self.assertTrue(semaphore.locked())
+
+            waiter = asyncio.ensure_future(semaphore.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(waiter.done())
+
+            semaphore.set_limit(2)
+            await asyncio.sleep(0)
+            self.assertTrue(waiter.done())
+            self.assertEqual(semaphore.active, 2)
+
+            # lowering the limit keeps the holders
+            semaphore.set_limit(1)
+            self.assertEqual(semaphore.active, 2)
+            semaphore.release()
+            self.assertTrue(semaphore.locked())
+            semaphore.release()
+            self.assertFalse(semaphore.locked())
+
+        self.loop.run_until_complete(_run())
+
+    def test_cancel(self):
+        async def _run():
+            semaphore = AdjustableSemaphore(1)
+            async with semaphore:
+                waiter = asyncio.ensure_future(semaphore.acquire())
+                await asyncio.sleep(0)
+                waiter.cancel()
+                await asyncio.sleep(0)
+            self.assertEqual(semaphore.active, 0)
+
+        self.loop.run_until_complete(_run())
+
+
+class ConcurrencyControllerTestCase(unittest.TestCase):
+    def test_adjust(self):
+        controller = ConcurrencyController(4, 8, 20, 40)
+        transmission = controller.add_transmission_semaphore()
+
+        self.assertEqual(controller.adjust(100), ConcurrencyAction.Increase)
+        self.assertEqual((controller.workers, controller.transmissions), (5, 25))
+        self.assertEqual(transmission.limit, 25)
+
+        # no throughput gain after an increase
+        self.assertEqual(controller.adjust(100), ConcurrencyAction.Hold)
+        self.assertEqual(controller.adjust(100), ConcurrencyAction.Increase)
+
+        controller.record_flood_wait()
+        self.assertEqual(controller.adjust(200), ConcurrencyAction.Decrease)
+        self.assertEqual((controller.workers, controller.transmissions), (3, 15))
+        self.assertEqual(transmission.limit, 15)
+
+        controller.record_success()
+        controller.record_error()
+        self.assertEqual(controller.adjust(200), ConcurrencyAction.Decrease)
+
+        for _ in range(5):
+            controller.record_flood_wait()
+            controller.adjust(0)
+        self.assertEqual((controller.workers, controller.transmissions), (1, 1))
+
+    def test_bounds(self):
+        controller = ConcurrencyController(2, 2, 10, 10)
+        self.assertEqual(controller.adjust(100), ConcurrencyAction.Increase)
+        self.assertEqual((controller.workers, controller.transmissions), (2, 10))
@@ -0,0 +1,114 @@
+"""test content hash"""
+
+import asyncio
+import hashlib
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pyrogram
+from pyrogram.file_id import FileId, FileType
+
+from module.content_hash import (
+    HASH_CHUNK_SIZE,
+    ChunkHasher,
+    get_current_hasher,
+    hash_download,
+    new_hash,
+)
+from module.pyrogram_extension import HookClient
+
+
+def _hash_list(chunks) -> str:
+    digests = b"".join(hashlib.sha256(it).digest() for it in chunks)
+    return hashlib.sha256(digests).hexdigest()
+
+
+class ContentHashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_new_hash(self):
+        self.assertEqual(new_hash("sha256").name, "sha256")
+        with self.assertRaises(ValueError):
+            new_hash("unknown")
+
+    def test_chunk_order(self):
+        chunks = [b"a" * HASH_CHUNK_SIZE, b"b" * HASH_CHUNK_SIZE, b"c"]
+        file_size = sum(len(it) for it in chunks)
+
+        hasher = ChunkHasher("sha256", file_size)
+        hasher.update(2, chunks[2])
+        hasher.update(0, chunks[0])
+        self.assertIsNone(hasher.hexdigest())
+
+        # restored from the journal of an earlier attempt
+        other = ChunkHasher("sha256", file_size)
+        other.update(1, chunks[1])
+        hasher.set_chunk_digest(1, other.get_chunk_digest(1))
+        self.assertEqual(hasher.hexdigest(), _hash_list(chunks))
+
+    def test_unknown_size(self):
+        hasher = ChunkHasher("sha256", 0)
+        hasher.update(0, b"a" * HASH_CHUNK_SIZE)
+        hasher.update(1, b"b")
+        self.assertEqual(hasher.hexdigest(), _hash_list([b"a" * HASH_CHUNK_SIZE, b"b"]))
+
+    def test_hash_download(self):
+        hasher = ChunkHasher("sha256", 2)
+
+        async def _segment(idx: int):
+            get_current_hasher().update(idx, b"x")
+
+        async def _run():
+            with hash_download(hasher):
+                await asyncio.gather(
+                    asyncio.ensure_future(_segment(0)),
+                    asyncio.ensure_future(_segment(1)),
+                )
+            self.assertIsNone(get_current_hasher())
+
+        self.loop.run_until_complete(_run())
+        self.assertEqual(len(hasher.chunk_digests), 2)
+
+    def test_hash_chunks(self):
+        chunks = [b"a" * HASH_CHUNK_SIZE, b"b"]
+        session = SimpleNamespace(dc_id=4, invoked=[])
+
+        async def _invoke(query, sleep_threshold=None):
+            session.invoked.append(query.offset)
+            return pyrogram.raw.types.upload.File(
+                type=pyrogram.raw.types.storage.FileUnknown(),
+                mtime=0,
+                bytes=chunks[query.offset // HASH_CHUNK_SIZE],
+            )
+
+        session.invoke = _invoke
+        file_id = FileId(
+            file_type=FileType.DOCUMENT,
+            dc_id=4,
+            media_id=1,
+            access_hash=2,
+            file_reference=b"",
+        )
+
+        async def _run():
+            client = HookClient("test", in_memory=True)
+            client.media_session_pool = mock.Mock(
+                acquire=mock.AsyncMock(return_value=session)
+            )
+            hasher = ChunkHasher("sha256", HASH_CHUNK_SIZE + 1)
+            with hash_download(hasher):
+                data = [
+                    it async for it in client.get_file(file_id, HASH_CHUNK_SIZE + 1)
+                ]
+            client.media_session_pool.release.assert_called_once_with(session)
+            return data, hasher
+
+        data, hasher = self.loop.run_until_complete(_run())
+        self.assertEqual(data, chunks)
+        self.assertEqual(session.invoked, [0, HASH_CHUNK_SIZE])
+        self.assertEqual(hasher.hexdigest(), _hash_list(chunks))
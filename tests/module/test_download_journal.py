@@ -0,0 +1,62 @@
+"""test download journal"""
+
+import os
+import tempfile
+import unittest
+
+from module.download_journal import DownloadJournal
+
+
+class DownloadJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "video.mp4")
+        with open(self.file_path, "wb") as f:
+            f.truncate(25)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_and_load(self):
+        journal = DownloadJournal(self.file_path, 25, 7, 10)
+        self.assertFalse(journal.load())
+        journal.open(False)
+        self.assertTrue(journal.record(0, 10))
+        # the last chunk is shorter
+        self.assertFalse(journal.record(2, 10))
+        self.assertTrue(journal.record(2, 5))
+        journal.close()
+
+        journal = DownloadJournal(self.file_path, 25, 7, 10)
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.done_chunks, {0, 2})
+        self.assertEqual(journal.done_size(), 15)
+        self.assertEqual(journal.missing_runs(0, 3), [(1, 1)])
+        self.assertFalse(journal.is_complete())
+
+        # another media with the same path can not resume
+        self.assertFalse(DownloadJournal(self.file_path, 25, 8, 10).load())
+
+        journal.remove()
+        self.assertFalse(os.path.exists(journal.journal_path))
+
+    def test_chunk_digests(self):
+        journal = DownloadJournal(self.file_path, 25, 7, 10)
+        journal.open(False)
+        journal.record(0, 10, "aa")
+        journal.record(1, 10)
+        journal.close()
+        # a line cut off by a crash is ignored
+        with open(journal.journal_path, "a", encoding="utf-8") as f:
+            f.write("2 b")
+
+        journal = DownloadJournal(self.file_path, 25, 7, 10)
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.done_chunks, {0, 1})
+        self.assertEqual(journal.chunk_digests, {0: "aa"})
+
+    def test_missing_runs(self):
+        journal = DownloadJournal(self.file_path, 100, 7, 10)
+        journal.done_chunks = {0, 1, 4, 7}
+        self.assertEqual(journal.missing_runs(0, 10), [(2, 2), (5, 2), (8, 2)])
+        self.assertEqual(journal.missing_runs(4, 1), [])
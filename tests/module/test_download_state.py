@@ -0,0 +1,50 @@
+"""test download state"""
+
+import os
+import tempfile
+import unittest
+
+from module.download_state import DownloadStateStore
+
+
+class DownloadStateStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = DownloadStateStore(os.path.join(self.temp_dir.name, "tdl.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_set_status(self):
+        self.assertIsNone(self.store.get(123, 1))
+        self.assertIsNone(self.store.get_status(123, 1))
+
+        self.store.set_status(123, 1, 3)
+        self.store.set_status(123, 1, 2, 10, "a.mp4", "unique")
+        # the path and size of a later attempt that did not set them are kept
+        self.store.set_status(123, 1, 1)
+
+        state = self.store.get("123", 1)
+        self.assertEqual(state.status, 1)
+        self.assertEqual((state.size, state.path), (10, os.path.abspath("a.mp4")))
+        self.assertEqual(state.file_unique_id, "unique")
+        self.assertEqual(state.attempts, 3)
+        self.assertEqual(self.store.find_by_path("a.mp4").message_id, 1)
+        self.assertIsNone(self.store.find_by_path("b.mp4"))
+
+    def test_message_ids(self):
+        self.store.set_status(123, 5, 2)
+        self.store.add_message_ids(123, [3, 1, 5], 3)
+        self.store.add_message_ids(456, [2], 3)
+
+        # recorded messages are not changed
+        self.assertEqual(self.store.get_status(123, 5), 2)
+        self.assertEqual(self.store.get_message_ids(123), [1, 3, 5])
+        self.assertEqual(self.store.get_message_ids(123, (1, 2)), [1, 3])
+        self.assertEqual(self.store.get_message_ids(456, (1, 2)), [2])
+
+    def test_reopen(self):
+        self.store.set_status(123, 1, 3)
+        self.store.open(self.store.db_path)
+        self.assertEqual(self.store.get_status(123, 1), 3)
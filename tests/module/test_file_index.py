@@ -0,0 +1,82 @@
+"""test file index"""
+
+import os
+import tempfile
+import unittest
+
+from module.file_index import FileIndex
+
+
+class FileIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_index = FileIndex(os.path.join(self.temp_dir.name, "tdl.db"))
+
+    def tearDown(self):
+        self.file_index.close()
+        self.temp_dir.cleanup()
+
+    def test_add_and_find(self):
+        self.file_index.add("a.mp4", 10, "sha256", "aa")
+        self.file_index.add("b.mp4", 20)
+
+        record = self.file_index.get("a.mp4")
+        self.assertEqual(record.path, os.path.abspath("a.mp4"))
+        self.assertEqual((record.size, record.digest), (10, "aa"))
+        self.assertIsNone(self.file_index.get("b.mp4").digest)
+
+        self.assertEqual(
+            self.file_index.find_by_digest("sha256", "aa").path,
+            os.path.abspath("a.mp4"),
+        )
+        self.assertIsNone(self.file_index.find_by_digest("xxh64", "aa"))
+
+        self.file_index.remove("a.mp4")
+        self.assertIsNone(self.file_index.get("a.mp4"))
+
+    def test_get_digest(self):
+        file_path = os.path.join(self.temp_dir.name, "a.mp4")
+        with open(file_path, "wb") as f:
+            f.write(b"0" * 10)
+        self.file_index.add(file_path, 10, "sha256-chunked-1m", "aa")
+        self.assertEqual(self.file_index.get_digest(file_path), "sha256-chunked-1m:aa")
+
+        self.file_index.add(file_path, 20, "sha256-chunked-1m", "aa")
+        self.assertIsNone(self.file_index.get_digest(file_path))
+        self.file_index.add(file_path, 10)
+        self.assertIsNone(self.file_index.get_digest(file_path))
+        self.assertIsNone(self.file_index.get_digest("b.mp4"))
+
+    def test_find_by_unique_id(self):
+        stored = os.path.join(self.temp_dir.name, "stored.mp4")
+        with open(stored, "wb") as f:
+            f.write(b"media")
+        self.file_index.add("deleted.mp4", 5, file_unique_id="unique")
+        self.file_index.add(stored, 5, file_unique_id="unique")
+
+        self.assertEqual(self.file_index.find_by_unique_id("unique").path, stored)
+        # the record of the deleted file is dropped
+        self.assertIsNone(self.file_index.get("deleted.mp4"))
+
+        # changed outside the downloader
+        with open(stored, "ab") as f:
+            f.write(b"changed")
+        self.assertIsNone(self.file_index.find_by_unique_id("unique"))
+        self.assertIsNone(self.file_index.get(stored))
+
+    def test_migrate(self):
+        self.file_index.conn.execute("DROP TABLE files")
+        self.file_index.conn.execute(
+            "CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "algorithm TEXT, digest TEXT, create_time REAL NOT NULL)"
+        )
+        self.file_index.conn.commit()
+        self.file_index.close()
+
+        self.file_index.add("a.mp4", 10, file_unique_id="unique")
+        self.assertEqual(self.file_index.get("a.mp4").file_unique_id, "unique")
+
+    def test_reopen(self):
+        self.file_index.add("a.mp4", 10, "sha256", "aa")
+        self.file_index.close()
+        self.assertEqual(self.file_index.get("a.mp4").digest, "aa")
@@ -0,0 +1,74 @@
+"""test file reference cache"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from module.file_reference_cache import FileReferenceCache
+
+from ..test_common import MockMessage
+
+
+class MockClient:
+    def __init__(self, name: str = "media_downloader"):
+        self.name = name
+        self.calls = 0
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls += 1
+        return [MockMessage(id=it, chat_id=chat_id) for it in message_ids]
+
+
+class FileReferenceCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_ttl(self):
+        cache = FileReferenceCache(ttl=60)
+        message = MockMessage(id=1, chat_id=-100)
+        with mock.patch("module.file_reference_cache.time.monotonic") as monotonic:
+            monotonic.return_value = 100.0
+            cache.put(None, -100, message)
+            self.assertIs(cache.get(None, -100, 1), message)
+            self.assertIsNone(cache.get(None, -100, 2))
+
+            monotonic.return_value = 161.0
+            self.assertIsNone(cache.get(None, -100, 1))
+            self.assertEqual(len(cache), 0)
+
+    def test_maxsize(self):
+        cache = FileReferenceCache(maxsize=2)
+        for i in range(3):
+            cache.put(None, -100, MockMessage(id=i, chat_id=-100))
+        self.assertIsNone(cache.get(None, -100, 0))
+        self.assertIsNotNone(cache.get(None, -100, 2))
+
+    def test_fetch(self):
+        cache = FileReferenceCache()
+        client = MockClient()
+        cache.put(client, -100, MockMessage(id=1, chat_id=-100))
+
+        message = self.loop.run_until_complete(cache.fetch(client, -100, 1))
+        self.assertEqual(message.id, 1)
+        self.assertEqual(client.calls, 0)
+
+        # expired file reference
+        cache.invalidate(client, -100, 1)
+        self.loop.run_until_complete(cache.fetch(client, -100, 1))
+        self.assertEqual(client.calls, 1)
+        self.loop.run_until_complete(cache.fetch(client, -100, 1))
+        self.assertEqual(client.calls, 1)
+
+    def test_fetch_per_account(self):
+        cache = FileReferenceCache()
+        client = MockClient()
+        other_client = MockClient("account_2")
+        cache.put(client, -100, MockMessage(id=1, chat_id=-100))
+
+        # file references are not shared between accounts
+        self.loop.run_until_complete(cache.fetch(other_client, -100, 1))
+        self.assertEqual(other_client.calls, 1)
+        self.assertIsNotNone(cache.get(client, -100, 1))
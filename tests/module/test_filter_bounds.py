@@ -0,0 +1,46 @@
+"""test filter bounds"""
+
+import unittest
+from datetime import datetime
+
+from module.filter_bounds import FilterBounds, get_filter_bounds
+from utils.format import replace_date_time
+
+
+def get_bounds(filter_str: str) -> FilterBounds:
+    return get_filter_bounds(replace_date_time(filter_str))
+
+
+class FilterBoundsTestCase(unittest.TestCase):
+    def test_id(self):
+        self.assertEqual(get_bounds("id > 5"), FilterBounds(min_id=6))
+        self.assertEqual(get_bounds("message_id <= 5"), FilterBounds(max_id=5))
+        self.assertEqual(get_bounds("100 < id"), FilterBounds(min_id=101))
+        self.assertEqual(get_bounds("id == 7"), FilterBounds(min_id=7, max_id=7))
+        self.assertEqual(get_bounds("id < 5 + 5"), FilterBounds(max_id=9))
+        self.assertEqual(get_bounds("id != 7"), FilterBounds())
+
+    def test_date(self):
+        self.assertEqual(
+            get_bounds("message_date >= 2023-01-01 && id < 50000"),
+            FilterBounds(max_id=49999, min_date=datetime(2023, 1, 1)),
+        )
+        self.assertEqual(
+            get_bounds("message_date < 2023-05-01 12:00:00"),
+            FilterBounds(max_date=datetime(2023, 5, 1, 12)),
+        )
+
+    def test_logic(self):
+        self.assertEqual(
+            get_bounds("(id > 10 && id < 20) || (id >= 100 && id <= 200)"),
+            FilterBounds(min_id=11, max_id=200),
+        )
+        self.assertEqual(get_bounds("id > 5 || file_size > 10MB"), FilterBounds())
+        self.assertEqual(
+            get_bounds("id > 5 and caption == r'.*test.*'"), FilterBounds(min_id=6)
+        )
+
+    def test_unbounded(self):
+        self.assertEqual(get_bounds(""), FilterBounds())
+        self.assertEqual(get_bounds("file_size > 10MB"), FilterBounds())
+        self.assertEqual(get_bounds("id >"), FilterBounds())
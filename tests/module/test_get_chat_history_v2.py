@@ -0,0 +1,245 @@
+"""test get chat history v2"""
+
+import asyncio
+import unittest
+
+import mock
+from pyrogram import raw
+
+from module import get_chat_history_v2 as get_chat_history_v2_module
+from module.get_chat_history_v2 import (
+    get_chat_history_by_media,
+    get_chat_history_partitioned,
+    get_chat_history_v2,
+)
+
+from ..test_common import MockMessage
+
+# a dense start, a sparse middle and a dense end
+MESSAGE_IDS = list(range(1, 301)) + [1000, 5000] + list(range(9000, 9150))
+
+
+class MockHistory:
+    def __init__(self, empty_in_gap: bool = False):
+        # the server returns nothing when reading on from a missing message
+        self.empty_in_gap = empty_in_gap
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    async def get_chunk_v2(
+        self,
+        *,
+        client,
+        chat_id,
+        limit=0,
+        max_id=0,
+        min_id=0,
+        from_message_id=0,
+        reverse=False,
+        **kwargs,
+    ):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.001)
+        self.running -= 1
+
+        ids = [it for it in MESSAGE_IDS if it > min_id and (not max_id or it < max_id)]
+        if reverse and self.empty_in_gap and from_message_id not in MESSAGE_IDS:
+            return []
+        if reverse:
+            ids = [it for it in ids if it >= from_message_id][:limit]
+        else:
+            ids = sorted(ids, reverse=True)[:limit]
+        return [MockMessage(id=it, chat_id=chat_id) for it in ids]
+
+
+class MockSearch:
+    def __init__(self):
+        self.ids = {
+            raw.types.InputMessagesFilterPhotos: list(range(1, 301, 3)) + [5000],
+            raw.types.InputMessagesFilterVideo: list(range(2, 301, 3)) + [9001],
+            raw.types.InputMessagesFilterDocument: [1, 1000, 9100],
+        }
+        self.filters = []
+
+    async def search_chunk(
+        self,
+        *,
+        client,
+        chat_id,
+        message_filter,
+        limit=100,
+        max_id=0,
+        from_message_id=1,
+    ):
+        self.filters.append(type(message_filter))
+        await asyncio.sleep(0.001)
+        ids = [
+            it
+            for it in self.ids[type(message_filter)]
+            if it >= from_message_id and (not max_id or it < max_id)
+        ][:limit]
+        return [MockMessage(id=it, chat_id=chat_id) for it in ids]
+
+
+class GetChatHistoryPartitionedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.history = MockHistory()
+        self.patcher = mock.patch(
+            "module.get_chat_history_v2.get_chunk_v2", new=self.history.get_chunk_v2
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.loop.close()
+
+    def _get_ids(self, **kwargs):
+        async def _run():
+            return [
+                it.id async for it in get_chat_history_partitioned(None, -100, **kwargs)
+            ]
+
+        return self.loop.run_until_complete(_run())
+
+    def test_ordered(self):
+        self.assertEqual(self._get_ids(partitions=4), MESSAGE_IDS)
+        self.assertEqual(self.history.max_running, 4)
+
+        self.assertEqual(
+            self._get_ids(offset_id=290, max_id=5000, partitions=3),
+            list(range(290, 301)) + [1000, 5000],
+        )
+
+    def test_page_limit(self):
+        get_range = get_chat_history_v2_module._get_range
+        sizes = []
+
+        async def _get_range(*args):
+            messages, rest = await get_range(*args)
+            sizes.append(len(messages))
+            return messages, rest
+
+        with mock.patch(
+            "module.get_chat_history_v2._get_range", new=_get_range
+        ), mock.patch("module.get_chat_history_v2._MIN_RANGE_SIZE", 10000):
+            self.assertEqual(self._get_ids(partitions=4), MESSAGE_IDS)
+            self.assertEqual(
+                sorted(self._get_ids(partitions=4, ordered=False)), MESSAGE_IDS
+            )
+        self.assertLessEqual(max(sizes), 200)
+
+    def test_empty_in_gap(self):
+        self.history.empty_in_gap = True
+        self.assertEqual(self._get_ids(partitions=4), MESSAGE_IDS)
+        self.assertEqual(
+            self._get_ids(offset_id=290, max_id=5000, partitions=3),
+            list(range(290, 301)) + [1000, 5000],
+        )
+
+    def test_unordered(self):
+        self.assertEqual(
+            sorted(self._get_ids(partitions=4, ordered=False)), MESSAGE_IDS
+        )
+
+    def test_close_early(self):
+        async def _run():
+            messages = get_chat_history_partitioned(None, -100, partitions=4)
+            async for message in messages:
+                if message.id == 10:
+                    break
+            await messages.aclose()
+            await asyncio.sleep(0.01)
+            return [
+                it for it in asyncio.all_tasks() if it is not asyncio.current_task()
+            ]
+
+        self.assertEqual(self.loop.run_until_complete(_run()), [])
+
+
+class GetChatHistoryV2TestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.history = MockHistory(empty_in_gap=True)
+        self.patcher = mock.patch(
+            "module.get_chat_history_v2.get_chunk_v2", new=self.history.get_chunk_v2
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.loop.close()
+
+    def _get_ids(self, **kwargs):
+        async def _run():
+            return [it.id async for it in get_chat_history_v2(None, -100, **kwargs)]
+
+        return self.loop.run_until_complete(_run())
+
+    def test_seek_over_gaps(self):
+        self.assertEqual(
+            self._get_ids(offset_id=301, reverse=True),
+            [1000, 5000] + list(range(9000, 9150)),
+        )
+        # bisecting the gaps, not reading the history up to them
+        self.assertLess(self.history.calls, 60)
+
+        self.assertEqual(
+            self._get_ids(offset_id=1001, max_id=8999, reverse=True), [5000]
+        )
+        self.assertEqual(self._get_ids(offset_id=9150, reverse=True), [])
+
+
+class GetChatHistoryByMediaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.search = MockSearch()
+        self.patcher = mock.patch(
+            "module.get_chat_history_v2.search_chunk", new=self.search.search_chunk
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.loop.close()
+
+    def _get_ids(self, media_types, **kwargs):
+        async def _run():
+            return [
+                it.id
+                async for it in get_chat_history_by_media(
+                    None, -100, media_types, **kwargs
+                )
+            ]
+
+        return self.loop.run_until_complete(_run())
+
+    def test_merge(self):
+        self.assertEqual(
+            self._get_ids(["photo", "video", "document"]),
+            sorted(
+                set(
+                    list(range(1, 301, 3))
+                    + list(range(2, 301, 3))
+                    + [1000, 5000, 9001, 9100]
+                )
+            ),
+        )
+        self.assertEqual(
+            self._get_ids(["photo", "document"], offset_id=290, max_id=5000),
+            [292, 295, 298, 1000, 5000],
+        )
+
+    def test_one_search_per_filter(self):
+        self.assertEqual(self._get_ids(["document", "document"]), [1, 1000, 9100])
+        self.assertEqual(
+            set(self.search.filters), {raw.types.InputMessagesFilterDocument}
+        )
+
+    def test_not_searchable(self):
+        with self.assertRaises(ValueError):
+            self._get_ids(["photo", "sticker"])
+        self.assertEqual(self.search.filters, [])
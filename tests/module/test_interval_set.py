@@ -0,0 +1,43 @@
+"""test interval set"""
+
+import unittest
+
+from module.interval_set import IntervalSet
+
+
+class IntervalSetTestCase(unittest.TestCase):
+    def test_add(self):
+        interval_set = IntervalSet([[5, 6], [1, 2]])
+        self.assertEqual(interval_set.intervals, [[1, 2], [5, 6]])
+
+        interval_set.add(3)
+        self.assertEqual(interval_set.intervals, [[1, 3], [5, 6]])
+        interval_set.add(4)
+        self.assertEqual(interval_set.intervals, [[1, 6]])
+        interval_set.add_range(10, 12)
+        interval_set.add_range(8, 20)
+        interval_set.add_range(9, 8)
+        self.assertEqual(interval_set.intervals, [[1, 6], [8, 20]])
+
+        self.assertIn(1, interval_set)
+        self.assertIn(20, interval_set)
+        self.assertNotIn(7, interval_set)
+        self.assertNotIn(0, interval_set)
+        self.assertEqual(len(interval_set), 19)
+        self.assertEqual(interval_set.first(), (1, 6))
+        self.assertEqual(list(IntervalSet([[1, 2], [4, 4]])), [1, 2, 4])
+
+    def test_remove(self):
+        interval_set = IntervalSet([[1, 10], [20, 30]])
+        interval_set.discard(5)
+        self.assertEqual(interval_set.intervals, [[1, 4], [6, 10], [20, 30]])
+        interval_set.remove_range(8, 25)
+        self.assertEqual(interval_set.intervals, [[1, 4], [6, 7], [26, 30]])
+        interval_set.remove_range(0, 40)
+        self.assertFalse(interval_set)
+        self.assertIsNone(interval_set.first())
+
+    def test_load(self):
+        interval_set = IntervalSet.load([4, 1, [2, 3], [10, 12]])
+        self.assertEqual(interval_set.intervals, [[1, 4], [10, 12]])
+        self.assertFalse(IntervalSet.load(None))
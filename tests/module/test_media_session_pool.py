@@ -0,0 +1,223 @@
+"""test media session pool"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pyrogram
+from pyrogram.file_id import FileId, FileType
+
+from module.pyrogram_extension import HookClient, MediaSessionPool
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MockSession:
+    def __init__(self, client, dc_id, auth_key, test_mode, is_media=False):
+        self.client = client
+        self.dc_id = dc_id
+        self.auth_key = auth_key
+        self.is_started = False
+        self.invoked = []
+
+    def start_timeout(self, start_timeout):
+        pass
+
+    async def start(self):
+        self.is_started = True
+
+    async def stop(self):
+        self.is_started = False
+
+    async def invoke(self, query):
+        self.invoked.append(query)
+
+
+class MockAuth:
+    created = 0
+
+    def __init__(self, client, dc_id, test_mode):
+        self.dc_id = dc_id
+
+    async def create(self):
+        MockAuth.created += 1
+        return f"auth key {self.dc_id}".encode()
+
+
+class MockStorage:
+    async def test_mode(self):
+        return False
+
+    async def dc_id(self):
+        return 2
+
+    async def auth_key(self):
+        return b"home auth key"
+
+
+class MockClient:
+    def __init__(self, workdir: str):
+        self.name = "media_downloader"
+        self.workdir = workdir
+        self.in_memory = False
+        self.storage = MockStorage()
+        self.exported = 0
+
+    async def invoke(self, query):
+        self.exported += 1
+        return SimpleNamespace(id=1, bytes=b"exported")
+
+
+@mock.patch("module.pyrogram_extension.HookSession", new=MockSession)
+@mock.patch("module.pyrogram_extension.pyrogram.session.Auth", new=MockAuth)
+class MediaSessionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        MockAuth.created = 0
+
+    def tearDown(self):
+        self.loop.close()
+        self.temp_dir.cleanup()
+
+    def test_reuse_session(self):
+        client = MockClient(self.temp_dir.name)
+        pool = MediaSessionPool(client)
+
+        async def _run():
+            session = await pool.acquire(2)
+            self.assertEqual(session.auth_key, b"home auth key")
+            pool.release(session)
+            self.assertIs(await pool.acquire(2), session)
+
+            # busy sessions are not shared
+            other = await pool.acquire(2)
+            self.assertIsNot(other, session)
+
+        self.loop.run_until_complete(_run())
+        self.assertEqual(MockAuth.created, 0)
+        self.assertFalse(os.path.exists(pool.auth_file))
+
+    def test_authorize_once(self):
+        client = MockClient(self.temp_dir.name)
+        pool = MediaSessionPool(client)
+
+        async def _run():
+            sessions = await asyncio.gather(pool.acquire(4), pool.acquire(4))
+            self.assertEqual(sessions[0].auth_key, sessions[1].auth_key)
+            for session in sessions:
+                pool.release(session)
+
+        self.loop.run_until_complete(_run())
+        self.assertEqual(MockAuth.created, 1)
+        self.assertEqual(client.exported, 1)
+        self.assertTrue(os.path.exists(pool.auth_file))
+
+    def test_prewarm_from_last_run(self):
+        client = MockClient(self.temp_dir.name)
+        self.loop.run_until_complete(MediaSessionPool(client).acquire(4))
+
+        pool = MediaSessionPool(client)
+        self.loop.run_until_complete(pool.prewarm())
+        session = self.loop.run_until_complete(pool.acquire(4))
+        self.assertTrue(session.is_started)
+        self.assertEqual(session.auth_key, b"auth key 4")
+        self.assertEqual(MockAuth.created, 1)
+        self.assertEqual(client.exported, 1)
+
+        # a revoked key is authorized again
+        self.loop.run_until_complete(pool.discard(session))
+        self.assertFalse(session.is_started)
+        self.loop.run_until_complete(pool.acquire(4))
+        self.assertEqual(MockAuth.created, 2)
+
+    def test_discard_broken_session(self):
+        client = MockClient(self.temp_dir.name)
+        pool = MediaSessionPool(client)
+        session = self.loop.run_until_complete(pool.acquire(4))
+        self.loop.run_until_complete(pool.discard(session, key_revoked=False))
+        self.assertFalse(session.is_started)
+
+        # the auth key is still valid, the next session reuses it
+        other = self.loop.run_until_complete(pool.acquire(4))
+        self.assertIsNot(other, session)
+        self.assertEqual(MockAuth.created, 1)
+
+    def test_stop(self):
+        client = MockClient(self.temp_dir.name)
+        pool = MediaSessionPool(client)
+        session = self.loop.run_until_complete(pool.acquire(2))
+        idle = self.loop.run_until_complete(pool.acquire(2))
+        pool.release(idle)
+
+        self.loop.run_until_complete(pool.stop())
+        self.assertFalse(session.is_started)
+        self.assertFalse(idle.is_started)
+
+
+class HookClientGetFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _get_file(self, errors: list):
+        """Download a two chunk file, the session raises `errors` in turn"""
+        session = SimpleNamespace(dc_id=4)
+
+        async def _invoke(query, sleep_threshold=None):
+            error = errors.pop(0) if errors else None
+            if error:
+                raise error
+            return pyrogram.raw.types.upload.File(
+                type=pyrogram.raw.types.storage.FileUnknown(),
+                mtime=0,
+                bytes=b"a" * CHUNK_SIZE if query.offset == 0 else b"b",
+            )
+
+        session.invoke = _invoke
+        file_id = FileId(
+            file_type=FileType.DOCUMENT,
+            dc_id=4,
+            media_id=1,
+            access_hash=2,
+            file_reference=b"",
+        )
+        client = HookClient("test", in_memory=True)
+        client.media_session_pool = mock.Mock(
+            acquire=mock.AsyncMock(return_value=session), discard=mock.AsyncMock()
+        )
+
+        async def _run():
+            return [it async for it in client.get_file(file_id, CHUNK_SIZE + 1)]
+
+        return client.media_session_pool, session, _run
+
+    def test_unauthorized_after_first_chunk(self):
+        pool, session, run = self._get_file(
+            [None, pyrogram.errors.exceptions.unauthorized_401.AuthKeyUnregistered()]
+        )
+        with self.assertRaises(pyrogram.errors.Unauthorized):
+            self.loop.run_until_complete(run())
+        pool.discard.assert_awaited_once_with(session)
+        pool.release.assert_not_called()
+
+    def test_broken_session(self):
+        pool, session, run = self._get_file([OSError("connection lost")])
+        with self.assertRaises(OSError):
+            self.loop.run_until_complete(run())
+        pool.discard.assert_awaited_once_with(session, key_revoked=False)
+        pool.release.assert_not_called()
+
+    def test_rpc_error_keeps_session(self):
+        pool, session, run = self._get_file(
+            [pyrogram.errors.exceptions.flood_420.FloodWait(value=5)]
+        )
+        with self.assertRaises(pyrogram.errors.FloodWait):
+            self.loop.run_until_complete(run())
+        pool.discard.assert_not_called()
+        pool.release.assert_called_once_with(session)
@@ -0,0 +1,68 @@
+"""test message fetcher"""
+
+import asyncio
+import unittest
+
+from module.message_fetcher import BatchMessageFetcher
+
+from ..test_common import MockMessage
+
+
+class MockClient:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, list(message_ids)))
+        if self.fail:
+            raise ValueError("get messages failed")
+        return [MockMessage(id=it, chat_id=chat_id, empty=it < 0) for it in message_ids]
+
+
+class BatchMessageFetcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_fetch_batch(self):
+        fetcher = BatchMessageFetcher(window=0.01, batch_size=3)
+        client = MockClient()
+
+        async def _run():
+            return await asyncio.gather(
+                *[fetcher.fetch(client, -100, it) for it in (1, 2, 3, 4, -5)],
+                fetcher.fetch(client, -200, 1),
+            )
+
+        messages = self.loop.run_until_complete(_run())
+        self.assertEqual(
+            [it.id if it else None for it in messages[:5]], [1, 2, 3, 4, None]
+        )
+        self.assertEqual(messages[5].id, 1)
+        self.assertEqual(
+            sorted(client.calls),
+            [(-200, [1]), (-100, [1, 2, 3]), (-100, [4, -5])],
+        )
+
+    def test_fetch_error(self):
+        fetcher = BatchMessageFetcher(window=0.01)
+        client = MockClient(fail=True)
+
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(fetcher.fetch(client, -100, 1))
+
+    def test_iter_messages(self):
+        fetcher = BatchMessageFetcher(batch_size=200)
+        client = MockClient()
+
+        async def _run():
+            return [
+                it.id
+                async for it in fetcher.iter_messages(client, -100, list(range(450)))
+            ]
+
+        self.assertEqual(self.loop.run_until_complete(_run()), list(range(450)))
+        self.assertEqual([len(it[1]) for it in client.calls], [200, 200, 50])
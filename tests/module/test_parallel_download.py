@@ -0,0 +1,117 @@
+"""test parallel download"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pyrogram
+
+from module.parallel_download import (
+    CHUNK_SIZE,
+    download_segmented,
+    get_segment_count,
+    split_segments,
+)
+
+
+def _chunk_bytes(idx: int, size: int = CHUNK_SIZE) -> bytes:
+    return bytes([idx % 256]) * size
+
+
+class MockClient:
+    def __init__(self, file_size: int, fail_offset: int = -1):
+        self.file_size = file_size
+        self.fail_offset = fail_offset
+        self.calls = []
+
+    async def get_file(self, _file_id, _file_size, limit, offset):
+        self.calls.append((offset, limit))
+        for idx in range(offset, offset + limit):
+            if idx == self.fail_offset:
+                self.fail_offset = -1
+                raise pyrogram.errors.exceptions.flood_420.FloodWait(value=3)
+            await asyncio.sleep(0)
+            size = min(CHUNK_SIZE, self.file_size - idx * CHUNK_SIZE)
+            yield _chunk_bytes(idx, size)
+
+
+@mock.patch(
+    "module.parallel_download.FileId.decode",
+    new=lambda file_id: SimpleNamespace(media_id=1),
+)
+class ParallelDownloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.loop.close()
+        self.temp_dir.cleanup()
+
+    def test_get_segment_count(self):
+        mb = 1024 * 1024
+        self.assertEqual(get_segment_count(0, 4, 32 * mb), 1)
+        self.assertEqual(get_segment_count(10 * mb, 4, 32 * mb), 1)
+        self.assertEqual(get_segment_count(70 * mb, 4, 32 * mb), 2)
+        self.assertEqual(get_segment_count(2048 * mb, 4, 32 * mb), 4)
+        self.assertEqual(get_segment_count(2048 * mb, 1, 32 * mb), 1)
+
+    def test_split_segments(self):
+        self.assertEqual(split_segments(0, 4), [])
+        self.assertEqual(split_segments(CHUNK_SIZE * 10, 3), [(0, 4), (4, 3), (7, 3)])
+        # never more segments than chunks
+        self.assertEqual(split_segments(CHUNK_SIZE + 1, 8), [(0, 1), (1, 1)])
+
+    def test_download_segmented(self):
+        file_size = CHUNK_SIZE * 5 + 123
+        client = MockClient(file_size)
+        file_path = os.path.join(self.temp_dir.name, "sub", "video.mp4")
+        progress = []
+
+        async def _progress(current, total):
+            progress.append((current, total))
+
+        res = self.loop.run_until_complete(
+            download_segmented(
+                client, "file_id", file_size, file_path, 3, progress=_progress
+            )
+        )
+
+        self.assertEqual(res, file_path)
+        self.assertEqual(sorted(client.calls), [(0, 2), (2, 2), (4, 2)])
+        self.assertEqual(progress[-1], (file_size, file_size))
+        with open(file_path, "rb") as f:
+            data = f.read()
+        expected = b"".join(
+            _chunk_bytes(i, min(CHUNK_SIZE, file_size - i * CHUNK_SIZE))
+            for i in range(6)
+        )
+        self.assertEqual(data, expected)
+
+    def test_download_segmented_resume(self):
+        file_size = CHUNK_SIZE * 4
+        client = MockClient(file_size, fail_offset=3)
+        file_path = os.path.join(self.temp_dir.name, "video.mp4")
+
+        with self.assertRaises(pyrogram.errors.exceptions.flood_420.FloodWait):
+            self.loop.run_until_complete(
+                download_segmented(client, "file_id", file_size, file_path, 2)
+            )
+        # partial file and journal are kept for the next attempt
+        self.assertTrue(os.path.exists(file_path))
+        self.assertTrue(os.path.exists(file_path + ".journal"))
+
+        client.calls.clear()
+        res = self.loop.run_until_complete(
+            download_segmented(client, "file_id", file_size, file_path, 2)
+        )
+        self.assertEqual(res, file_path)
+        # only the missing chunk is fetched again
+        self.assertEqual(client.calls, [(3, 1)])
+        self.assertFalse(os.path.exists(file_path + ".journal"))
+        with open(file_path, "rb") as f:
+            data = f.read()
+        self.assertEqual(data, b"".join(_chunk_bytes(i) for i in range(4)))
@@ -0,0 +1,112 @@
+"""test rate limiter"""
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from module.rate_limiter import RateFamily, RateLimiter, TokenBucket, get_query_family
+
+
+class MockClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.clock = MockClock()
+        self.patchers = [
+            mock.patch("module.rate_limiter.time.monotonic", new=self.clock.monotonic),
+            mock.patch("module.rate_limiter.asyncio.sleep", new=self.clock.sleep),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.loop.close()
+
+    def test_get_query_family(self):
+        self.assertEqual(
+            get_query_family(SimpleNamespace(QUALNAME="functions.messages.SendMedia")),
+            RateFamily.Forward,
+        )
+        self.assertEqual(
+            get_query_family(SimpleNamespace(QUALNAME="functions.messages.GetHistory")),
+            RateFamily.History,
+        )
+        self.assertEqual(get_query_family(object()), RateFamily.Default)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2)
+        self.assertEqual(bucket.reserve(), 0)
+        # the next callers wait exactly for their token
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.assertEqual(bucket.reserve(), 1.0)
+
+        self.clock.now += 1.0
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        for _ in range(10):
+            self.assertEqual(bucket.reserve(), 0)
+
+    def test_acquire(self):
+        limiter = RateLimiter()
+        limiter.set_rate(RateFamily.Forward, 60, 30)
+
+        async def _run():
+            for _ in range(3):
+                await limiter.acquire(RateFamily.Forward, -100)
+
+        start = self.clock.now
+        self.loop.run_until_complete(_run())
+        # limited by the chat bucket: one call every 2 seconds
+        self.assertEqual(self.clock.now - start, 4)
+
+    def test_acquire_cancel(self):
+        limiter = RateLimiter()
+        limiter.flood_wait(RateFamily.Forward, 600)
+        start = self.clock.now
+
+        def cancel():
+            # the task is stopped while waiting
+            return self.clock.now - start >= 3
+
+        result = self.loop.run_until_complete(
+            limiter.acquire(RateFamily.Forward, cancel=cancel)
+        )
+        self.assertFalse(result)
+        self.assertEqual(self.clock.now - start, 3)
+
+        self.assertFalse(
+            self.loop.run_until_complete(
+                limiter.acquire(RateFamily.Forward, cancel=lambda: True)
+            )
+        )
+
+    def test_flood_wait(self):
+        limiter = RateLimiter()
+        limiter.flood_wait(RateFamily.History, 30)
+        limiter.flood_wait(RateFamily.History, 10)
+
+        start = self.clock.now
+        self.loop.run_until_complete(limiter.acquire(RateFamily.History))
+        self.assertEqual(self.clock.now - start, 30)
+
+        # other families are not paused
+        self.loop.run_until_complete(limiter.acquire(RateFamily.File))
+        self.assertEqual(self.clock.now - start, 30)
+
+        self.loop.run_until_complete(limiter.on_flood_wait(RateFamily.File, 5))
+        self.assertEqual(self.clock.now - start, 35)
@@ -0,0 +1,50 @@
+"""test retry queue"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from module.retry_queue import DelayedRetryQueue, get_backoff_delay
+
+
+class RetryQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_get_backoff_delay(self):
+        with mock.patch("module.retry_queue.random.uniform", new=lambda a, b: b):
+            self.assertEqual(get_backoff_delay(1, 3), 3)
+            self.assertEqual(get_backoff_delay(2, 3), 6)
+            self.assertEqual(get_backoff_delay(3, 3), 12)
+            self.assertEqual(get_backoff_delay(10, 3, 60), 60)
+
+        with mock.patch("module.retry_queue.random.uniform", new=lambda a, b: a):
+            self.assertEqual(get_backoff_delay(2, 3), 3)
+
+    def test_deadline_order(self):
+        async def _run():
+            retry_queue = DelayedRetryQueue()
+            await retry_queue.put("late", 0.05)
+            await retry_queue.put("now", 0)
+            self.assertEqual(len(retry_queue), 2)
+            self.assertEqual(await retry_queue.get(), "now")
+            self.assertEqual(await retry_queue.get(), "late")
+            self.assertEqual(len(retry_queue), 0)
+
+        self.loop.run_until_complete(_run())
+
+    def test_earlier_deadline_wakes_up(self):
+        async def _run():
+            retry_queue = DelayedRetryQueue()
+            await retry_queue.put("late", 10)
+            getter = asyncio.ensure_future(retry_queue.get())
+            await asyncio.sleep(0.01)
+            self.assertFalse(getter.done())
+
+            await retry_queue.put("soon", 0.01)
+            self.assertEqual(await asyncio.wait_for(getter, 1), "soon")
+
+        self.loop.run_until_complete(_run())
@@ -0,0 +1,24 @@
+"""test sqlite store"""
+
+import unittest
+
+from module.sqlite_store import SqliteStore
+
+
+class SqliteStoreTestCase(unittest.TestCase):
+    def test_create_tables_required(self):
+        class NoTables(SqliteStore):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoTables()
+
+        class Tables(SqliteStore):
+            def _create_tables(self, conn):
+                conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+
+        store = Tables()
+        self.assertEqual(
+            store.conn.execute("SELECT COUNT(*) FROM items").fetchone(), (0,)
+        )
+        store.close()
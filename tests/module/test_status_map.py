@@ -0,0 +1,49 @@
+"""test status map"""
+
+import unittest
+from enum import Enum
+
+from module.app import DownloadStatus, UploadStatus
+from module.status_map import StatusMap
+
+
+class StatusMapTestCase(unittest.TestCase):
+    def test_status_map(self):
+        status_map = StatusMap(DownloadStatus)
+        self.assertEqual(
+            status_map.get(1, DownloadStatus.Downloading), DownloadStatus.Downloading
+        )
+
+        status_map[1] = DownloadStatus.Downloading
+        status_map[1] = DownloadStatus.SuccessDownload
+        status_map[5000] = DownloadStatus.FailedDownload
+        status_map[3] = None
+
+        self.assertEqual(status_map[1], DownloadStatus.SuccessDownload)
+        self.assertIsNone(status_map.get(3, DownloadStatus.Downloading))
+        self.assertNotIn(2, status_map)
+        self.assertEqual(len(status_map), 3)
+        self.assertEqual(
+            list(status_map.items()),
+            [
+                (1, DownloadStatus.SuccessDownload),
+                (3, None),
+                (5000, DownloadStatus.FailedDownload),
+            ],
+        )
+
+        del status_map[5000]
+        self.assertNotIn(5000, status_map)
+        self.assertEqual(len(status_map), 2)
+        with self.assertRaises(KeyError):
+            del status_map[5000]
+
+        with self.assertRaises(ValueError):
+            status_map[2] = UploadStatus.SuccessUpload
+
+    def test_not_byte_status(self):
+        class Status(Enum):
+            Done = "done"
+
+        with self.assertRaises(ValueError):
+            StatusMap(Status)
@@ -0,0 +1,116 @@
+"""test task queue"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from module.app import TaskNode, TaskPriority, TaskType
+from module.task_queue import PriorityTaskQueue
+
+
+class PriorityTaskQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_default_priority(self):
+        self.assertEqual(TaskNode(1).priority, TaskPriority.Bulk)
+        self.assertEqual(TaskNode(1, bot=1, limit=1).priority, TaskPriority.Interactive)
+        self.assertEqual(TaskNode(1, bot=1, limit=100).priority, TaskPriority.Bulk)
+        self.assertEqual(
+            TaskNode(1, bot=1, task_type=TaskType.ListenForward).priority,
+            TaskPriority.ListenForward,
+        )
+        self.assertEqual(
+            TaskNode(1, priority=TaskPriority.Interactive).priority,
+            TaskPriority.Interactive,
+        )
+
+    def test_priority_order(self):
+        async def _run():
+            queue = PriorityTaskQueue()
+            await queue.put("bulk1", TaskPriority.Bulk)
+            await queue.put("bulk2", TaskPriority.Bulk)
+            await queue.put("listen", TaskPriority.ListenForward)
+            await queue.put("interactive", TaskPriority.Interactive)
+            return [await queue.get() for _ in range(4)]
+
+        self.assertEqual(
+            self.loop.run_until_complete(_run()),
+            ["interactive", "listen", "bulk1", "bulk2"],
+        )
+
+    def test_aging(self):
+        async def _run():
+            queue = PriorityTaskQueue(aging=10)
+            with mock.patch("module.task_queue.time.monotonic", return_value=0):
+                await queue.put("bulk", TaskPriority.Bulk)
+            with mock.patch("module.task_queue.time.monotonic", return_value=5):
+                await queue.put("listen", TaskPriority.ListenForward)
+            with mock.patch("module.task_queue.time.monotonic", return_value=25):
+                return [await queue.get() for _ in range(2)]
+
+        # bulk waited 25s and reached the listen forward class, it is older
+        self.assertEqual(self.loop.run_until_complete(_run()), ["bulk", "listen"])
+
+    def test_aging_never_overtakes_interactive(self):
+        async def _run():
+            queue = PriorityTaskQueue(aging=60)
+            with mock.patch("module.task_queue.time.monotonic", return_value=0):
+                for i in range(1000):
+                    await queue.put(f"bulk{i}", TaskPriority.Bulk)
+            with mock.patch("module.task_queue.time.monotonic", return_value=600):
+                await queue.put("interactive", TaskPriority.Interactive)
+                return await queue.get()
+
+        self.assertEqual(self.loop.run_until_complete(_run()), "interactive")
+
+    def test_full_class_does_not_block_others(self):
+        async def _run():
+            queue = PriorityTaskQueue(maxsize=1)
+            await queue.put("bulk1", TaskPriority.Bulk)
+            blocked = asyncio.ensure_future(queue.put("bulk2", TaskPriority.Bulk))
+            await asyncio.sleep(0)
+            self.assertFalse(blocked.done())
+
+            await asyncio.wait_for(
+                queue.put("interactive", TaskPriority.Interactive), 1
+            )
+            self.assertEqual(await queue.get(), "interactive")
+            self.assertEqual(await queue.get(), "bulk1")
+            await asyncio.wait_for(blocked, 1)
+            self.assertEqual(await queue.get(), "bulk2")
+
+        self.loop.run_until_complete(_run())
+
+    def test_dc_affinity(self):
+        async def _run(dc_batch_size: int):
+            queue = PriorityTaskQueue(dc_batch_size=dc_batch_size)
+            for i in range(4):
+                await queue.put(f"dc1_{i}", TaskPriority.Bulk, 1)
+                await queue.put(f"dc2_{i}", TaskPriority.Bulk, 2)
+            await queue.put("interactive", TaskPriority.Interactive, 4)
+            return [await queue.get() for _ in range(9)]
+
+        self.assertEqual(
+            self.loop.run_until_complete(_run(3)),
+            [
+                "interactive",
+                "dc1_0",
+                "dc1_1",
+                "dc1_2",
+                "dc2_0",
+                "dc2_1",
+                "dc2_2",
+                "dc1_3",
+                "dc2_3",
+            ],
+        )
+
+        # plain FIFO order
+        self.assertEqual(
+            self.loop.run_until_complete(_run(0))[1:5],
+            ["dc1_0", "dc2_0", "dc1_1", "dc2_1"],
+        )
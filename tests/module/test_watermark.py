@@ -0,0 +1,39 @@
+"""test watermark"""
+
+import unittest
+
+from module.watermark import MessageWatermark
+
+
+class MessageWatermarkTestCase(unittest.TestCase):
+    def test_finish_out_of_order(self):
+        watermark = MessageWatermark()
+        for message_id in (1, 2, 4, 5):
+            watermark.scan(message_id)
+
+        watermark.finish(2)
+        watermark.finish(5)
+        self.assertEqual(watermark.watermark, 0)
+        # 3 does not exist
+        self.assertEqual(watermark.finished.intervals, [[2, 3], [5, 5]])
+        self.assertTrue(watermark.is_finished(3))
+        self.assertFalse(watermark.is_finished(4))
+
+        watermark.finish(1)
+        self.assertEqual(watermark.watermark, 3)
+        watermark.finish(4)
+        self.assertEqual(watermark.watermark, 5)
+        self.assertFalse(watermark.finished)
+
+    def test_resume(self):
+        watermark = MessageWatermark(10, [[13, 15], [11, 11]])
+        self.assertEqual(watermark.watermark, 11)
+        self.assertEqual(watermark.finished.intervals, [[13, 15]])
+
+        watermark.scan(12)
+        watermark.finish(12)
+        self.assertEqual(watermark.watermark, 15)
+
+        # finished before the watermark, e.g. a retry
+        watermark.finish(3)
+        self.assertFalse(watermark.finished)
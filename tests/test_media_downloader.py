@@ -4,18 +4,25 @@ import os
 import platform
 import queue
 import sys
+import tempfile
 import unittest
 from datetime import datetime
 from typing import List, Union
 
 import mock
 import pyrogram
+from pyrogram.file_id import FileId, FileType
 
 from media_downloader import (
     _can_download,
     _check_config,
+    _fetch_task_message,
+    _get_download_path,
+    _get_history_range,
     _get_media_meta,
     _is_exist,
+    _link_stored_media,
+    _move_to_download_path,
     app,
     download_all_chat,
     download_media,
@@ -24,13 +31,25 @@ from media_downloader import (
     save_msg_to_file,
     worker,
 )
-from module.app import Application, DownloadStatus, TaskNode
+from module.app import (
+    Application,
+    ChatDownloadConfig,
+    DownloadStatus,
+    DownloadTaskItem,
+    TaskNode,
+)
+from module.client_pool import ClientPool
 from module.cloud_drive import CloudDriveConfig
+from module.download_state import DownloadStateStore
+from module.file_index import FileIndex
 from module.pyrogram_extension import (
     get_extension,
+    get_media_dc_id,
     record_download_status,
     reset_download_cache,
 )
+from module.rate_limiter import get_rate_limiter
+from module.retry_queue import RetryLaterError
 
 from .test_common import (
     Chat,
@@ -118,6 +137,7 @@ def rest_app(conf: dict):
     app.web_port: int = 5000
     app.config_file = "config_test.yaml"
     app.app_data_file = "data_test.yaml"
+    app.download_state = DownloadStateStore()
     app.config = conf
     app.assign_config(conf)
     app.assign_app_data(conf)
@@ -199,10 +219,6 @@ def mock_check_download_finish(media_size: int, download_path: str, ui_file_name
     pass
 
 
-async def new_fetch_message(client: pyrogram.Client, message: pyrogram.types.Message):
-    return message
-
-
 async def get_chat_history(client, *args, **kwargs):
     items = [
         MockMessage(
@@ -331,7 +347,7 @@ class MockClient:
     async def download_media(self, *args, **kwargs):
         mock_message = args[0]
         if mock_message.id in [7, 8]:
-            raise pyrogram.errors.exceptions.bad_request_400.BadRequest
+            raise pyrogram.errors.exceptions.bad_request_400.FileReferenceExpired
         elif mock_message.id == 9:
             raise pyrogram.errors.exceptions.unauthorized_401.Unauthorized
         elif mock_message.id == 11:
@@ -352,7 +368,6 @@ def check_for_updates(_: dict = None):
 
 @mock.patch("media_downloader.get_extension", new=get_extension)
 @mock.patch("module.pyrogram_extension.get_extension", new=get_extension)
-@mock.patch("media_downloader.fetch_message", new=new_fetch_message)
 @mock.patch("media_downloader.get_chat_history_v2", new=get_chat_history)
 @mock.patch("media_downloader.RETRY_TIME_OUT", new=0)
 @mock.patch("media_downloader.check_for_updates", new=check_for_updates)
@@ -702,12 +717,13 @@ class MediaDownloaderTestCase(unittest.TestCase):
                 mime_type="video/mov",
             ),
         )
-        result = self.loop.run_until_complete(
-            async_download_media(
-                client, message, ["video", "photo"], {"video": ["all"]}
+        with self.assertRaises(RetryLaterError) as retry_err:
+            self.loop.run_until_complete(
+                async_download_media(
+                    client, message, ["video", "photo"], {"video": ["all"]}
+                )
             )
-        )
-        self.assertEqual((DownloadStatus.FailedDownload, None), result)
+        self.assertIsNone(retry_err.exception.delay)
         mock_logger.warning.assert_called_with(
             "Message[7]: file reference expired, refetching..."
         )
@@ -721,14 +737,15 @@ class MediaDownloaderTestCase(unittest.TestCase):
                 mime_type="video/mov",
             ),
         )
-        result = self.loop.run_until_complete(
-            async_download_media(
-                client, message, ["video", "photo"], {"video": ["all"]}
+        with self.assertRaises(RetryLaterError) as retry_err:
+            self.loop.run_until_complete(
+                async_download_media(
+                    client, message, ["video", "photo"], {"video": ["all"]}
+                )
             )
-        )
-        self.assertEqual((DownloadStatus.FailedDownload, None), result)
-        mock_logger.error.assert_called_with(
-            "Message[8]: file reference expired for 3 retries, download skipped."
+        self.assertEqual(
+            retry_err.exception.reason,
+            "file reference expired for 3 retries, download skipped.",
         )
 
         # Test other exception
@@ -768,14 +785,15 @@ class MediaDownloaderTestCase(unittest.TestCase):
                 mime_type="video/mov",
             ),
         )
-        result = self.loop.run_until_complete(
-            async_download_media(
-                client, message, ["video", "photo"], {"video": ["all"]}
+        with self.assertRaises(RetryLaterError) as retry_err:
+            self.loop.run_until_complete(
+                async_download_media(
+                    client, message, ["video", "photo"], {"video": ["all"]}
+                )
             )
-        )
-        self.assertEqual((DownloadStatus.FailedDownload, None), result)
-        mock_logger.error.assert_called_with(
-            "Message[11]: Timing out after 3 reties, download skipped."
+        self.assertEqual(
+            retry_err.exception.reason,
+            "Timing out after 3 reties, download skipped.",
         )
 
         # Test file name with out suffix
@@ -809,13 +827,15 @@ class MediaDownloaderTestCase(unittest.TestCase):
                 mime_type="video/mov",
             ),
         )
-        result = self.loop.run_until_complete(
-            async_download_media(
-                client, message, ["video", "photo"], {"video": ["all"]}
+        with self.assertRaises(RetryLaterError) as retry_err:
+            self.loop.run_until_complete(
+                async_download_media(
+                    client, message, ["video", "photo"], {"video": ["all"]}
+                )
             )
-        )
-        self.assertEqual((DownloadStatus.FailedDownload, None), result)
+        self.assertEqual(retry_err.exception.delay, 420)
         mock_logger.warning.assert_called_with("Message[{}]: FlowWait {}", 420, 420)
+        get_rate_limiter().reset()
 
         # Test other Exception
         message = MockMessage(
@@ -850,7 +870,7 @@ class MediaDownloaderTestCase(unittest.TestCase):
         self.assertEqual((DownloadStatus.FailedDownload, None), result)
 
     @mock.patch("media_downloader.HookClient", new=MockClient)
-    @mock.patch("media_downloader.asyncio.Queue.put")
+    @mock.patch("media_downloader.PriorityTaskQueue.put")
     def test_download_task(self, moc_put):
         rest_app(MOCK_CONF)
         client = MockClient()
@@ -858,6 +878,199 @@ class MediaDownloaderTestCase(unittest.TestCase):
         self.loop.run_until_complete(download_all_chat(client))
         moc_put.assert_called()
 
+    def test_download_all_chat_concurrently(self):
+        rest_app(MOCK_CONF)
+        for chat_id in (1, 2, 3):
+            app.chat_download_config[chat_id] = ChatDownloadConfig()
+        app.max_scan_chats = 2
+        running = []
+        max_running = []
+
+        async def scan_chat(client, chat_download_config, node):
+            running.append(node.chat_id)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(node.chat_id)
+            if node.chat_id == 1:
+                raise ValueError("chat 1 failed")
+
+        with mock.patch("media_downloader.download_chat_task", new=scan_chat):
+            self.loop.run_until_complete(download_all_chat(MockClient()))
+
+        self.assertEqual(max(max_running), 2)
+        for value in app.chat_download_config.values():
+            self.assertTrue(value.need_check)
+
+    def test_get_history_range(self):
+        node = TaskNode(chat_id=1)
+        config = ChatDownloadConfig()
+        config.last_read_message_id = 10
+
+        async def get_message_id_by_date(client, chat_id, date):
+            return {datetime(2023, 1, 1): 500, datetime(2023, 2, 1, 0, 0, 1): 900}[date]
+
+        def get_range(download_filter):
+            config.download_filter = download_filter
+            return self.loop.run_until_complete(
+                _get_history_range(MockClient(), config, node)
+            )
+
+        with mock.patch(
+            "media_downloader.get_message_id_by_date", new=get_message_id_by_date
+        ):
+            self.assertEqual(get_range(None), (10, 0))
+            self.assertEqual(get_range("id >= 100 && id < 2000"), (100, 1999))
+            self.assertEqual(
+                get_range(
+                    "message_date >= 2023-01-01 00:00:00 "
+                    "&& message_date <= 2023-02-01 00:00:00"
+                ),
+                (501, 900),
+            )
+            self.assertEqual(get_range("id < 5"), None)
+            self.assertEqual(get_range("id < 1"), None)
+
+            node.end_offset_id = 50
+            self.assertEqual(get_range("id < 2000 && file_size > 1024"), (10, 50))
+
+    def test_fetch_task_message_retry(self):
+        client = MockClient()
+        item = DownloadTaskItem(chat_id=1, message_id=5, node=TaskNode(chat_id=1))
+        errors = [
+            (pyrogram.errors.exceptions.flood_420.FloodWait(value=30), 30),
+            (
+                pyrogram.errors.exceptions.internal_server_error_500.InternalServerError(),
+                None,
+            ),
+            (OSError("connection lost"), None),
+        ]
+        for error, delay in errors:
+            pool = ClientPool([client])
+            with mock.patch("media_downloader.get_file_reference_cache") as mock_cache:
+                mock_cache.return_value.fetch = mock.AsyncMock(side_effect=error)
+                with self.assertRaises(RetryLaterError) as retry_err:
+                    self.loop.run_until_complete(_fetch_task_message(pool, item))
+            self.assertEqual(retry_err.exception.delay, delay)
+            self.assertEqual(pool.load(client), 0)
+
+    def test_fetch_task_message_accounts(self):
+        main_client, extra_client = MockClient(), MockClient()
+        item = DownloadTaskItem(chat_id=1, message_id=5, node=TaskNode(chat_id=1))
+        message = MockMessage(id=5, media=True)
+
+        async def fetch_deleted(client, chat_id, message_id):
+            if client is extra_client:
+                return MockMessage(id=message_id, empty=True)
+            return message
+
+        async def fetch_no_access(client, chat_id, message_id):
+            if client is extra_client:
+                raise pyrogram.errors.exceptions.bad_request_400.ChannelInvalid()
+            return message
+
+        for fetch, hidden in ((fetch_deleted, False), (fetch_no_access, True)):
+            pool = ClientPool([main_client, extra_client])
+            pool.acquire(1)
+            with mock.patch("media_downloader.get_file_reference_cache") as mock_cache:
+                mock_cache.return_value.fetch = fetch
+                download_client, result = self.loop.run_until_complete(
+                    _fetch_task_message(pool, item)
+                )
+            # the extra account was selected, the main one has the message
+            self.assertIs(download_client, main_client)
+            self.assertIs(result, message)
+            self.assertEqual(pool.can_see(extra_client, 1), not hidden)
+            self.assertEqual(pool.load(extra_client), 0)
+
+    def test_fetch_task_message_forward(self):
+        main_client, extra_client = MockClient(), MockClient()
+        node = TaskNode(chat_id=1, upload_telegram_chat_id=2)
+        item = DownloadTaskItem(chat_id=1, message_id=5, node=node)
+        message = MockMessage(id=5, media=True)
+
+        pool = ClientPool([main_client, extra_client])
+        # the extra account is selected for other tasks
+        pool.acquire(1)
+        self.assertIs(pool.select(1), extra_client)
+        with mock.patch("media_downloader.get_file_reference_cache") as mock_cache:
+            mock_cache.return_value.fetch = mock.AsyncMock(return_value=message)
+            download_client, result = self.loop.run_until_complete(
+                _fetch_task_message(pool, item)
+            )
+        self.assertIs(download_client, main_client)
+        self.assertIs(result, message)
+        self.assertEqual(pool.load(main_client), 2)
+        self.assertEqual(pool.load(extra_client), 0)
+
+    def test_link_stored_media(self):
+        media = MockVideo(mime_type="video/mp4")
+        media.file_unique_id = "unique"
+        file_index = FileIndex()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stored = os.path.join(temp_dir, "chat1", "a.mp4")
+            reposted = os.path.join(temp_dir, "chat2", "a.mp4")
+            with mock.patch("media_downloader.get_file_index", return_value=file_index):
+                self.assertFalse(_link_stored_media(media, reposted, "a.mp4"))
+
+            os.makedirs(os.path.dirname(stored))
+            with open(stored, "wb") as f:
+                f.write(b"media")
+            file_index.add(stored, 5, file_unique_id="unique")
+
+            with mock.patch("media_downloader.get_file_index", return_value=file_index):
+                # linking is opt in
+                self.assertFalse(_link_stored_media(media, reposted, "a.mp4"))
+                app.dedup_link = "hardlink"
+                self.assertTrue(_link_stored_media(media, reposted, "a.mp4"))
+                app.dedup_link = ""
+            self.assertTrue(os.path.samefile(stored, reposted))
+            self.assertEqual(file_index.get(reposted).file_unique_id, "unique")
+
+    def test_download_in_place(self):
+        app.download_in_place = True
+        self.assertEqual(
+            _get_download_path("/save/a.mp4", "/temp/a.mp4"), "/save/a.mp4.part"
+        )
+        app.download_in_place = False
+        self.assertEqual(
+            _get_download_path("/save/a.mp4", "/temp/a.mp4"), "/temp/a.mp4"
+        )
+        app.download_in_place = True
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, "chat", "a.mp4")
+            partial_file_name = os.path.join(temp_dir, "a.mp4.part")
+            with open(partial_file_name, "wb") as f:
+                f.write(b"media")
+
+            with mock.patch("media_downloader.shutil.move") as mock_move:
+                _move_to_download_path(partial_file_name, file_name)
+                mock_move.assert_not_called()
+
+            self.assertFalse(os.path.exists(partial_file_name))
+            with open(file_name, "rb") as f:
+                self.assertEqual(f.read(), b"media")
+
+    def test_get_media_dc_id(self):
+        file_id = FileId(
+            file_type=FileType.VIDEO,
+            dc_id=4,
+            media_id=1,
+            access_hash=2,
+            file_reference=b"ref",
+        ).encode()
+        message = MockMessage(
+            id=1,
+            media=pyrogram.enums.MessageMediaType.VIDEO,
+            video=MockVideo(file_name="test.mp4", mime_type="video/mp4"),
+        )
+        message.video.file_id = file_id
+        self.assertEqual(get_media_dc_id(message), 4)
+
+        message.video.file_id = "broken"
+        self.assertEqual(get_media_dc_id(message), 0)
+        self.assertEqual(get_media_dc_id(MockMessage(id=2, media=None)), 0)
+
     def test_can_download(self):
         file_formats = {
             "audio": ["mp3"],
@@ -942,12 +1155,12 @@ class MediaDownloaderTestCase(unittest.TestCase):
         media_size = getattr(message.video, "file_size")
         self.assertEqual(media_size, 1024)
 
-        res = self.loop.run_until_complete(
-            async_download_media(
-                client, message, ["video", "photo"], {"video": ["mp4"]}
+        with self.assertRaises(RetryLaterError):
+            self.loop.run_until_complete(
+                async_download_media(
+                    client, message, ["video", "photo"], {"video": ["mp4"]}
+                )
             )
-        )
-        self.assertEqual(res, (DownloadStatus.FailedDownload, None))
 
         # 2. test sucess download
         rest_app(MOCK_CONF)
@@ -1042,7 +1255,9 @@ class MediaDownloaderTestCase(unittest.TestCase):
 
     def test_check_config_suc(self):
         app.update_config()
-        self.assertEqual(_check_config(), True)
+        # keep the download state in memory
+        with mock.patch.object(app.download_state, "open"):
+            self.assertEqual(_check_config(), True)
 
     # @mock.patch(
     #     "media_downloader.queue",
@@ -1,4 +1,5 @@
 """Unittest module for media downloader."""
+import errno
 import os
 import sys
 import tempfile
@@ -8,7 +9,13 @@ from pathlib import Path
 import mock
 
 sys.path.append("..")  # Adds higher directory to python modules path.
-from utils.file_management import get_next_name, manage_duplicate_file
+from utils.file_management import (
+    atomic_write,
+    get_next_name,
+    is_same_filesystem,
+    link_file,
+    manage_duplicate_file,
+)
 
 
 class FileManagementTestCase(unittest.TestCase):
@@ -35,6 +42,91 @@ class FileManagementTestCase(unittest.TestCase):
         result1 = manage_duplicate_file(self.test_file_copy_1)
         self.assertEqual(result1, self.test_file_copy_1)
 
+    def test_manage_duplicate_file_digest(self):
+        digests = {
+            self.test_file: "sha256:00",
+            self.test_file_copy_1: "sha256:aa",
+            self.test_file_copy_2: "sha256:bb",
+        }
+        with mock.patch("utils.file_management._get_file_md5") as mock_md5:
+            result = manage_duplicate_file(self.test_file_copy_2, digests.get)
+            self.assertEqual(result, self.test_file_copy_2)
+            mock_md5.assert_not_called()
+
+            digests[self.test_file_copy_2] = "sha256:aa"
+            result = manage_duplicate_file(self.test_file_copy_2, digests.get)
+            self.assertEqual(result, self.test_file_copy_1)
+            mock_md5.assert_not_called()
+
+    def test_is_same_filesystem(self):
+        self.assertTrue(
+            is_same_filesystem(self.test_file, os.path.join(self.this_dir, "a", "b"))
+        )
+
+        other_device = os.path.join(self.this_dir, "mnt")
+        with mock.patch(
+            "utils.file_management.os.path.exists", return_value=True
+        ), mock.patch("utils.file_management.os.stat") as mock_stat:
+            mock_stat.side_effect = lambda path: mock.Mock(
+                st_dev=1 if path == other_device else 2
+            )
+            self.assertFalse(is_same_filesystem(other_device, self.test_file))
+
+    def test_link_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dst = os.path.join(temp_dir, "hardlink", "file-test.txt")
+            link_file(self.test_file, dst, "hardlink")
+            with open(dst, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "dummy file")
+            self.assertTrue(os.path.samefile(self.test_file, dst))
+
+            with self.assertRaises(ValueError):
+                link_file(self.test_file, os.path.join(temp_dir, "copy"), "copy")
+
+    @unittest.skipIf(sys.platform == "win32", "symlinks need privileges on windows")
+    def test_symlink_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dst = os.path.join(temp_dir, "symlink", "file-test.txt")
+            link_file(self.test_file, dst, "symlink")
+            self.assertTrue(os.path.islink(dst))
+            with open(dst, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "dummy file")
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "data.yaml")
+            with atomic_write(file_path) as f:
+                f.write("old")
+
+            with self.assertRaises(ValueError):
+                with atomic_write(file_path) as f:
+                    f.write("new")
+                    raise ValueError
+
+            with open(file_path, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "old")
+            self.assertEqual(os.listdir(temp_dir), ["data.yaml"])
+
+            # a single file bind mount can not be replaced
+            with mock.patch(
+                "utils.file_management.os.replace",
+                side_effect=OSError(errno.EBUSY, "busy"),
+            ):
+                with atomic_write(file_path) as f:
+                    f.write("new")
+            with open(file_path, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "new")
+            self.assertEqual(os.listdir(temp_dir), ["data.yaml"])
+
+            with mock.patch(
+                "utils.file_management.os.replace",
+                side_effect=OSError(errno.EACCES, "denied"),
+            ):
+                with self.assertRaises(OSError):
+                    with atomic_write(file_path) as f:
+                        f.write("other")
+            self.assertEqual(os.listdir(temp_dir), ["data.yaml"])
+
     def tearDown(self):
         os.remove(self.test_file)
         os.remove(self.test_file_copy_1)
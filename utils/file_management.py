@@ -1,8 +1,13 @@
 """Utility functions to handle downloaded files."""
+import errno
 import glob
 import os
 import pathlib
+import shutil
+import sys
+from contextlib import contextmanager
 from hashlib import md5
+from typing import IO, Callable, Dict, Iterator, Optional
 
 
 def get_next_name(file_path: str) -> str:
@@ -40,12 +45,152 @@ def get_next_name(file_path: str) -> str:
     )
 
 
-def manage_duplicate_file(file_path: str):
+def is_same_filesystem(path: str, other_path: str) -> bool:
+    """
+    Check if two paths are on the same filesystem.
+
+    Paths that do not exist yet are checked by their nearest existing
+    parent, where they would be created.
+
+    Parameters
+    ----------
+    path: str
+        First path.
+
+    other_path: str
+        Second path.
+
+    Returns
+    -------
+    bool
+        True if a rename can move a file between the two paths.
+    """
+
+    def _get_device(file_path: str) -> int:
+        file_path = os.path.abspath(file_path)
+        while not os.path.exists(file_path):
+            parent = os.path.dirname(file_path)
+            if parent == file_path:
+                break
+            file_path = parent
+        return os.stat(file_path).st_dev
+
+    return _get_device(path) == _get_device(other_path)
+
+
+@contextmanager
+def atomic_write(file_path: str, encoding: str = "utf-8") -> Iterator[IO]:
+    """
+    Open a text file for writing that is replaced only when done.
+
+    The content is written to a temp file next to `file_path`, synced to
+    disk and renamed over it, so after a crash the file holds either the
+    old or the new content, never a part of it.
+
+    A file that can not be replaced, such as a single file bind mount of
+    docker, is written in place from the temp file instead.
+
+    Parameters
+    ----------
+    file_path: str
+        Path of the file to write.
+
+    encoding: str
+        Encoding of the file.
+    """
+    temp_path = f"{file_path}.tmp"
+    try:
+        with open(temp_path, "w", encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.replace(temp_path, file_path)
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            with open(temp_path, "rb") as src, open(file_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# linux ioctl cloning the blocks of a file, btrfs and xfs support it
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str):
+    """Clone `src` to `dst` sharing its blocks, `dst` is removed on failure"""
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only supported on linux", dst)
+
+    import fcntl  # pylint: disable = C0415
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def link_file(src: str, dst: str, method: str = "hardlink"):
+    """
+    Make `dst` show the content of the existing file `src` without a copy.
+
+    Parameters
+    ----------
+    src: str
+        Path of the existing file.
+
+    dst: str
+        Path to create, its directory is created if needed.
+
+    method: str
+        `hardlink`, `reflink` (copy on write clone, btrfs and xfs) or
+        `symlink`.
+
+    Raises
+    ------
+    OSError
+        If the filesystem does not support `method`, e.g. a hardlink
+        across filesystems.
+    """
+    directory = os.path.dirname(dst)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if method == "hardlink":
+        os.link(src, dst)
+    elif method == "reflink":
+        _reflink(src, dst)
+    elif method == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        raise ValueError(f"unknown link method {method}")
+
+
+def _get_file_md5(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Get the md5 of a file, reading it block by block"""
+    file_md5 = md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_md5.update(block)
+    return file_md5.hexdigest()
+
+
+def manage_duplicate_file(
+    file_path: str, get_digest: Optional[Callable[[str], Optional[str]]] = None
+):
     """
     Check if a file is duplicate.
 
-    Compare the md5 of files with copy name pattern
-    and remove if the md5 hash is same.
+    Compare the digests of files with copy name pattern
+    and remove if the digest is same.
 
     Parameters
     ----------
@@ -53,12 +198,16 @@ def manage_duplicate_file(file_path: str):
         Absolute path of the file for which duplicates needs to
         be managed.
 
+    get_digest: Optional[Callable[[str], Optional[str]]]
+        Get the digest recorded for a file while it downloaded, e.g.
+        `FileIndex.get_digest`, so the files are not read again. Files
+        without a recorded digest are read and compared by md5.
+
     Returns
     -------
     str
         Absolute path of the duplicate managed file.
     """
-    # pylint: disable = R1732
     posix_path = pathlib.Path(file_path)
     file_base_name: str = "".join(posix_path.stem.split("-copy")[0])
     name_pattern: str = f"{posix_path.parent}/{file_base_name}*"
@@ -69,10 +218,21 @@ def manage_duplicate_file(file_path: str):
     )
     if file_path in old_files:
         old_files.remove(file_path)
-    current_file_md5: str = md5(open(file_path, "rb").read()).hexdigest()
+    file_md5: Dict[str, str] = {}
+
+    def _get_md5(path: str) -> str:
+        if path not in file_md5:
+            file_md5[path] = _get_file_md5(path)
+        return file_md5[path]
+
+    current_digest = get_digest(file_path) if get_digest else None
     for old_file_path in old_files:
-        old_file_md5: str = md5(open(old_file_path, "rb").read()).hexdigest()
-        if current_file_md5 == old_file_md5:
+        old_digest = get_digest(old_file_path) if get_digest else None
+        if current_digest and old_digest:
+            is_same = current_digest == old_digest
+        else:
+            is_same = _get_md5(file_path) == _get_md5(old_file_path)
+        if is_same:
             os.remove(file_path)
             return old_file_path
     return file_path